@@ -0,0 +1,92 @@
+# __main__.py (flowsa)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Generates FlowBySector methods from the command line, or with --dry-run,
+explains what generating them involves without loading any data. Several
+methods, or glob patterns, are generated as a batch (see batch.py)
+EX: python -m flowsa Water_national_2015_m1 --dry-run
+EX: python -m flowsa "Employment_national_*" "GHG_national_*_m1"
+EX: python -m flowsa "Employment_national_{year}" --years 2015 2016 2017
+"""
+
+import argparse
+
+
+def parse_args(args=None):
+    """
+    Make method and generation parameters
+    :return: dictionary of arguments
+    """
+    ap = argparse.ArgumentParser(prog='python -m flowsa')
+    ap.add_argument("methods", nargs="+",
+                    help="Names of FlowBySector method yamls, or glob "
+                         "patterns matching them")
+    ap.add_argument("--dry-run", action="store_true",
+                    help="Describe the sources, attribution steps and local "
+                         "datasets of the method without generating it")
+    ap.add_argument("--external-config-path", default=None,
+                    help="Folder of the method yaml, if outside flowsa")
+    ap.add_argument("--download-sources-ok", action="store_true",
+                    help="Download missing source datasets from EPA's "
+                         "remote server before generating them")
+    ap.add_argument("--max-workers", type=int, default=1,
+                    help="Number of worker processes used to prepare "
+                         "sources")
+    ap.add_argument("--checkpoint", action="store_true",
+                    help="Write each source, once prepared, to a run "
+                         "directory, to be reused with --resume")
+    ap.add_argument("--resume", action="store_true",
+                    help="Reuse the sources completed by an earlier "
+                         "checkpointed run whose inputs are unchanged")
+    ap.add_argument("--spill", action="store_true",
+                    help="Write sources to disk as they are prepared and "
+                         "aggregate them in parts, to limit memory use")
+    ap.add_argument("--years", type=int, nargs="+", default=None,
+                    help="Years to generate together, of methods named "
+                         "with {year} in place of the year (see "
+                         "multiyear.py)")
+    return vars(ap.parse_args(args))
+
+
+def main(args=None):
+    args = parse_args(args)
+    if args['years'] and not args['dry_run']:
+        from flowsa.multiyear import generate_years
+        for method in args['methods']:
+            generate_years(method, args['years'],
+                           external_config_path=args['external_config_path'],
+                           download_sources_ok=args['download_sources_ok'],
+                           max_workers=args['max_workers'],
+                           checkpoint=args['checkpoint'],
+                           resume=args['resume'],
+                           spill=args['spill'])
+        return
+    from flowsa.batch import generate_batch, resolve_methods
+    if args['years']:
+        args['methods'] = [method.format(year=year)
+                           for method in args['methods']
+                           for year in args['years']]
+    methods = resolve_methods(args['methods'], args['external_config_path'])
+    kwargs = {'external_config_path': args['external_config_path'],
+              'download_sources_ok': args['download_sources_ok'],
+              'max_workers': args['max_workers'],
+              'checkpoint': args['checkpoint'],
+              'resume': args['resume'],
+              'spill': args['spill']}
+    if args['dry_run']:
+        from flowsa.dryrun import explain
+        for method in methods:
+            explain(method,
+                    external_config_path=args['external_config_path'])
+    elif args['methods'] == methods and len(methods) == 1:
+        from flowsa.flowbysector import FlowBySector
+        FlowBySector.generateFlowBySector(methods[0], **kwargs)
+    else:
+        summary = generate_batch(methods, **kwargs)
+        if (summary['status'] == 'failed').any():
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
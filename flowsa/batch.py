@@ -0,0 +1,144 @@
+"""
+Generates a batch of FlowBySector methods, such as every year of a family
+of methods, in one generation run, so that the datasets they load, the
+attribution sources they prepare and the tables they derive from reference
+data are shared between methods (see caching.py). A failure in one method
+does not stop the others. Run from the command line with, e.g.
+
+python -m flowsa "Employment_national_*"
+"""
+
+import fnmatch
+import os
+import time
+import pandas as pd
+from flowsa import caching, settings
+from flowsa.common import load_yaml_dict, seeAvailableFlowByModels
+from flowsa.flowsa_log import log
+
+
+def resolve_methods(methods, external_config_path: str = None) -> list:
+    """
+    Expands glob patterns (e.g. 'GHG_national_*_m1') into the names of the
+    available FlowBySector methods they match. Names without wildcards are
+    kept as given.
+    :param methods: str or list of str, method names or patterns
+    :param external_config_path: str, optional folder of method yamls
+        outside flowsa, also searched for matches
+    :return: list of str, method names, without duplicates, in the order
+        given (matches of a pattern are sorted)
+    """
+    if isinstance(methods, str):
+        methods = [methods]
+    available = seeAvailableFlowByModels('FBS', print_method=False)
+    if external_config_path is not None and os.path.isdir(
+            external_config_path):
+        available = available + [
+            os.path.splitext(f)[0] for f in os.listdir(external_config_path)
+            if f.endswith('.yaml')]
+    resolved = []
+    for method in methods:
+        if any(c in method for c in '*?['):
+            matches = sorted(fnmatch.filter(available, method))
+            if not matches:
+                log.warning('No FlowBySector methods match %s', method)
+            resolved.extend(matches)
+        else:
+            resolved.append(method)
+    return list(dict.fromkeys(resolved))
+
+
+def generate_batch(
+        methods,
+        external_config_path: str = None,
+        download_sources_ok: bool = settings.DEFAULT_DOWNLOAD_IF_MISSING,
+        max_workers: int = 1,
+        **kwargs
+) -> pd.DataFrame:
+    """
+    Generates a batch of FlowBySector methods in one generation run, in
+    which loaded datasets, prepared attribution and clean sources and
+    derived reference tables are cached and shared between methods. A
+    method that fails is logged and reported, and the batch moves on. A
+    method already written as one of the derived_outputs of an earlier
+    method in the batch is not generated again.
+    :param methods: str or list of str, method names or glob patterns
+        (see resolve_methods())
+    :param external_config_path: str, optional. If given, tells flowsa
+        where to look for the method yamls
+    :param download_sources_ok: bool, passed to generateFlowBySector()
+    :param max_workers: int, passed to generateFlowBySector()
+    :kwargs: keyword arguments passed to generateFlowBySector()
+    :return: df, one row per method, with its 'status' ('generated',
+        'derived' or 'failed'), 'seconds' taken, number of 'rows'
+        generated and 'error'
+    """
+    from flowsa.flowbysector import FlowBySector
+
+    methods = resolve_methods(methods, external_config_path)
+    # generate the methods with derived_outputs before the methods they
+    # derive
+    derived_from = {}
+    for method in methods:
+        try:
+            derived_outputs = load_yaml_dict(
+                method, 'FBS', external_config_path).get(
+                'derived_outputs', {})
+        except Exception:
+            # reported when the method is generated
+            continue
+        derived_from.update({name: method for name in derived_outputs
+                             if name in methods and name != method})
+    methods = sorted(methods, key=lambda m: m in derived_from)
+    log.info('Generating %s FlowBySector methods: %s', len(methods),
+             ', '.join(methods))
+    caches = {'loaded datasets': caching.loaded_datasets,
+              'prepared sources': caching.prepared_sources,
+              'reference tables': caching.reference_tables,
+              'reference data': caching.reference_data}
+    counts = {name: (cache.hits, cache.misses)
+              for name, cache in caches.items()}
+    summary = []
+    generated = set()
+    with caching.generation_run():
+        for method in methods:
+            if derived_from.get(method) in generated:
+                log.info('%s was derived from %s, skipping', method,
+                         derived_from[method])
+                summary.append({'method': method, 'status': 'derived',
+                                'seconds': 0., 'rows': None, 'error': None})
+                continue
+            start = time.perf_counter()
+            try:
+                fbs = FlowBySector.generateFlowBySector(
+                    method,
+                    external_config_path=external_config_path,
+                    download_sources_ok=download_sources_ok,
+                    max_workers=max_workers,
+                    **kwargs)
+            except Exception as e:
+                log.error('Generating %s failed: %s: %s', method,
+                          type(e).__name__, e)
+                summary.append({'method': method, 'status': 'failed',
+                                'seconds': time.perf_counter() - start,
+                                'rows': None,
+                                'error': f'{type(e).__name__}: {e}'})
+            else:
+                summary.append({'method': method, 'status': 'generated',
+                                'seconds': time.perf_counter() - start,
+                                'rows': len(fbs), 'error': None})
+                generated.add(method)
+        cache_stats = {
+            name: (f'{cache.hits - counts[name][0]} hits, '
+                   f'{cache.misses - counts[name][1]} misses')
+            for name, cache in caches.items()}
+
+    summary = pd.DataFrame(summary,
+                           columns=['method', 'status', 'seconds', 'rows',
+                                    'error'])
+    log.info('Batch complete: %s of %s methods generated\n%s',
+             (summary['status'] == 'generated').sum(), len(summary),
+             summary.round({'seconds': 1}).to_string(index=False))
+    log.info('Cache use: %s', '; '.join(f'{k}: {v}'
+                                        for k, v in cache_stats.items()))
+    return summary
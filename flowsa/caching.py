@@ -0,0 +1,348 @@
+"""
+Memory-bounded caches for data that is derived more than once during a
+flowsa run, such as attribution sources that are harmonized once and then
+used by many activity sets, and for reference data read from file, such
+as crosswalks, which is kept for the life of the process.
+"""
+
+import hashlib
+import inspect
+import os
+import shutil
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+from flowsa import settings
+
+
+def nbytes(value) -> int:
+    """
+    Approximate memory used by a cached value
+    :param value: df, or any other object
+    :return: int, bytes
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def fingerprint(df: pd.DataFrame, columns: list = None) -> str:
+    """
+    Hash of the values (not the index) of the given columns of df, used to
+    recognize the same data when it is loaded or generated more than once.
+    :param df: df
+    :param columns: list, columns to include. Columns not in df are
+        skipped. Defaults to all columns.
+    :return: str, hex digest
+    """
+    columns = [c for c in (columns or df.columns) if c in df.columns]
+    digest = hashlib.sha1(
+        repr([(c, str(df[c].dtype)) for c in columns]).encode())
+    digest.update(pd.util.hash_pandas_object(df[columns], index=False)
+                  .to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """
+    Dictionary-like cache holding at most max_bytes (as measured by
+    nbytes()) of values. When full, the least recently used values are
+    evicted first. Values larger than max_bytes are not cached.
+    """
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+
+    def __contains__(self, key) -> bool:
+        return key in self._values
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def get(self, key, default=None):
+        """
+        :param key: hashable
+        :param default: returned if key is not cached
+        :return: cached value, marked as most recently used
+        """
+        if key not in self._values:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._values.move_to_end(key)
+        return self._values[key][0]
+
+    def put(self, key, value) -> None:
+        """
+        Caches value under key, evicting least recently used values as
+        needed to stay within max_bytes.
+        :param key: hashable
+        :param value: value to cache
+        """
+        size = nbytes(value)
+        self.pop(key)
+        if size > self.max_bytes:
+            return
+        while self._values and self.current_bytes + size > self.max_bytes:
+            _, (_, evicted_size) = self._values.popitem(last=False)
+            self.current_bytes -= evicted_size
+        self._values[key] = (value, size)
+        self.current_bytes += size
+
+    def pop(self, key, default=None):
+        """
+        Removes key from the cache.
+        :return: the cached value, or default if key is not cached
+        """
+        if key not in self._values:
+            return default
+        value, size = self._values.pop(key)
+        self.current_bytes -= size
+        return value
+
+    def clear(self) -> None:
+        self._values.clear()
+        self.current_bytes = 0
+
+    def stats(self) -> dict:
+        """
+        :return: dict, number of cached 'entries', 'hits' and 'misses' so
+            far, and 'bytes' and 'max_bytes' of memory used
+        """
+        return {'entries': len(self._values), 'hits': self.hits,
+                'misses': self.misses, 'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes}
+
+
+class ReferenceDataCache(LRUCache):
+    """
+    Cache of reference data read from files, and of tables derived from
+    them, keyed by the path of each file and its modification time, so
+    that an entry is read again once its file changes. Entries are kept
+    between generation runs. Cached DataFrames are returned as copies, so
+    the cached frames are never modified by their callers. Tables cached
+    with persist=True are also saved to settings.referencecachepath, under
+    a hash of their key, the contents of the files they are built from and
+    the code building them, and reused by later processes.
+    """
+    @staticmethod
+    def _versions(paths) -> tuple:
+        versions = []
+        for path in paths:
+            stat = Path(path).stat()
+            versions.append((str(path), stat.st_mtime_ns, stat.st_size))
+        return tuple(versions)
+
+    def cached(self, key, paths, build, persist: bool = False):
+        """
+        Returns build(), cached under key until any of paths is modified.
+        :param key: hashable, identifying build()
+        :param paths: list of paths of the files read by build()
+        :param build: function without arguments
+        :param persist: bool, if True and settings.PERSIST_REFERENCE_CACHE,
+            also save a DataFrame returned by build() to disk, and load it
+            from there in later processes
+        :return: the value returned by build(), a copy if a DataFrame
+        """
+        versions = self._versions(paths)
+        entry = self._values.get(key)
+        if entry is not None and entry[0][0] == versions:
+            self.hits += 1
+            self._values.move_to_end(key)
+            value = entry[0][1]
+        else:
+            self.misses += 1
+            if persist and settings.PERSIST_REFERENCE_CACHE:
+                value = self._persisted(key, paths, build)
+            else:
+                value = build()
+            self.put(key, (versions, value))
+        return value.copy() if isinstance(value, pd.DataFrame) else value
+
+    @staticmethod
+    def _persisted(key, paths, build):
+        """
+        build(), loaded from settings.referencecachepath if saved there by
+        an earlier process, otherwise built and saved
+        """
+        from flowsa.incremental import file_hash
+        code = inspect.getsourcefile(build)
+        digest = hashlib.sha1(repr(
+            (key, [file_hash(p) for p in paths],
+             file_hash(code) if code else None)).encode()).hexdigest()
+        path = settings.referencecachepath / f'{digest}.pkl'
+        if path.exists():
+            try:
+                return pd.read_pickle(path)
+            except Exception:
+                # rebuilt below, e.g. if written by an interrupted process
+                pass
+        value = build()
+        if isinstance(value, pd.DataFrame):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            value.to_pickle(tmp)
+            os.replace(tmp, path)
+        return value
+
+    def read_csv(self, path, **kwargs) -> pd.DataFrame:
+        """
+        pd.read_csv(path, **kwargs), cached until the file is modified.
+        Csvs packaged in flowsa/data are read from the reference bundle
+        (see refbundle.py).
+        :param path: path of the csv
+        :kwargs: keyword arguments passed to pd.read_csv(), such as dtype
+        :return: df
+        """
+        from flowsa import refbundle
+        return self.cached(('read_csv', str(path), repr(sorted(
+            kwargs.items()))), [path],
+            lambda: refbundle.read_csv(path, **kwargs))
+
+    def invalidate(self, path=None, persisted: bool = False) -> None:
+        """
+        Removes the entries read from path, or every entry if path is None.
+        :param path: path of a file, optional
+        :param persisted: bool, if True, also delete the tables saved to
+            settings.referencecachepath
+        """
+        if persisted:
+            shutil.rmtree(settings.referencecachepath, ignore_errors=True)
+        if path is None:
+            self.clear()
+            return
+        for key in [key for key, ((versions, _), _)
+                    in self._values.items()
+                    if str(path) in (v[0] for v in versions)]:
+            self.pop(key)
+
+
+# Attribution sources as harmonized by _FlowBy.harmonize_geoscale(), keyed by
+# the fingerprint of the source and the harmonization settings
+harmonized_sources = LRUCache(settings.ATTRIBUTION_CACHE_MAX_BYTES)
+
+# Attribution and clean sources after prepare_fbs(), keyed by
+# planner.config_key() of the config they were loaded with
+prepared_sources = LRUCache(settings.PREPARED_SOURCE_CACHE_MAX_BYTES)
+
+# FlowByActivity and FlowBySector datasets as loaded from parquet, keyed by
+# category, name and folder
+loaded_datasets = LRUCache(settings.LOADED_DATASET_CACHE_MAX_BYTES)
+# (category, name) of the datasets loaded into loaded_datasets in this run,
+# evicted or not (see dataset_saved())
+_loaded_names = set()
+
+# Tables derived from reference data, such as flow mappings, keyed by the
+# function building them and its arguments
+reference_tables = LRUCache(settings.REFERENCE_TABLE_CACHE_MAX_BYTES)
+
+# Crosswalks and other reference data read from file, and tables derived
+# from them, for the life of the process (see ReferenceDataCache)
+reference_data = ReferenceDataCache(settings.REFERENCE_DATA_CACHE_MAX_BYTES)
+
+_open_runs = 0
+
+
+def stats() -> pd.DataFrame:
+    """
+    :return: df, one row per cache, with the statistics of
+        LRUCache.stats()
+    """
+    caches = {'harmonized_sources': harmonized_sources,
+              'prepared_sources': prepared_sources,
+              'loaded_datasets': loaded_datasets,
+              'reference_tables': reference_tables,
+              'reference_data': reference_data}
+    return pd.DataFrame([{'cache': name, **cache.stats()}
+                         for name, cache in caches.items()])
+
+
+def in_run() -> bool:
+    """
+    Whether a generation_run() is open, in which case data loaded or
+    derived more than once is cached until the run ends.
+    """
+    return _open_runs > 0
+
+
+def run_cached(cache: LRUCache, key, build):
+    """
+    Returns build(), cached in cache under key while a generation_run() is
+    open. DataFrames are returned as copies, so that callers can modify
+    them without changing the cached value.
+    :param cache: LRUCache
+    :param key: hashable
+    :param build: function without arguments
+    :return: the value returned by build()
+    """
+    if not in_run():
+        return build()
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.put(key, value)
+    return value.copy() if isinstance(value, pd.DataFrame) else value
+
+
+def dataset_loaded(key: tuple, df: pd.DataFrame) -> None:
+    """
+    Caches a dataset loaded from file in loaded_datasets, if a
+    generation_run() is open.
+    :param key: tuple, (category, name, folder) of the dataset
+    :param df: df, as loaded
+    """
+    if in_run():
+        loaded_datasets.put(key, df)
+        _loaded_names.add(key[:2])
+
+
+def dataset_saved(category: str, name: str) -> None:
+    """
+    Drops what a run has cached of a dataset that is saved again, e.g. an
+    FBS regenerated by a batch after an earlier method of the batch loaded
+    it as a source: its loaded copies, and, as they may have been derived
+    from it, the prepared and harmonized sources.
+    :param category: str, 'FlowBySector' or 'FlowByActivity'
+    :param name: str, name of the dataset
+    """
+    from flowsa.flowsa_log import log
+
+    if (category, name) not in _loaded_names:
+        return
+    _loaded_names.discard((category, name))
+    for key in [k for k in loaded_datasets._values
+                if k[:2] == (category, name)]:
+        loaded_datasets.pop(key)
+    log.info('%s %s was loaded earlier in this run; dropping the sources '
+             'prepared from it', name, category)
+    prepared_sources.clear()
+    harmonized_sources.clear()
+
+
+@contextmanager
+def generation_run():
+    """
+    Context for generating one or more FlowBySector datasets. Data cached
+    while generating are kept until the outermost generation ends, so an
+    FBS generated while preparing the sources of another FBS does not clear
+    the caches of the enclosing run, and a batch of methods generated in
+    one run share the data they have in common.
+    """
+    global _open_runs
+    _open_runs += 1
+    try:
+        yield
+    finally:
+        _open_runs -= 1
+        if _open_runs == 0:
+            for cache in [harmonized_sources, prepared_sources,
+                          loaded_datasets, reference_tables]:
+                cache.clear()
+            _loaded_names.clear()
@@ -0,0 +1,95 @@
+"""
+Checkpoints of FlowBySector generation. Each source of a method, once
+prepared, is written to a run directory (settings.checkpointpath / method)
+along with a manifest recording the fingerprint of its inputs (see
+incremental.source_key()). A run resumed after a failure reuses the sources
+whose inputs are unchanged and prepares only the others.
+"""
+
+import json
+import os
+import shutil
+import pandas as pd
+from flowsa import incremental, settings
+from flowsa.flowsa_log import log
+
+MANIFEST = 'manifest.json'
+
+
+class CheckpointRun:
+    """
+    Run directory of a FlowBySector method, holding the prepared sources
+    completed so far and a manifest describing them.
+    """
+    def __init__(self, method: str, resume: bool = False,
+                 prepare_kwargs: dict = None) -> None:
+        """
+        :param method: str, name of the FlowBySector method
+        :param resume: bool, if True, keep the sources completed by an
+            earlier run of the method. Otherwise, start from an empty run
+            directory.
+        :param prepare_kwargs: dict, keyword arguments passed to
+            prepare_fbs() that change its result
+        """
+        self.method = method
+        self.path = settings.checkpointpath / method
+        self.prepare_kwargs = prepare_kwargs or {}
+        if not resume and self.path.exists():
+            shutil.rmtree(self.path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.manifest = {'method': method, 'sources': {}}
+        if resume and (self.path / MANIFEST).exists():
+            with open(self.path / MANIFEST, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+
+    def _file(self, name: str) -> str:
+        return f'{name}.parquet'
+
+    def completed(self, name: str, config: dict) -> bool:
+        """
+        Whether a source was completed by an earlier run with the same
+        inputs, so that it can be loaded rather than prepared again.
+        :param name: str, source name
+        :param config: dict, source config
+        :return: bool
+        """
+        entry = self.manifest['sources'].get(name)
+        if entry is None or not (self.path / entry['file']).exists():
+            return False
+        key = incremental.source_key(name, config, self.prepare_kwargs)
+        if key is None or key != entry['key']:
+            log.info('Inputs of %s changed since it was checkpointed, '
+                     'preparing it again', name)
+            return False
+        return True
+
+    def save(self, name: str, config: dict, fbs) -> None:
+        """
+        Writes a prepared source and records it in the manifest.
+        :param name: str, source name
+        :param config: dict, source config
+        :param fbs: FlowBySector, prepared source
+        """
+        fbs.to_parquet(self.path / self._file(name), index=False)
+        self.manifest['sources'][name] = {
+            'key': incremental.source_key(name, config, self.prepare_kwargs),
+            'file': self._file(name),
+            'completed': pd.to_datetime('today').strftime(
+                '%Y-%m-%d %H:%M:%S')
+        }
+        manifest_path = self.path / MANIFEST
+        with open(f'{manifest_path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+        log.info('Checkpointed %s to %s', name, self.path)
+
+    def load(self, name: str, config: dict):
+        """
+        :param name: str, source name
+        :param config: dict, source config
+        :return: FlowBySector, the source as saved by save()
+        """
+        from flowsa.flowbysector import FlowBySector
+        entry = self.manifest['sources'][name]
+        return FlowBySector(pd.read_parquet(self.path / entry['file']),
+                            full_name=name, config=config)
@@ -7,6 +7,7 @@
 import os
 import pprint
 from os import path
+from pathlib import Path
 import re
 import yaml
 import pandas as pd
@@ -15,13 +16,14 @@ from copy import deepcopy
 from dotenv import load_dotenv
 import flowsa.flowsa_yaml as flowsa_yaml
 import flowsa.exceptions
+from flowsa import caching
 from flowsa.flowsa_log import log
 from flowsa.schema import flow_by_activity_fields, flow_by_sector_fields, \
     flow_by_sector_collapsed_fields, flow_by_activity_mapped_fields, \
     flow_by_activity_wsec_fields, flow_by_activity_mapped_wsec_fields, \
     activity_fields
 from flowsa.settings import datapath, MODULEPATH, \
-    sourceconfigpath, flowbysectormethodpath, methodpath
+    sourceconfigpath, flowbysectormethodpath, methodpath, paths
 
 
 # Sets default Sector Source Name
@@ -82,23 +84,29 @@ def load_crosswalk(crosswalk_name):
     :return: df, NAICS crosswalk over the years
     """
 
-    cw = pd.read_csv(datapath / f'{crosswalk_name}.csv', dtype="str")
+    cw = caching.reference_data.read_csv(datapath / f'{crosswalk_name}.csv',
+                                         dtype="str")
 
     return cw
 
 
 def load_sector_length_cw_melt(year='2012'):
-    cw_load = load_crosswalk(f'NAICS_{year}_Crosswalk')
-    cw_melt = cw_load.melt(var_name="SectorLength", value_name='Sector'
-                           ).drop_duplicates().reset_index(drop=True)
-    cw_melt = cw_melt.dropna().reset_index(drop=True)
-    cw_melt['SectorLength'] = cw_melt['SectorLength'].str.replace(
-        'NAICS_', "")
-    cw_melt['SectorLength'] = pd.to_numeric(cw_melt['SectorLength'])
+    def melt():
+        cw_load = load_crosswalk(f'NAICS_{year}_Crosswalk')
+        cw_melt = cw_load.melt(var_name="SectorLength", value_name='Sector'
+                               ).drop_duplicates().reset_index(drop=True)
+        cw_melt = cw_melt.dropna().reset_index(drop=True)
+        cw_melt['SectorLength'] = cw_melt['SectorLength'].str.replace(
+            'NAICS_', "")
+        cw_melt['SectorLength'] = pd.to_numeric(cw_melt['SectorLength'])
 
-    cw_melt = cw_melt[['Sector', 'SectorLength']]
+        cw_melt = cw_melt[['Sector', 'SectorLength']]
 
-    return cw_melt
+        return cw_melt
+
+    return caching.reference_data.cached(
+        ('load_sector_length_cw_melt', str(year)),
+        [datapath / f'NAICS_{year}_Crosswalk.csv'], melt)
 
 
 def return_bea_codes_used_as_naics():
@@ -156,8 +164,7 @@ def load_yaml_dict(filename, flowbytype=None, filepath=None, **kwargs):
     yaml_path = f'{folder}/{filename}.yaml'
 
     try:
-        with open(yaml_path, 'r', encoding='utf-8') as f:
-            config = flowsa_yaml.load(f, filepath)
+        config = flowsa_yaml.load_file(yaml_path, filepath)
     except FileNotFoundError:
         if 'config' in kwargs:
             return deepcopy(kwargs['config'])
@@ -289,10 +296,8 @@ def return_true_source_catalog_name(sourcename):
     """
     Drop any extensions on source name until find the name in source catalog
     """
-    while (load_yaml_dict('source_catalog').get(sourcename) is None) & (
-            '_' in sourcename):
-        sourcename = sourcename.rsplit("_", 1)[0]
-    return sourcename
+    from flowsa import registry
+    return registry.catalog_name(sourcename)
 
 
 def str2bool(v):
@@ -311,10 +316,8 @@ def str2bool(v):
 
 def check_method_status():
     """Read the current method status"""
-    yaml_path = methodpath / 'method_status.yaml'
-    with open(yaml_path, 'r') as f:
-        method_status = yaml.safe_load(f)
-    return method_status
+    from flowsa import registry
+    return registry.method_status()
 
 
 def get_catalog_info(source_name: str) -> dict:
@@ -322,9 +325,55 @@ def get_catalog_info(source_name: str) -> dict:
     Retrieves the information on a given source from source_catalog.yaml.
     Replaces various pieces of code that load the source_catalog yaml.
     '''
-    source_catalog = load_yaml_dict('source_catalog')
-    source_name = return_true_source_catalog_name(source_name)
-    return source_catalog.get(source_name, {})
+    from flowsa import registry
+    return registry.catalog_entry(source_name)
+
+
+def local_dataset(name: str, config: dict) -> dict:
+    """
+    Looks for the most recent locally stored parquet of a FlowByActivity or
+    FlowBySector dataset, as loaded by get_flowby_from_config().
+    :param name: str, source name
+    :param config: dict, source config
+    :return: dict, with the 'file' name of the dataset, the 'path' of the
+        local parquet (None if not found), and its number of 'rows' (None if
+        not found or not readable)
+    """
+    if config.get('data_format') == 'FBA':
+        year = config.get('year')
+        file_name = name if year is None else f'{name}_{year}'
+        category = 'FlowByActivity'
+    elif config.get('data_format') == 'FBS':
+        file_name = name
+        category = 'FlowBySector'
+    else:
+        return {'file': None, 'path': None, 'rows': None}
+
+    folder = (Path(config.get('external_data_path')
+                   or paths.local_path) / category)
+    candidates = []
+    if folder.is_dir():
+        candidates = [f for f in os.scandir(folder)
+                      if f.name.endswith('.parquet')
+                      and (f.name.startswith(f'{file_name}_v')
+                           or f.name == f'{file_name}.parquet')]
+    if not candidates:
+        return {'file': file_name, 'path': None, 'rows': None}
+    path = max(candidates, key=lambda f: f.stat().st_mtime).path
+    return {'file': file_name, 'path': path, 'rows': parquet_rows(path)}
+
+
+def parquet_rows(path: str) -> int:
+    """
+    Number of rows of a parquet file, read from its metadata
+    :param path: str, path to parquet
+    :return: int, or None if the metadata can not be read
+    """
+    try:
+        import pyarrow.parquet
+        return pyarrow.parquet.read_metadata(path).num_rows
+    except Exception:
+        return None
 
 
 def seeAvailableFlowByModels(flowbytype, print_method=True):
@@ -335,36 +384,17 @@ def seeAvailableFlowByModels(flowbytype, print_method=True):
     :return: dict or list of available models
     """
 
-    # fb directory contents dependent on FBA or FBS
+    from flowsa import registry
+
+    # methods in the FBA or FBS directory, excluding common and
+    # summary_target files, with the years of each FBA
     if flowbytype == 'FBA':
-        fb_dir = os.listdir(sourceconfigpath)
+        data_print = registry.fba_years()
     elif flowbytype == 'FBS':
-        fb_dir = os.listdir(flowbysectormethodpath)
+        data_print = registry.fbs_methods()
     else:
         raise ValueError("flowbytype must be 'FBA' or 'FBS'")
 
-    # list of file names (drop extension) for yaml files in flow directory
-    fb_names = [os.path.splitext(f)[0] for f in fb_dir if f.endswith('.yaml')]
-
-    # further reduce list of file names by excluding common and summary_target
-    exclude = ["_common", "_Common", "_target"]
-    fb_names = [f for f in fb_names if all(s not in f for s in exclude)]
-
-    if flowbytype == 'FBA':
-        # create empty dictionary, this will be the data format to print FBA
-        data_print = {}
-        # iterate over names to build dict for FBA and handling years
-        for f in fb_names:
-            s = load_yaml_dict(f, 'FBA')
-            try:
-                years = s['years']
-            except KeyError:
-                years = 'YAML missing information on years'
-            data_print.update({f: years})
-    else:
-        # data format to print FBS
-        data_print = fb_names
-
     if print_method:
         # print data in human-readable format
         pprint.pprint(data_print, width=79, compact=True)
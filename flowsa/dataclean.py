@@ -7,7 +7,7 @@ Common functions to clean and harmonize dataframes
 
 import pandas as pd
 import numpy as np
-from flowsa import (literature_values, settings, flowsa_log)
+from flowsa import (caching, literature_values, settings, flowsa_log)
 
 
 def clean_df(df, flowbyfields, drop_description=True):
@@ -87,7 +87,8 @@ def standardize_units(df):
     )
 
     conversion_table = pd.concat([
-        pd.read_csv(settings.datapath / 'unit_conversion.csv'),
+        caching.reference_data.read_csv(
+            settings.datapath / 'unit_conversion.csv'),
         pd.Series({'old_unit': 'Canadian Dollar',
                    'new_unit': 'USD',
                    'conversion_factor': 1 / exchange_rate}).to_frame().T
@@ -0,0 +1,358 @@
+"""
+Explains a FlowBySector method without generating it: the sources, activity
+sets, attribution steps and function sockets it uses, which of the datasets
+it loads are already stored locally, and estimates of their size. Run from
+the command line with, e.g.
+
+python -m flowsa Water_national_2015_m1 --dry-run
+"""
+
+from flowsa import common, geo, naics, planner
+
+# geoscales at which joining an attribution source is flagged by explain()
+_JOIN_WARNING_GEOSCALES = ['county']
+
+
+def sector_fan_out(industry_spec: dict, year: int) -> dict:
+    """
+    Number of target sectors each source NAICS code is mapped to by
+    naics.industry_spec_key(), by length of the source code. A code shorter
+    than the target level is divided among (and its rows multiplied by) all
+    of the target sectors it contains.
+    :param industry_spec: dict, as in the method yaml
+    :param year: int, target_naics_year
+    :return: dict, {source code length: {'codes': number of source codes,
+        'mean': mean number of targets, 'max': max number of targets}}
+    """
+    naics_key = naics.industry_spec_key(industry_spec, year)
+    targets = naics_key.groupby('source_naics').size()
+    targets = targets[targets.index.str.isdigit()]
+    fan_out = targets.groupby(targets.index.str.len()).agg(
+        ['size', 'mean', 'max'])
+    return {int(length): {'codes': int(row['size']),
+                          'mean': round(float(row['mean']), 2),
+                          'max': int(row['max'])}
+            for length, row in fan_out.iterrows()}
+
+
+def attributed_rows(rows: int, fan_out: dict) -> int:
+    """
+    Estimated number of rows of a source once attributed to target sectors:
+    its rows times the mean number of target sectors per source NAICS code,
+    over all source code lengths
+    :param rows: int, rows of the source, or None if not known
+    :param fan_out: dict, as returned by sector_fan_out()
+    :return: int, or None if rows or fan_out are not known
+    """
+    codes = sum(f['codes'] for f in fan_out.values())
+    if rows is None or not codes:
+        return None
+    mean = sum(f['codes'] * f['mean'] for f in fan_out.values()) / codes
+    return round(rows * mean)
+
+
+def location_count(geoscale: str) -> int:
+    """
+    Number of FIPS codes at a geoscale
+    :param geoscale: str, e.g. 'state'
+    :return: int, or None for geoscales without FIPS codes
+    """
+    scale = geo.scale.from_string(geoscale)
+    if not scale.has_fips_level:
+        return None
+    return len(geo.filtered_fips(scale))
+
+
+def function_sockets(config: dict) -> dict:
+    """
+    Functions assigned in a config, e.g. with !script_function
+    :param config: dict
+    :return: dict, {config key: qualified function name}
+    """
+    return {k: f'{v.__module__}.{getattr(v, "__qualname__", v.__name__)}'
+            for k, v in config.items() if callable(v)}
+
+
+def _attribution_steps(yaml_config: dict, config: dict) -> list:
+    """
+    The attribution steps of a source or activity set. config is the full
+    config of the source or activity set, yaml_config only the keys given
+    for it in the method yaml.
+    """
+    steps = yaml_config.get('attribute', yaml_config)
+    steps = [steps] if isinstance(steps, dict) else steps
+    parent_config = {k: v for k, v in config.items()
+                     if k not in planner._NOT_INHERITED
+                     and not k.startswith('_')}
+    explained = []
+    for step in steps:
+        step_config = {**parent_config, **step}
+        explained_step = {
+            'attribution_method': step.get('attribution_method', 'direct'),
+            'attribute_on': step.get('attribute_on'),
+            'fill_columns': step.get('fill_columns'),
+            'attribution_source': None,
+        }
+        if 'attribution_source' in step:
+            name, source_yaml = planner._name_and_config(
+                step['attribution_source'])
+            source_config = planner.source_config(step_config, name,
+                                                  source_yaml)
+            explained_step['attribution_source'] = _dataset(
+                name, source_config, source_yaml,
+                cached=name in (config.get('cache') or {}))
+            explained_step['join_geoscale'] = _join_geoscale(
+                config.get('geoscale'), source_config.get('geoscale'))
+        explained.append(explained_step)
+    return explained
+
+
+def _join_geoscale(fb_geoscale: str, other_geoscale: str) -> str:
+    """
+    Geoscale at which an attribution source is joined to the data it
+    attributes (see _FlowBy.harmonize_geoscale())
+    """
+    if fb_geoscale is None or other_geoscale is None:
+        return None
+    return max(geo.scale.from_string(fb_geoscale),
+               geo.scale.from_string(other_geoscale)).name.lower()
+
+
+def _clean_source(yaml_config: dict, config: dict) -> dict:
+    """
+    {'clean_source': explained clean source}, if one is given in yaml_config
+    """
+    if 'clean_source' not in yaml_config:
+        return {}
+    name, clean_yaml = planner._name_and_config(yaml_config['clean_source'])
+    return {'clean_source': _dataset(
+        name, planner.source_config(config, name, clean_yaml), clean_yaml)}
+
+
+def _dataset(name: str, config: dict, yaml_config: dict,
+             cached: bool = False) -> dict:
+    """
+    Explains a primary, attribution or clean source loaded with config,
+    including its own clean source and attribution steps.
+    """
+    explained = {
+        'name': name,
+        'data_format': config.get('data_format'),
+        'year': config.get('year'),
+        'geoscale': config.get('geoscale'),
+        'cached': cached,
+        **common.local_dataset(name, config),
+        'function_sockets': function_sockets(yaml_config),
+    }
+    if cached:
+        # loaded from sources_to_cache, already prepared
+        return explained
+    explained.update(_clean_source(yaml_config, config))
+    if 'activity_sets' in config:
+        parent_config = {k: v for k, v in config.items()
+                         if k not in planner._NOT_INHERITED
+                         and not k.startswith('_')}
+        explained['activity_sets'] = {}
+        for activity_set, activity_config in config['activity_sets'].items():
+            full_config = {**parent_config, **activity_config}
+            explained['activity_sets'][activity_set] = {
+                'function_sockets': function_sockets(activity_config),
+                **_clean_source(activity_config, full_config),
+                'attribution': _attribution_steps(activity_config,
+                                                  full_config)
+            }
+    else:
+        explained['attribution'] = _attribution_steps(yaml_config, config)
+    return explained
+
+
+def explain(
+        method: str,
+        external_config_path: str = None,
+        print_report: bool = True,
+        **kwargs
+) -> dict:
+    """
+    Describes what generating a FlowBySector method involves, without
+    loading or generating any data: its sources, activity sets, attribution
+    steps and function sockets, which datasets are already stored locally
+    (and would otherwise be downloaded or generated), their size, and how
+    many target sectors source sectors are mapped to, and so about how many
+    rows each source has once attributed.
+    :param method: str, name of FlowBySector method .yaml file
+    :param external_config_path: str, optional. If given, tells flowsa
+        where to look for the method yaml
+    :param print_report: bool, False to skip printing to console
+    :kwargs: keyword arguments to pass to load_yaml_dict()
+    :return: dict
+    """
+    method_config = common.load_yaml_dict(method, 'FBS',
+                                          external_config_path, **kwargs)
+    to_cache = method_config.pop('sources_to_cache', {})
+    sources = method_config.pop('source_names')
+    method_config['cache'] = {}
+
+    def full_config(name, config):
+        return {**method_config,
+                'method_config_keys': set(method_config.keys()),
+                **common.get_catalog_info(name),
+                **config}
+
+    cached_sources = []
+    for name, config in to_cache.items():
+        cached_sources.append(
+            _dataset(name, full_config(name, config), config))
+        method_config['cache'][name] = None
+
+    plan = planner.plan_method(method_config, sources)
+    report = {
+        'method': method,
+        'target_naics_year': method_config.get('target_naics_year'),
+        'industry_spec': method_config.get('industry_spec'),
+        'geoscale': method_config.get('geoscale'),
+        'sources_to_cache': cached_sources,
+        'source_names': [_dataset(name, full_config(name, config or {}),
+                                  config or {})
+                         for name, config in sources.items()],
+        'unique_datasets': len(plan.nodes) + len(cached_sources),
+        'sector_fan_out': (
+            sector_fan_out(method_config['industry_spec'],
+                           method_config['target_naics_year'])
+            if 'industry_spec' in method_config else {}),
+    }
+    for dataset in report['source_names']:
+        dataset['attributed_rows'] = attributed_rows(
+            dataset['rows'], report['sector_fan_out'])
+    report['attributed_rows'] = sum(
+        d['attributed_rows'] or 0 for d in report['source_names'])
+    report['warnings'] = _warnings(report)
+    if print_report:
+        print(format_report(report))
+    return report
+
+
+def _walk(report: dict):
+    """Yields every dataset in a report, with the attribution step (or None)
+    through which it is loaded"""
+    def walk_dataset(dataset, step=None):
+        yield dataset, step
+        if 'clean_source' in dataset:
+            yield from walk_dataset(dataset['clean_source'])
+        for aset in dataset.get('activity_sets', {}).values():
+            if 'clean_source' in aset:
+                yield from walk_dataset(aset['clean_source'])
+        attribution = [s for aset in dataset.get('activity_sets', {}).values()
+                       for s in aset['attribution']]
+        for s in attribution + dataset.get('attribution', []):
+            if s['attribution_source'] is not None:
+                yield from walk_dataset(s['attribution_source'], s)
+
+    for dataset in report['sources_to_cache'] + report['source_names']:
+        yield from walk_dataset(dataset)
+
+
+def _warnings(report: dict) -> list:
+    warnings = []
+    for dataset, step in _walk(report):
+        if dataset['path'] is None and dataset['data_format'] in ['FBA',
+                                                                  'FBS']:
+            warnings.append(
+                f"{dataset['file']} ({dataset['data_format']}) is not stored "
+                f"locally and would be downloaded or generated")
+        if (step is not None
+                and step.get('join_geoscale') in _JOIN_WARNING_GEOSCALES):
+            warnings.append(
+                f"{dataset['name']} is joined at the "
+                f"{step['join_geoscale']} level "
+                f"({location_count(step['join_geoscale'])} locations), "
+                f"which can use a lot of memory")
+    return list(dict.fromkeys(warnings))
+
+
+def format_report(report: dict) -> str:
+    """
+    Formats the dict returned by explain() for printing
+    :param report: dict
+    :return: str
+    """
+    def rows(dataset):
+        if dataset['path'] is None:
+            return 'not stored locally'
+        if dataset['rows'] is None:
+            return 'stored locally'
+        if dataset.get('attributed_rows') is not None:
+            return (f"{dataset['rows']:,} rows, about "
+                    f"{dataset['attributed_rows']:,} once attributed")
+        return f"{dataset['rows']:,} rows"
+
+    def describe(dataset):
+        year = f" {dataset['year']}" if dataset['year'] else ''
+        cached = ', sources_to_cache' if dataset['cached'] else ''
+        return (f"{dataset['name']}{year} ({dataset['data_format']}, "
+                f"{dataset['geoscale']}, {rows(dataset)}{cached})")
+
+    def sockets(config, indent):
+        return [f'{indent}{k}: {v}' for k, v in config.items()]
+
+    def steps(attribution, indent):
+        lines = []
+        for step in attribution:
+            line = f"{indent}- {step['attribution_method']}"
+            if step['attribution_source'] is not None:
+                line += (f" with {describe(step['attribution_source'])}, "
+                         f"joined at {step['join_geoscale']} level")
+            lines.append(line)
+            for k in ['attribute_on', 'fill_columns']:
+                if step[k]:
+                    lines.append(f'{indent}  {k}: {step[k]}')
+            if step['attribution_source'] is not None:
+                lines.extend(dataset_lines(step['attribution_source'],
+                                           indent + '  ', header=False))
+        return lines
+
+    def dataset_lines(dataset, indent, header=True):
+        lines = [f'{indent}{describe(dataset)}'] if header else []
+        lines.extend(sockets(dataset['function_sockets'], indent + '  '))
+        if 'clean_source' in dataset:
+            lines.append(f'{indent}  clean_source:')
+            lines.extend(dataset_lines(dataset['clean_source'],
+                                       indent + '    '))
+        for name, aset in dataset.get('activity_sets', {}).items():
+            lines.append(f'{indent}  activity set {name}:')
+            lines.extend(sockets(aset['function_sockets'], indent + '    '))
+            if 'clean_source' in aset:
+                lines.append(f'{indent}    clean_source:')
+                lines.extend(dataset_lines(aset['clean_source'],
+                                           indent + '      '))
+            lines.extend(steps(aset['attribution'], indent + '    '))
+        lines.extend(steps(dataset.get('attribution', []), indent + '  '))
+        return lines
+
+    lines = [f"FlowBySector method {report['method']}: "
+             f"{report['geoscale']}, NAICS {report['target_naics_year']}, "
+             f"industry_spec {report['industry_spec']}"]
+    if report['sources_to_cache']:
+        lines.append('sources_to_cache:')
+        for dataset in report['sources_to_cache']:
+            lines.extend(dataset_lines(dataset, '  '))
+    lines.append('source_names:')
+    for dataset in report['source_names']:
+        lines.extend(dataset_lines(dataset, '  '))
+    local_rows = sum(d['rows'] or 0 for d, _ in _walk(report))
+    lines.append(f"{report['unique_datasets']} unique datasets, "
+                 f"{local_rows:,} rows in those stored locally "
+                 f"(datasets loaded more than once are counted each time)")
+    if report['attributed_rows']:
+        lines.append(f"About {report['attributed_rows']:,} rows once "
+                     f"attributed to target sectors (rows of the "
+                     f"source_names stored locally, times the mean number "
+                     f"of target sectors per source NAICS code)")
+    if report['sector_fan_out']:
+        lines.append('Target sectors per source NAICS code, by code length:')
+        lines.extend(f"  {length} digits: mean {f['mean']}, max {f['max']} "
+                     f"({f['codes']} codes)"
+                     for length, f in report['sector_fan_out'].items())
+    if report['warnings']:
+        lines.append('Warnings:')
+        lines.extend(f'  {w}' for w in report['warnings'])
+    return '\n'.join(lines)
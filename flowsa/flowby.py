@@ -9,7 +9,8 @@ import numpy as np
 from functools import partial, reduce
 from copy import deepcopy
 from flowsa import (settings, literature_values, flowsa_yaml, geo, schema,
-                    naics)
+                    naics, flowbyfunctions, selection, caching,
+                    planner)
 from flowsa.common import get_catalog_info
 from flowsa.flowsa_log import log, vlog
 import esupy.processed_data_mgmt
@@ -83,13 +84,81 @@ def get_flowby_from_config(
                          '"FBA", "FBS", "FBS_outside_flowsa".')
 
 
+def concat_flowby(objs, **kwargs) -> FB:
+    '''
+    Concatenates FlowBy datasets with pd.concat(). If any of the datasets hold
+    categorical columns (see categorical_storage in flowby_config.yaml), the
+    categories of each such column are first unioned across the datasets, so
+    that the column remains categorical in the concatenated dataset instead of
+    falling back to object.
+
+    :param objs: iterable of FlowBy datasets
+    :param kwargs: passed to pd.concat()
+    :return: concatenated FlowBy dataset
+    '''
+    objs = list(objs)
+    categorical_columns = {
+        c for fb in objs for c in fb.columns
+        if isinstance(fb[c].dtype, pd.CategoricalDtype)
+    }
+    for column in categorical_columns:
+        categories = pd.unique(np.concatenate([
+            (fb[column].cat.categories.to_numpy(dtype=object)
+             if isinstance(fb[column].dtype, pd.CategoricalDtype)
+             else fb[column].dropna().unique().astype(object))
+            for fb in objs if column in fb.columns
+        ]))
+        dtype = pd.CategoricalDtype(categories)
+        objs = [fb.assign(**{column: fb[column].astype(dtype)})
+                if column in fb.columns else fb
+                for fb in objs]
+    return pd.concat(objs, **kwargs)
+
+
+class _InvalidatingIndexer:
+    '''
+    Wraps the .loc, .iloc, .at or .iat indexer of a FlowBy, so that
+    assigning values through it, which can write values __init__ would
+    normalize (e.g. 'None' or NaN), clears the validated_fields of the
+    FlowBy. Anything else is passed on to the wrapped indexer.
+    '''
+    def __init__(self, indexer, fb) -> None:
+        object.__setattr__(self, '_indexer', indexer)
+        object.__setattr__(self, '_fb', fb)
+
+    def __getitem__(self, key):
+        return self._indexer[key]
+
+    def __setitem__(self, key, value) -> None:
+        try:
+            self._indexer[key] = value
+        except (TypeError, ValueError) as e:
+            if 'new category' not in str(e):
+                raise
+            # A value that is not yet a category of a categorical column
+            # (see categorical_storage): the categorical columns fall back
+            # to object, and are stored as categorical again when the next
+            # FlowBy is constructed.
+            fb = self._fb
+            for column in [c for c in fb.columns
+                           if isinstance(fb[c].dtype, pd.CategoricalDtype)]:
+                fb[column] = fb[column].astype('object')
+            self._indexer[key] = value
+        object.__setattr__(self._fb, 'validated_fields', {})
+
+    def __call__(self, *args, **kwargs):
+        return _InvalidatingIndexer(self._indexer(*args, **kwargs), self._fb)
+
+    def __getattr__(self, name):
+        return getattr(self._indexer, name)
 
 
 class _FlowBy(pd.DataFrame):
-    _metadata = ['full_name', 'config']
+    _metadata = ['full_name', 'config', 'validated_fields']
 
     full_name: str
     config: dict
+    validated_fields: dict
 
     def __init__(
         self,
@@ -108,6 +177,11 @@ class _FlowBy(pd.DataFrame):
 
         All args and kwargs not specified above or in FBA/FBS metadata are
         passed to the DataFrame constructor.
+
+        Fields that have already been normalized (recorded, with their dtype,
+        in the validated_fields attribute of the data) are not normalized
+        again, so only newly added or modified fields are processed when one
+        FlowBy is constructed from another.
         '''
 
         # Assign values to metadata attributes, checking the following sources,
@@ -124,6 +198,8 @@ class _FlowBy(pd.DataFrame):
                 )
 
         if isinstance(data, pd.DataFrame) and fields is not None:
+            validated = (self._normalized_fields(data, fields)
+                         if string_null is np.nan else [])
             if add_missing_columns:
                 data = data.assign(**{field: None
                                       for field in fields
@@ -131,21 +207,32 @@ class _FlowBy(pd.DataFrame):
             else:
                 fields = {k: v for k, v in fields.items() if k in data.columns}
 
-            fill_na_dict = {
-                field: 0 if dtype in ['int', 'float'] else string_null
-                for field, dtype in fields.items()
-            }
-            null_string_dict = {
-                field: {null: string_null
-                        for null in ['nan', '<NA>', 'None', '',
-                                     np.nan, pd.NA, None]}
-                for field, dtype in fields.items() if dtype == 'object'
-            }
-
-            data = (data
-                    .fillna(fill_na_dict)
-                    .replace(null_string_dict)
-                    .astype(fields))
+            pending = {field: dtype for field, dtype in fields.items()
+                       if field not in validated}
+            if pending:
+                fill_na_dict = {
+                    field: 0 if dtype in ['int', 'float'] else string_null
+                    for field, dtype in pending.items()
+                }
+                null_string_dict = {
+                    field: {null: string_null
+                            for null in ['nan', '<NA>', 'None', '',
+                                         np.nan, pd.NA, None]}
+                    for field, dtype in pending.items() if dtype == 'object'
+                }
+
+                # normalized as a plain DataFrame, since methods such as
+                # astype() construct their result with _constructor, which
+                # would normalize every field of a FlowBy again
+                data = (pd.DataFrame(data)
+                        .fillna(fill_na_dict)
+                        .replace(null_string_dict)
+                        .astype(self._storage_dtypes(pending)))
+
+            super().__setattr__(
+                'validated_fields',
+                ({**self.validated_fields, **fields}
+                 if string_null is np.nan else {}))
 
         if isinstance(data, pd.DataFrame) and column_order is not None:
             data = data[[c for c in column_order if c in data.columns]
@@ -171,6 +258,12 @@ class _FlowBy(pd.DataFrame):
         concat: for full_name or config, use the shared portion (possibly
             '' or {}); for other _metadata (if any), use values from the
             first FlowBy
+
+        validated_fields is only kept by methods that cannot change the
+        values of existing columns (see _validating_methods). After a left
+        or inner merge, the validated fields of the left FlowBy that are not
+        also columns of the right FlowBy are kept; after a concat, the fields
+        validated and present in every concatenated FlowBy are kept.
         '''
         self = super().__finalize__(other, method=method, **kwargs)
 
@@ -179,6 +272,13 @@ class _FlowBy(pd.DataFrame):
             for attribute in self._metadata:
                 object.__setattr__(self, attribute,
                                    getattr(other.left, attribute, None))
+            object.__setattr__(
+                self, 'validated_fields',
+                {k: v for k, v
+                 in (getattr(other.left, 'validated_fields', None) or {})
+                 .items()
+                 if k not in other.right.columns or k in (other.on or [])}
+                if other.how in ['left', 'inner'] else {})
 
         # When concatenating, use shared portion of full_name or config. For
         # other attributes, use metadata from the first FlowBy
@@ -201,11 +301,112 @@ class _FlowBy(pd.DataFrame):
             object.__setattr__(self, 'full_name', _full_name)
             object.__setattr__(self, 'config', _config)
             for attribute in [x for x in self._metadata
-                              if x not in ['full_name', 'config']]:
+                              if x not in ['full_name', 'config',
+                                           'validated_fields']]:
                 object.__setattr__(self, attribute,
                                    getattr(other.objs[0], attribute, None))
+            object.__setattr__(
+                self, 'validated_fields',
+                {k: v for k, v
+                 in (getattr(other.objs[0], 'validated_fields', None) or {})
+                 .items()
+                 if all((getattr(x, 'validated_fields', None) or {}).get(k)
+                        == v and k in getattr(x, 'columns', [])
+                        for x in other.objs)})
+
+        elif method not in ['merge', *self._validating_methods]:
+            object.__setattr__(self, 'validated_fields', {})
         return self
 
+    # DataFrame methods that keep the values of each column unchanged, so
+    # that fields validated in the calling FlowBy remain valid in the result
+    _validating_methods = ['copy', 'take', 'sort_values', 'sort_index']
+
+    def __setitem__(self, key, value) -> None:
+        '''
+        Overrides DataFrame.__setitem__() (and so also DataFrame.assign()).
+        Any column that is (re)assigned is removed from validated_fields,
+        so that it is normalized again the next time a FlowBy is constructed.
+        '''
+        super().__setitem__(key, value)
+        validated = getattr(self, 'validated_fields', None)
+        if validated:
+            if isinstance(key, str):
+                keys = [key]
+            elif (isinstance(key, (list, tuple, pd.Index))
+                  and all(isinstance(k, str) for k in key)):
+                keys = list(key)
+            else:
+                keys = list(validated)
+            object.__setattr__(self, 'validated_fields',
+                               {k: v for k, v in validated.items()
+                                if k not in keys})
+
+    def _update_inplace(self, result, verify_is_copy=True) -> None:
+        '''
+        Overrides NDFrame._update_inplace(), through which methods called
+        with inplace=True (e.g. fillna() or replace()) modify the FlowBy.
+        Their changes are not tracked by column, so validated_fields is
+        cleared.
+        '''
+        super()._update_inplace(result, verify_is_copy=verify_is_copy)
+        object.__setattr__(self, 'validated_fields', {})
+
+    @property
+    def loc(self):
+        return _InvalidatingIndexer(super().loc, self)
+
+    @property
+    def iloc(self):
+        return _InvalidatingIndexer(super().iloc, self)
+
+    @property
+    def at(self):
+        return _InvalidatingIndexer(super().at, self)
+
+    @property
+    def iat(self):
+        return _InvalidatingIndexer(super().iat, self)
+
+    def _iset_item(self, loc, value) -> None:
+        '''
+        Overrides DataFrame._iset_item(), through which replace() with
+        inplace=True sets columns by position, clearing validated_fields
+        '''
+        super()._iset_item(loc, value)
+        object.__setattr__(self, 'validated_fields', {})
+
+    def _normalized_fields(self, data: pd.DataFrame, fields: dict) -> list:
+        '''
+        Returns the subset of the given fields that have already been
+        normalized in data, and so can skip normalization in __init__. A
+        field qualifies if it is recorded in data.validated_fields with the
+        same dtype and it passes a cheap check of its current values: the
+        storage dtype must match, numeric fields must not contain NaN, and
+        categorical fields must not have null-like strings as categories.
+        '''
+        validated = getattr(data, 'validated_fields', None) or {}
+        if not validated or not data.columns.is_unique:
+            return []
+        storage_dtypes = self._storage_dtypes(fields)
+        normalized = []
+        for field, dtype in fields.items():
+            if validated.get(field) != dtype or field not in data.columns:
+                continue
+            column = data[field]
+            if storage_dtypes[field] == 'category':
+                ok = (isinstance(column.dtype, pd.CategoricalDtype)
+                      and not column.cat.categories.isin(
+                          ['nan', '<NA>', 'None', '']).any())
+            elif dtype in ['int', 'float']:
+                ok = (column.dtype == np.dtype(dtype)
+                      and not column.isna().any())
+            else:
+                ok = column.dtype == 'object'
+            if ok:
+                normalized.append(field)
+        return normalized
+
     @property
     def source_name(self) -> str:
         return self.full_name.split('.', maxsplit=1)[0]
@@ -217,9 +418,54 @@ class _FlowBy(pd.DataFrame):
     @property
     def groupby_cols(self) -> List[str]:
         return [x for x in self
-                if self[x].dtype in ['int', 'object', 'int32', 'int64']
+                if self[x].dtype in ['int', 'object', 'int32', 'int64',
+                                     'category']
                 and x not in ['Description', 'group_id']]
 
+    @property
+    def categorical_storage(self) -> bool:
+        '''
+        Whether the fields in flowby_config['categorical_fields'] are stored
+        as pandas Categorical. Set by 'categorical_storage' in the config
+        dictionary, defaulting to the value in flowby_config.yaml.
+        '''
+        return (self.config or {}).get('categorical_storage',
+                                       flowby_config['categorical_storage'])
+
+    def _storage_dtypes(self, fields: dict) -> dict:
+        '''
+        Returns the given {field: dtype} dictionary, with the dtype of
+        low-cardinality object fields set to 'category' if categorical
+        storage is enabled.
+        '''
+        if not self.categorical_storage:
+            return fields
+        return {field: ('category'
+                        if dtype == 'object'
+                        and field in flowby_config['categorical_fields']
+                        else dtype)
+                for field, dtype in fields.items()}
+
+    def convert_categoricals_to_object(self: FB) -> FB:
+        '''
+        Casts any categorical columns back to object dtype. Used before a
+        FlowBy is written to file or returned to the user.
+        '''
+        return self.assign(**{c: self[c].astype('object') for c in self
+                              if isinstance(self[c].dtype,
+                                            pd.CategoricalDtype)})
+
+    def convert_object_to_categoricals(self: FB) -> FB:
+        '''
+        Casts low-cardinality object fields to categorical, if categorical
+        storage is enabled. Otherwise, returns the calling FlowBy unchanged.
+        '''
+        if not self.categorical_storage:
+            return self
+        return self.assign(**{c: self[c].astype('category')
+                              for c in flowby_config['categorical_fields']
+                              if c in self and self[c].dtype == 'object'})
+
     @classmethod
     def _getFlowBy(
         cls,
@@ -238,6 +484,15 @@ class _FlowBy(pd.DataFrame):
         attempt_list = (['import local', 'download', 'generate']
                         if download_ok else ['import local', 'generate'])
 
+        # datasets loaded earlier in a generation run are reused
+        cache_key = (file_metadata.category, file_metadata.name_data,
+                     str(paths.local_path))
+        df = caching.loaded_datasets.get(cache_key)
+        if df is not None:
+            log.info(f'Reusing {file_metadata.name_data} '
+                     f'{file_metadata.category}, already loaded')
+            attempt_list = []
+
         for attempt in attempt_list:
             log.info(f'Attempting to {attempt} {file_metadata.name_data} '
                      f'{file_metadata.category}')
@@ -258,10 +513,15 @@ class _FlowBy(pd.DataFrame):
             else:
                 log.info(f'Successfully loaded {file_metadata.name_data} '
                          f'{file_metadata.category} from {output_path}')
+                caching.dataset_loaded(cache_key, df)
                 break
         else:
-            log.error(f'{file_metadata.name_data} {file_metadata.category} '
-                      f'could not be found locally, downloaded, or generated')
+            if df is None:
+                log.error(f'{file_metadata.name_data} '
+                          f'{file_metadata.category} could not be found '
+                          f'locally, downloaded, or generated')
+        if df is not None and cache_key in caching.loaded_datasets:
+            df = df.copy()
         fb = cls(df, full_name=full_name or '', config=config or {})
         return fb
 
@@ -286,7 +546,8 @@ class _FlowBy(pd.DataFrame):
         )
 
         conversion_table = pd.concat([
-            pd.read_csv(settings.datapath / 'unit_conversion.csv'),
+            caching.reference_data.read_csv(
+                settings.datapath / 'unit_conversion.csv'),
             pd.Series({'old_unit': 'Canadian Dollar',
                        'new_unit': 'USD',
                        'conversion_factor': 1 / exchange_rate}).to_frame().T
@@ -334,12 +595,24 @@ class _FlowBy(pd.DataFrame):
         :return: transformed FlowBy dataset
         '''
         if socket_name in self.config:
+            # Functions in data source scripts are written for object
+            # columns (e.g. assigning new values with .loc), so categorical
+            # columns are converted for the duration of the function call.
+            fb = (self.convert_categoricals_to_object()
+                  if self.categorical_storage else self)
             if isinstance(self.config[socket_name], list):
-                return reduce(lambda fb, func: fb.pipe(func, *args, **kwargs),
-                              self.config[socket_name],
-                              self)
+                fb = reduce(lambda fb, func: fb.pipe(func, *args, **kwargs),
+                            self.config[socket_name],
+                            fb)
             else:
-                return self.config[socket_name](self, *args, **kwargs)
+                fb = self.config[socket_name](fb, *args, **kwargs)
+            if isinstance(fb, _FlowBy):
+                # The function may have modified values in place (e.g.,
+                # with .loc), which validated_fields cannot track.
+                fb.validated_fields = {}
+                if self.categorical_storage:
+                    fb = fb.convert_object_to_categoricals()
+            return fb
         else:
             return self
 
@@ -383,11 +656,25 @@ class _FlowBy(pd.DataFrame):
         if type(target_geoscale) == str:
             target_geoscale = geo.scale.from_string(target_geoscale)
 
+        categorical = isinstance(self[column].dtype, pd.CategoricalDtype)
         if target_geoscale == geo.scale.NATIONAL:
+            fips = geo.filtered_fips('national').FIPS.values[0]
             return self.assign(
-                **{column: geo.filtered_fips('national').FIPS.values[0]}
+                **{column: pd.Categorical.from_codes(
+                    np.zeros(len(self), dtype='int8'), categories=[fips])
+                   if categorical else fips}
             )
         elif target_geoscale == geo.scale.STATE:
+            if categorical:
+                # replace each category once, merging the counties of a
+                # state into one category
+                codes, states = pd.factorize(
+                    self[column].cat.categories.str.slice_replace(
+                        start=2, repl='000'))
+                location = self[column].cat.codes.to_numpy()
+                return self.assign(**{column: pd.Categorical.from_codes(
+                    np.where(location >= 0, codes[location], -1),
+                    categories=states)})
             return self.assign(
                 **{column: self[column].str.slice_replace(start=2, repl='000')}
             )
@@ -441,100 +728,21 @@ class _FlowBy(pd.DataFrame):
 
         Similarly, can use 'exclusion_fields' to remove particular data in the
         same manner.
+
+        The dictionaries are compiled with selection.compile_selection(),
+        which can also be used directly to apply the same selection to many
+        datasets.
         '''
         if skip_select_by:
             return self
         exclusion_fields = (exclusion_fields or
                             self.config.get('exclusion_fields', {}))
-        exclusion_fields = {k: [v] if not isinstance(v, (list, dict)) else v
-                            for k, v in exclusion_fields.items()}
-        for field, values in exclusion_fields.items():
-            if field == 'conditional':
-                qry = ' & '.join(
-                    ["({} in {})".format(
-                        k, [v] if not isinstance(v, (list,dict)) else v)
-                        for k, v in exclusion_fields['conditional'].items()]
-                    )
-                self = self.query(f'~({qry})')
-            else:
-                if field not in self:
-                    log.warning(f'{field} not found, can not apply '
-                                'exclusion_fields')
-                else:
-                    self = self.query(f'{field} not in @values')
-
         selection_fields = (selection_fields
                             or self.config.get('selection_fields'))
 
-        if selection_fields is None or selection_fields == 'null':
-            return self
-
-        selection_fields = {k: [v] if not isinstance(v, (list, dict)) else v
-                            for k, v in selection_fields.items()}
-
-        if 'PrimaryActivity' in selection_fields:
-            self = (self
-                    .add_primary_secondary_columns('Activity')
-                    .drop(columns='SecondaryActivity'))
-        if 'PrimarySector' in selection_fields:
-            self = (self
-                    .add_primary_secondary_columns('Sector')
-                    .drop(columns='SecondarySector'))
-
-        special_fields = {
-            k: v for k, v in selection_fields.items()
-            if k in ['Activity', 'Sector']
-        }
-        other_fields = {
-            k: v for k, v in selection_fields.items()
-            if k not in ['Activity', 'Sector']
-        }
-
-        filtered_fb = self
-        for field, values in special_fields.items():
-            check_values = ([*values.keys(), *values.values()]
-                            if isinstance(values, dict) else values)
-            filtered_fb = filtered_fb.query(
-                f'{field}ProducedBy in @check_values '
-                f'| {field}ConsumedBy in @check_values'
-            )
-        for field, values in other_fields.items():
-            check_values = ([*values.keys(), *values.values()]
-                            if isinstance(values, dict) else values)
-            filtered_fb = filtered_fb.query(f'{field} in @check_values')
-
-        if filtered_fb.empty:
-            log.warning(f'{filtered_fb.full_name} FBA is empty')
-
-        for k in ['Activity', 'Sector']:
-            if isinstance(other_fields.get(f'Primary{k}'), dict):
-                if isinstance(special_fields.get(k), dict):
-                    special_fields[k].update(other_fields.pop(f'Primary{k}'))
-                else:
-                    special_fields[k] = other_fields.pop(f'Primary{k}')
-
-        replace_dict = {
-            **{f'{k}ProducedBy': v for k, v in special_fields.items()
-               if isinstance(v, dict)},
-            **{f'{k}ConsumedBy': v for k, v in special_fields.items()
-               if isinstance(v, dict)},
-            **{k: v for k, v in other_fields.items()
-               if isinstance(v, dict)}
-        }
-
-        replaced_fb = (
-            filtered_fb
-            .replace(replace_dict)
-            .drop(columns=['PrimaryActivity', 'PrimarySector'],
-                  errors='ignore')
-            .reset_index(drop=True)
-        )
-        # Reset blank values to nan
-        for k in replace_dict.keys():
-            if all(replaced_fb[k] == ''):
-                replaced_fb[k] = np.nan
-
-        return replaced_fb
+        return (selection.compile_selection(selection_fields,
+                                            exclusion_fields)
+                .apply(self))
 
     def aggregate_flowby(
             self: FB,
@@ -556,10 +764,10 @@ class _FlowBy(pd.DataFrame):
         :return: FlowBy, with aggregated columns
         """
         # if units are rates or ratios, do not aggregate
-        if (self['Unit'].str.contains('/').any()) and (aggregate_ratios
-                                                       is False):
+        units = pd.Series(self['Unit'].unique(), dtype='object')
+        if (units.str.contains('/').any()) and (aggregate_ratios is False):
             log.info(f"At least one row is a rate or ratio with units "
-                     f"{self['Unit'].unique().tolist()}, returning df "
+                     f"{units.tolist()}, returning df "
                      f"without aggregating")
             return self
 
@@ -575,37 +783,43 @@ class _FlowBy(pd.DataFrame):
             self = self.query('FlowAmount != 0')
             # ^^^ keep rows of zero values
 
-        fb = self.drop(columns=[c for c in self.columns
-                                if c not in ['FlowAmount',
-                                             *columns_to_average,
-                                             *columns_to_group_by]])
         if len(self) == 0:
             log.warning('Error, dataframe is empty')
             return self
+
+        # Factorize the group by columns into a single group key, then sum
+        # FlowAmount and the FlowAmount-weighted values of columns_to_average
+        # by group. Equivalent to groupby(columns_to_group_by, dropna=False,
+        # observed=True).agg(sum), without building the weighted columns.
+        group_ids, first_rows = flowbyfunctions.factorize_columns(
+            self, columns_to_group_by)
+        n_groups = len(first_rows)
+        flow = self['FlowAmount'].to_numpy(dtype=float)
+        aggregated_values = {'FlowAmount': flowbyfunctions.sum_by_group(
+            flow, group_ids, n_groups)}
+        for c in columns_to_average:
+            values = self[c].to_numpy(dtype=float)
+            weighted = flowbyfunctions.sum_by_group(
+                values * flow, group_ids, n_groups)
+            weights = flowbyfunctions.sum_by_group(
+                flow * ~np.isnan(values), group_ids, n_groups)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                aggregated_values[c] = weighted / weights
+
         aggregated = (
-            fb
-            .assign(**{f'_{c}_weighted': fb[c] * fb.FlowAmount
-                    for c in columns_to_average},
-                    **{f'_{c}_weights': fb.FlowAmount * fb[c].notnull()
-                    for c in columns_to_average})
-            .groupby(columns_to_group_by, dropna=False)
-            .agg(sum)
-            .reset_index()
-        )
-        aggregated = (
-            aggregated
-            .assign(**{c: (aggregated[f'_{c}_weighted']
-                           / aggregated[f'_{c}_weights'])
-                       for c in columns_to_average})
-            .drop(columns=([*[f'_{c}_weighted' for c in columns_to_average],
-                            *[f'_{c}_weights' for c in columns_to_average]]))
+            self[columns_to_group_by]
+            .take(first_rows)
+            .reset_index(drop=True)
+            .assign(**{c: aggregated_values[c] for c in self.columns
+                       if c in aggregated_values
+                       and c not in columns_to_group_by})
         )
-        aggregated = aggregated.astype(
+        aggregated = aggregated.astype(self._storage_dtypes(
             {column: type for column, type
              in set([*flowby_config['all_fba_fields'].items(),
                      *flowby_config['all_fbs_fields'].items()])
              if column in aggregated}
-        )
+        ))
         # ^^^ Need to convert back to correct dtypes after aggregating;
         #     otherwise, columns of NaN will become float dtype.
 
@@ -841,50 +1055,80 @@ class _FlowBy(pd.DataFrame):
             return [self]
 
         log.info(f'Splitting {self.full_name} into activity sets')
+        child_df_list = []
+        for child_df in self._split_activity_sets():
+            if not child_df.empty:
+                child_df_list.append(child_df)
+            else:
+                log.error(f'Activity set {child_df.full_name} is empty. '
+                          'Check activity set definition!')
+
+        return child_df_list
+
+    def _split_activity_sets(self: FB) -> List[FB]:
+        '''
+        Returns one subset of the calling FlowBy for each activity set in its
+        config dictionary, empty subsets included. Helper for
+        activity_sets().
+
+        The selections of all activity sets are evaluated against the calling
+        FlowBy, with any Primary... columns added only once, and each subset
+        is taken from it directly. The number of activity sets each row is
+        assigned to is tracked in a single array, which is used to log rows
+        assigned to multiple activity sets (double-counting) and rows not
+        assigned to any activity set.
+        '''
         activities = self.config['activity_sets']
         parent_config = {k: v for k, v in self.config.items()
                          if k not in ['activity_sets',
                                       'clean_fba_before_activity_sets']
                          and not k.startswith('_')}
-        parent_df = self.reset_index().rename(columns={'index': 'row'})
+        parent_fb = self.reset_index(drop=True)
+
+        selections = {
+            activity_set: selection.compile_selection(
+                activity_config.get('selection_fields')
+                or self.config.get('selection_fields'),
+                activity_config.get('exclusion_fields')
+                or self.config.get('exclusion_fields', {}))
+            for activity_set, activity_config in activities.items()
+        }
+        primary_fb = parent_fb
+        for k in ['Activity', 'Sector']:
+            if any(k in s.primary_columns for s in selections.values()):
+                primary_fb = primary_fb.add_primary_secondary_columns(k)
 
-        child_df_list = []
-        assigned_rows = set()
+        child_fb_list = []
+        assignments = np.zeros(len(parent_fb), dtype=int)
         for activity_set, activity_config in activities.items():
             log.info(f'Creating subset for {activity_set}')
-
-            child_df = (
-                parent_df
-                .add_full_name(
-                    f'{parent_df.full_name}{NAME_SEP_CHAR}{activity_set}')
-                .select_by_fields(
-                    selection_fields=activity_config.get('selection_fields'),
-                    exclusion_fields=activity_config.get('exclusion_fields'))
-            )
-
-            child_df.config = {**parent_config, **activity_config}
-            child_df = child_df.assign(SourceName=child_df.full_name)
-
-            if set(child_df.row) & assigned_rows:
-                log.critical(f"Some rows from {parent_df.full_name} assigned "
+            keep = selections[activity_set].mask(primary_fb)
+
+            named_fb = parent_fb.copy(deep=False)
+            named_fb.full_name = (f'{parent_fb.full_name}{NAME_SEP_CHAR}'
+                                  f'{activity_set}')
+            child_fb = selections[activity_set].take(named_fb, keep)
+            child_fb.config = {**parent_config, **activity_config}
+            child_fb = child_fb.assign(SourceName=child_fb.full_name)
+
+            double_counted = (assignments[keep] > 0)
+            if double_counted.any():
+                # show double-counted rows with their original index
+                rows = (child_fb[double_counted]
+                        .set_axis(self.index[keep][double_counted]))
+                log.critical(f"Some rows from {parent_fb.full_name} assigned "
                              f"to multiple activity sets. This will lead to "
-                             f"double-counting:"
-                             f"\n{child_df.query(f'row in {list(set(child_df.row) & assigned_rows)}')}")
+                             f"double-counting:\n{rows}")
                 # raise ValueError('Some rows in multiple activity sets')
 
-            assigned_rows.update(child_df.row)
-            if not child_df.empty:
-                child_df_list.append(child_df.drop(columns='row'))
-            else:
-                log.error(f'Activity set {child_df.full_name} is empty. '
-                          'Check activity set definition!')
+            assignments += keep
+            child_fb_list.append(child_fb)
 
-        if set(parent_df.row) - assigned_rows:
-            log.warning(f'Some rows from {parent_df.full_name} not assigned '
+        if (assignments == 0).any():
+            log.warning(f'Some rows from {parent_fb.full_name} not assigned '
                         f'to an activity set. Is this intentional?')
-            unassigned = parent_df.query('row not in @assigned_rows')
 
-        return child_df_list
+        return child_fb_list
 
     def load_prepare_attribution_source(
         self: FB,
@@ -903,7 +1147,8 @@ class _FlowBy(pd.DataFrame):
             (name, config), = attribution_source.items()
 
         if name in self.config['cache']:
-            attribution_fbs = self.config['cache'][name].copy()
+            attribution_fbs = planner.partition_rows(
+                self.config['cache'][name])
             attribution_fbs.config = {
                 **{k: attribution_fbs.config[k]
                    for k in attribution_fbs.config['method_config_keys']},
@@ -916,15 +1161,11 @@ class _FlowBy(pd.DataFrame):
             attribution_fbs = attribution_fbs.prepare_fbs(
                 download_sources_ok=download_sources_ok)
         else:
-            attribution_fbs = get_flowby_from_config(
+            attribution_fbs = planner.load_prepared_source(
                 name=name,
-                config={**{k: v for k, v in self.config.items()
-                           if k in self.config['method_config_keys']
-                           or k == 'method_config_keys'},
-                        **get_catalog_info(name),
-                        **config},
+                config=planner.source_config(self.config, name, config),
                 download_sources_ok=download_sources_ok
-            ).prepare_fbs(download_sources_ok=download_sources_ok)
+            )
 
         return attribution_fbs
 
@@ -932,22 +1173,54 @@ class _FlowBy(pd.DataFrame):
         self: 'FB',
         other: 'FlowBySector'
     ) -> 'FlowByActivity':
+        """
+        Brings self and other (an attribution FBS) to a common geoscale,
+        adds PrimarySector and SecondarySector columns, and sums other by
+        PrimarySector, Location and Unit (and any attribute_on and
+        fill_columns). The summed attribution source is cached, so activity
+        sets sharing an attribution source only harmonize it once (see
+        caching.harmonized_sources). A source as returned by
+        planner.load_prepared_source() is identified by its prepared_key,
+        other sources by the fingerprint of their content.
+        """
 
         fb_geoscale = geo.scale.from_string(self.config['geoscale'])
         other_geoscale = geo.scale.from_string(other.config['geoscale'])
 
         fill_cols = self.config.get('fill_columns')
+        attribution_cols = self.config.get('attribute_on')
+        source_key = getattr(other, 'prepared_key', None)
+        if source_key is None:
+            source_key = caching.fingerprint(other, [
+                'SectorProducedBy', 'SectorConsumedBy', 'FlowType',
+                'Location', 'FlowAmount', 'Unit',
+                *(attribution_cols or []), *([fill_cols] if fill_cols else [])
+            ])
+        cache_key = (
+            source_key,
+            other.config.get('primary_action_type'),
+            other.categorical_storage,
+            fb_geoscale, other_geoscale,
+            tuple(attribution_cols or []), fill_cols
+        )
+        harmonized = caching.harmonized_sources.get(cache_key)
+        other_name, other_config = other.full_name, other.config
+        if harmonized is not None:
+            log.info(f'Reusing harmonized {other.full_name}, already '
+                     f'summed for an earlier activity set')
+
         if fill_cols and 'Location' in fill_cols:
             # Don't harmonize geoscales when updating Location
             pass
         elif other_geoscale < fb_geoscale:
-            log.info(f'Aggregating {other.full_name} from {other_geoscale} to '
-                     f'{fb_geoscale}')
-            other = (
-                other
-                .convert_fips_to_geoscale(fb_geoscale)
-                .aggregate_flowby()
-            )
+            if harmonized is None:
+                log.info(f'Aggregating {other.full_name} from '
+                         f'{other_geoscale} to {fb_geoscale}')
+                other = (
+                    other
+                    .convert_fips_to_geoscale(fb_geoscale)
+                    .aggregate_flowby()
+                )
         elif other_geoscale > fb_geoscale:
             log.info(f'{other.full_name} is {other_geoscale}, while '
                      f'{self.full_name} is {fb_geoscale}, so attributing '
@@ -961,27 +1234,32 @@ class _FlowBy(pd.DataFrame):
 
         fb = self.add_primary_secondary_columns('Sector')
 
-        subset_cols = ['PrimarySector', 'Location', 'FlowAmount', 'Unit']
-        groupby_cols = ['PrimarySector', 'Location', 'Unit']
-        attribution_cols = self.config.get('attribute_on')
-        if attribution_cols is not None:
-            subset_cols = subset_cols + attribution_cols
-            groupby_cols = subset_cols + attribution_cols
-        if fill_cols is not None:
-            subset_cols = subset_cols + [fill_cols]
-            groupby_cols = groupby_cols + [fill_cols]
-        # ensure no duplicates
-        subset_cols = list(set(subset_cols))
-        groupby_cols = list(set(groupby_cols))
-
-        other = (
-            other
-            .add_primary_secondary_columns('Sector')
-            [subset_cols]
-            .groupby(groupby_cols)
-            .agg('sum')
-            .reset_index()
-        )
+        if harmonized is None:
+            subset_cols = ['PrimarySector', 'Location', 'FlowAmount', 'Unit']
+            groupby_cols = ['PrimarySector', 'Location', 'Unit']
+            if attribution_cols is not None:
+                subset_cols = subset_cols + attribution_cols
+                groupby_cols = subset_cols + attribution_cols
+            if fill_cols is not None:
+                subset_cols = subset_cols + [fill_cols]
+                groupby_cols = groupby_cols + [fill_cols]
+            # ensure no duplicates
+            subset_cols = list(set(subset_cols))
+            groupby_cols = list(set(groupby_cols))
+
+            harmonized = (
+                other
+                .add_primary_secondary_columns('Sector')
+                [subset_cols]
+                .groupby(groupby_cols, observed=True)
+                .agg('sum')
+                .reset_index()
+            )
+            caching.harmonized_sources.put(cache_key, harmonized)
+
+        other = harmonized.copy()
+        other.full_name = other_name
+        other.config = other_config
 
         return fb_geoscale, other_geoscale, fb, other
 
@@ -993,6 +1271,11 @@ class _FlowBy(pd.DataFrame):
         This method takes flows from the calling FBA which are mapped to
         multiple sectors and attributes them to those sectors proportionally to
         flows from other (an FBS).
+
+        Rows are paired with the matching rows of other by position (see
+        flowbyfunctions.JoinIndex) and denominators are summed by integer
+        group_id, so that only rows which receive a share of a flow are
+        built, rather than the full merge of self and other.
         """
 
         log.info(f'Attributing flows in {self.full_name} using '
@@ -1000,60 +1283,62 @@ class _FlowBy(pd.DataFrame):
 
         fb_geoscale, other_geoscale, fb, other = self.harmonize_geoscale(other)
 
+        location_col = 'temp_location' if 'temp_location' in fb else 'Location'
+        group_ids, first_rows = flowbyfunctions.factorize_columns(fb,
+                                                                 ['group_id'])
+        # rows without a group_id are in no group (as in groupby), rather
+        # than in one group of their own
+        has_group = fb['group_id'].notna().to_numpy()
+        # FlowAmount of each row of other, with 0 appended for rows which
+        # do not match any row of other (position -1)
+        other_flows = np.append(other['FlowAmount'].fillna(0)
+                                .to_numpy(dtype=float), 0)
+
         # attribute on sector columns
         if self.config.get('attribute_on') is None:
-            groupby_cols = ['group_id']
+            right_on = ['PrimarySector', 'Location']
+            index = flowbyfunctions.JoinIndex(other, right_on)
+            group_count = np.bincount(group_ids)[group_ids]
+            directly_attributed = np.flatnonzero(has_group
+                                                 & (group_count == 1))
+            needs_attribution = np.flatnonzero(has_group & (group_count > 1))
+
             for rank in ['Primary', 'Secondary']:
                 # skip over Secondary if not relevant
                 if fb[f'{rank}Sector'].isna().all():
                     continue
-                counted = fb.assign(group_count=(fb.groupby(groupby_cols)
-                                                  ['group_id']
-                                                  .transform('count')))
-                directly_attributed = (
-                    counted
-                    .query('group_count == 1')
-                    .drop(columns='group_count')
-                )
-                needs_attribution = (
-                    counted
-                    .query('group_count > 1')
-                    .drop(columns='group_count')
-                )
-
-                merged = (
-                    needs_attribution
-                    .merge(other,
-                           how='left',
-                           left_on=[f'{rank}Sector',
-                                    'temp_location'
-                                    if 'temp_location' in needs_attribution
-                                    else 'Location'],
-                           right_on=['PrimarySector', 'Location'],
-                           suffixes=[None, '_other'])
-                    .fillna({'FlowAmount_other': 0})
-                )
-
-                denominator_flag = ~merged.duplicated(subset=[*groupby_cols,
-                                                      f'{rank}Sector'])
-                with_denominator = (
-                    merged
-                    .assign(denominator=(
-                        merged
-                        .assign(FlowAmount_other=(merged.FlowAmount_other
-                                                  * denominator_flag))
-                        .groupby(groupby_cols)
-                        ['FlowAmount_other']
-                        .transform('sum')))
-                )
-
-                non_zero_denominator = with_denominator.query(f'denominator != 0 ')
-                unattributable = with_denominator.query(f'denominator == 0 ')
-
-                if not unattributable.empty:
+                left_on = [f'{rank}Sector', location_col]
+                positions, other_rows = index.expand(
+                    index.match(fb, left_on)[needs_attribution])
+                rows = needs_attribution[positions]
+                flow_other = other_flows[other_rows]
+
+                # each sector in a group counts towards the denominator once
+                sector_ids, _ = flowbyfunctions.factorize_columns(
+                    fb, ['group_id', f'{rank}Sector'])
+                denominator_flag = np.zeros(len(rows), dtype=bool)
+                denominator_flag[np.unique(sector_ids[rows],
+                                           return_index=True)[1]] = True
+                denominator = np.bincount(
+                    group_ids[rows], weights=flow_other * denominator_flag,
+                    minlength=len(first_rows))[group_ids[rows]]
+
+                if (denominator == 0).any():
+                    unattributable = (
+                        fb
+                        .take(np.unique(rows[denominator == 0]))
+                        .merge(other,
+                               how='left',
+                               left_on=left_on,
+                               right_on=right_on,
+                               suffixes=[None, '_other'])
+                        .fillna({'FlowAmount_other': 0})
+                        .assign(denominator=0.0)
+                    )
                     # implode the location data to shorten warning message
                     unatt_sub = unattributable.groupby(
-                        [f"{rank}Sector"], dropna=False, as_index=False).agg(
+                        [f"{rank}Sector"], dropna=False, as_index=False,
+                        observed=True).agg(
                         {'Location': lambda x: ", ".join(x)})
                     vlog.warning(
                         f'Could not attribute activities in '
@@ -1078,48 +1363,38 @@ class _FlowBy(pd.DataFrame):
                                    'Suppressed'], errors='ignore'
                                   ).to_string()))
 
-                proportionally_attributed = (
-                    non_zero_denominator
-                    .assign(FlowAmount=lambda x: (x.FlowAmount
-                                                  * x.FlowAmount_other
-                                                  / x.denominator))
-                )
-
-            fb = pd.concat([directly_attributed,
-                             proportionally_attributed], ignore_index=True)
-
         # else attribute on column specified in the FBS yaml
         else:
             attribute_cols = self.config.get('attribute_on')
 
             log.info(f'Proportionally attributing on {attribute_cols}')
-            left_on = attribute_cols + ['temp_location' if 'temp_location'
-                                        in fb else 'Location']
+            left_on = attribute_cols + [location_col]
             right_on = attribute_cols + ['Location']
             for l in (left_on, right_on):
                 if 'Location' in self.config.get('fill_columns', []):
                     l.remove('Location')
-            merged = (
-                fb
-                .merge(other,
-                       how='left',
-                       left_on=left_on,
-                       right_on=right_on,
-                       suffixes=[None, '_other'])
-                .fillna({'FlowAmount_other': 0})
-            )
-
-            merged_with_denominator = (
-                merged
-                .assign(denominator=(merged
-                        .groupby('group_id')['FlowAmount_other']
-                        .transform('sum')))
-            )
-
-            non_zero_denominator = merged_with_denominator.query(f'denominator != 0 ')
-            unattributable = merged_with_denominator.query(f'denominator == 0 ')
-
-            if not unattributable.empty:
+            index = flowbyfunctions.JoinIndex(other, right_on)
+            directly_attributed = None
+            rows, other_rows = index.expand(index.match(fb, left_on))
+            flow_other = other_flows[other_rows]
+            denominator = np.where(
+                has_group[rows],
+                np.bincount(group_ids[rows], weights=flow_other,
+                            minlength=len(first_rows))[group_ids[rows]],
+                np.nan)
+
+            if (denominator == 0).any():
+                unattributable = (
+                    fb
+                    .take(np.unique(rows[denominator == 0]))
+                    .merge(other,
+                           how='left',
+                           left_on=left_on,
+                           right_on=right_on,
+                           suffixes=[None, '_other'])
+                    .fillna({'FlowAmount_other': 0})
+                    .assign(denominator=0.0)
+                )
                 vlog.warning(
                     'Could not attribute activities in %s due to lack of '
                     'flows in attribution source %s for %s. '
@@ -1138,20 +1413,6 @@ class _FlowBy(pd.DataFrame):
                                'denominator', 'Suppressed'],
                               errors='ignore')
                         .to_string()))
-            fb = (
-                non_zero_denominator
-                .assign(FlowAmount=lambda x: (x.FlowAmount
-                                              * x.FlowAmount_other
-                                              / x.denominator))
-            )
-        # if the fbs method yamls specifies that a column from in the
-        # primary data source should be replaced with data from the
-        # attribution source, fill here
-        fill_col = self.config.get('fill_columns')
-        if fill_col is not None:
-            log.info(f'Replacing {fill_col} values in primary data source '
-                     f'with those from attribution source.')
-            fb[fill_col] = fb[f'{fill_col}_other']
 
         # drop rows where 'FlowAmount_other' is 0 because the primary
         # activities are not attributed to those sectors. The values are 0
@@ -1161,7 +1422,42 @@ class _FlowBy(pd.DataFrame):
         # otherwise if the data is further attributed (such as multiplied),
         # it could appear that data is dropped elsewhere when the dataset is
         # checked for null values
-        fb = fb[fb['FlowAmount_other'] != 0].reset_index(drop=True)
+        keep = (denominator != 0) & (flow_other != 0)
+        rows, other_rows = rows[keep], other_rows[keep]
+
+        # columns of other that are not join keys or already in fb are
+        # carried over, as in a merge
+        join_keys = [r for l, r in zip(left_on, right_on) if l == r]
+        other_cols = [c for c in other.columns
+                      if c not in join_keys and c not in fb.columns]
+        proportionally_attributed = (
+            fb
+            .take(rows)
+            .assign(FlowAmount=(fb['FlowAmount'].to_numpy()[rows]
+                                * flow_other[keep] / denominator[keep]),
+                    **{c: other[c].to_numpy()[other_rows]
+                       for c in other_cols})
+        )
+
+        # if the fbs method yamls specifies that a column from in the
+        # primary data source should be replaced with data from the
+        # attribution source, fill here
+        fill_col = self.config.get('fill_columns')
+        if fill_col is not None:
+            log.info(f'Replacing {fill_col} values in primary data source '
+                     f'with those from attribution source.')
+            proportionally_attributed[fill_col] = (
+                other[fill_col].to_numpy()[other_rows])
+
+        if directly_attributed is not None:
+            directly_attributed = fb.take(directly_attributed)
+            if fill_col is not None:
+                # directly attributed rows have no attribution source values
+                directly_attributed[fill_col] = np.nan
+            fb = pd.concat([directly_attributed, proportionally_attributed],
+                           ignore_index=True)
+        else:
+            fb = proportionally_attributed
 
         return (
             fb
@@ -1199,12 +1495,8 @@ class _FlowBy(pd.DataFrame):
             right_merge = ['PrimarySector', 'Location']
 
         # multiply using each dfs primary sector col
-        merged = (fb
-                  .merge(other,
-                         how='left',
-                         left_on=left_merge,
-                         right_on=right_merge,
-                         suffixes=[None, '_other'])
+        merged = (flowbyfunctions.JoinIndex(other, right_merge)
+                  .merge(fb, left_merge)
                   .fillna({'FlowAmount_other': 0})
                   )
 
@@ -1242,22 +1534,24 @@ class _FlowBy(pd.DataFrame):
 
         # set new units, incorporating a check that units are correctly
         # converted
+        units, unit_pairs = self._unit_pairs(fb)
         rate = None
-        if fb['Unit'].str.contains('/').all():
+        if units['Unit'].str.contains('/').all():
             rate = 'Unit'
             other = 'Unit_other'
-        elif fb['Unit_other'].str.contains('/').all():
+        elif units['Unit_other'].str.contains('/').all():
             rate = 'Unit_other'
             other = 'Unit'
         if rate is not None:
-            fb['Denominator'] = fb[rate].str.split("/").str[1]
-            fb[rate] = fb[rate].str.split("/").str[0]
-            if fb[other].equals(fb['Denominator']) is False:
+            units['Denominator'] = units[rate].str.split("/").str[1]
+            units[rate] = units[rate].str.split("/").str[0]
+            if units[other].equals(units['Denominator']) is False:
                 log.warning('Check units being multiplied')
             else:
                 log.info(f"Units reset to"
-                         f" {fb[rate].drop_duplicates().tolist()}")
-                fb['Unit'] = fb[rate] # updates when Unit_other is rate
+                         f" {units[rate].drop_duplicates().tolist()}")
+                units['Unit'] = units[rate] # updates when Unit_other is rate
+            fb['Unit'] = units['Unit'].to_numpy()[unit_pairs]
 
         return (
             fb
@@ -1288,14 +1582,11 @@ class _FlowBy(pd.DataFrame):
             other)
 
         # divide using each dfs primary sector col
-        merged = (fb
-                  .merge(other,
-                         how='left',
-                         left_on=['PrimarySector', 'temp_location'
-                                  if 'temp_location' in fb
-                                  else 'Location'],
-                         right_on=['PrimarySector', 'Location'],
-                         suffixes=[None, '_other'])
+        merged = (flowbyfunctions.JoinIndex(other,
+                                            ['PrimarySector', 'Location'])
+                  .merge(fb, ['PrimarySector', 'temp_location'
+                              if 'temp_location' in fb
+                              else 'Location'])
                   .fillna({'FlowAmount_other': 0})
                   )
 
@@ -1320,7 +1611,9 @@ class _FlowBy(pd.DataFrame):
                         )
 
         # set new units
-        fb['Unit'] = fb['Unit'] + '/' + fb['Unit_other']
+        units, unit_pairs = self._unit_pairs(fb)
+        fb['Unit'] = (units['Unit'] + '/' + units['Unit_other']
+                      ).to_numpy()[unit_pairs]
 
         return (
             fb
@@ -1330,6 +1623,28 @@ class _FlowBy(pd.DataFrame):
             .reset_index(drop=True)
         )
 
+    @staticmethod
+    def _unit_pairs(fb: 'FB') -> tuple:
+        '''
+        Finds the distinct pairs of Unit and Unit_other in fb, after a merge
+        with an attribution source, so that units can be reconciled once per
+        pair rather than once per row.
+
+        :param fb: FlowBy dataset with Unit and Unit_other columns
+        :return: tuple, (pd.DataFrame of the distinct pairs as strings, in
+            order of first appearance, array giving the pair of each row of
+            fb)
+        '''
+        pair_ids, first_rows = flowbyfunctions.factorize_columns(
+            fb, ['Unit', 'Unit_other'])
+        order = np.argsort(first_rows)
+        unit_pairs = np.empty_like(order)
+        unit_pairs[order] = np.arange(len(order))
+        units = pd.DataFrame(
+            {c: fb[c].to_numpy(dtype='object')[first_rows[order]]
+             for c in ['Unit', 'Unit_other']})
+        return units, unit_pairs[pair_ids]
+
     def equally_attribute(self: 'FB') -> 'FB':
         """
         This function takes a FlowByActivity dataset with SectorProducedBy and
@@ -1357,40 +1672,29 @@ class _FlowBy(pd.DataFrame):
         SectorConsumedBy). If necessary, flow amounts are further (equally)
         subdivided based on the secondary sector.
         """
-        naics_key = naics.map_target_sectors_to_less_aggregated_sectors(
-            self.config['industry_spec'], self.config['target_naics_year'])
+        hierarchy = naics.SectorHierarchy(
+            naics.map_target_sectors_to_less_aggregated_sectors(
+                self.config['industry_spec'],
+                self.config['target_naics_year']))
 
         fba = self.add_primary_secondary_columns('Sector')
 
         groupby_cols = ['group_id', 'Location']
         for rank in ['Primary', 'Secondary']:
-            fba = (
-                fba
-                .merge(naics_key, how='left', left_on=f'{rank}Sector',
-                       right_on='target_naics')
-                .assign(
-                    **{f'_unique_naics_{n}_by_group': lambda x, i=n: (
-                            x.groupby(groupby_cols if i == 2
-                                      else [*groupby_cols, f'_naics_{i-1}'],
-                                      dropna=False)
-                            [[f'_naics_{i}']]
-                            .transform('nunique', dropna=False)
-                        )
-                        for n in range(2, 8)},
-                    FlowAmount=lambda x: reduce(
-                        lambda x, y: x / y,
-                        [x.FlowAmount, *[x[f'_unique_naics_{n}_by_group']
-                                         for n in range(2, 8)]]
-                    )
-                )
-                .drop(columns=naics_key.columns.values.tolist())
-            )
+            # Repeat each row once per NAICS path below its sector, then
+            # divide FlowAmount by the number of distinct sectors at each
+            # level (2 through 7) within the group and parent sector
+            positions, key_rows = hierarchy.expand(fba[f'{rank}Sector'])
+            fba = fba.take(positions).reset_index(drop=True)
+            group_ids, _ = flowbyfunctions.factorize_columns(fba,
+                                                             groupby_cols)
+            fba = fba.assign(FlowAmount=reduce(
+                lambda x, y: x / y,
+                [fba.FlowAmount.to_numpy(),
+                 *hierarchy.fan_out(group_ids, key_rows)]))
             groupby_cols.append(f'{rank}Sector')
 
-        return fba.drop(
-            columns=['PrimarySector', 'SecondarySector',
-                     *[f'_unique_naics_{n}_by_group' for n in range(2, 8)]]
-        )
+        return fba.drop(columns=['PrimarySector', 'SecondarySector'])
 
     def add_primary_secondary_columns(
         self: FB,
@@ -1444,34 +1748,25 @@ class _FlowBy(pd.DataFrame):
                 )
 
             else:
+                produced = self[f'{col_type}ProducedBy']
+                consumed = self[f'{col_type}ConsumedBy']
+                primary_is_consumed = (
+                    ((self.FlowType == 'TECHNOSPHERE_FLOW')
+                     | (produced.isna())
+                     | (produced.isin(['22', '221', '2213', '22131', '221310'])
+                        & consumed.isin(['F010', 'F0100', 'F01000'])))
+                    & consumed.notna()
+                ).to_numpy(dtype=bool)
+                produced = produced.to_numpy(dtype='object')
+                consumed = consumed.to_numpy(dtype='object')
+
+                # The secondary sector or activity is whichever of
+                # ...ProducedBy or ...ConsumedBy is not primary
                 fb = self.assign(
-                    **{f'Primary{col_type}':
-                        self[f'{col_type}ProducedBy'].mask(
-                            ((self.FlowType == 'TECHNOSPHERE_FLOW')
-                             | (self[f'{col_type}ProducedBy'].isna())
-                             | (self[f'{col_type}ProducedBy'].isin(
-                                 ['22', '221', '2213', '22131', '221310']
-                             )
-                             & self[f'{col_type}ConsumedBy'].isin(
-                                 ['F010', 'F0100', 'F01000']
-                             )))
-                            & self[f'{col_type}ConsumedBy'].notna(),
-                            self[f'{col_type}ConsumedBy']
-                        )
-                       }
-                )
-
-                def _identify_secondary(row: _FlowBySeries) -> str:
-                    sectors = [row[f'{col_type}ProducedBy'],
-                               row[f'{col_type}ConsumedBy']]
-                    sectors.remove(row[f'Primary{col_type}'])
-                    return sectors[0]
-
-                fb = fb.assign(
-                    **{f'Secondary{col_type}': (
-                        fb.apply(_identify_secondary, axis='columns')
-                        # ^^^ Applying with axis='columns' applies TO each row.
-                        .astype('object'))}
+                    **{f'Primary{col_type}': np.where(primary_is_consumed,
+                                                      consumed, produced),
+                       f'Secondary{col_type}': np.where(primary_is_consumed,
+                                                        produced, consumed)}
                 )
 
             return fb
@@ -1482,7 +1777,8 @@ class _FlowBy(pd.DataFrame):
         return fb
 
     def to_parquet(self: FB, *args, **kwargs) -> None:
-        pd.DataFrame(self).to_parquet(*args, **kwargs)
+        pd.DataFrame(self.convert_categoricals_to_object()).to_parquet(
+            *args, **kwargs)
         # ^^^ For some reason, the extra features of a FlowBy stop the
         #     to_parquet method inherited from DatFrame from working, so this
         #     casts the data back to plain DataFrame to write to a parquet.
@@ -1501,9 +1797,14 @@ class _FlowBy(pd.DataFrame):
         column names back properly). This function fixes the problem by making
         it so DataFrame.astype() is not called by a FlowBy dataframe, but
         instead by a plain pd.DataFrame.
+
+        validated_fields is not passed on, since casting can change values
+        (e.g., NaN becomes 'nan' when cast to str), so every field is
+        normalized again.
         '''
         metadata = {attribute: self.__getattr__(attribute)
-                    for attribute in self._metadata}
+                    for attribute in self._metadata
+                    if attribute != 'validated_fields'}
         df = pd.DataFrame(self).astype(*args, **kwargs)
         fb = type(self)(df, add_missing_columns=False, **metadata)
 
@@ -1528,3 +1829,14 @@ class _FlowBySeries(pd.Series):
     @property
     def _constructor_expanddim(self) -> '_FlowBy':
         return _FlowBy
+
+    def where(self: S, cond, *args, **kwargs) -> S:
+        '''
+        Overrides Series.where() (and so also Series.mask()). A categorical
+        series cannot take values outside of its categories, so when
+        categorical storage is enabled the replacement values would raise a
+        TypeError. Categorical series are therefore cast to object first.
+        '''
+        if isinstance(self.dtype, pd.CategoricalDtype):
+            return self.astype('object').where(cond, *args, **kwargs)
+        return super().where(cond, *args, **kwargs)
@@ -20,11 +20,12 @@ import pandas as pd
 
 import flowsa.exceptions
 from flowsa import settings, metadata, geo, validation, naics, common, \
-    sectormapping, generateflowbyactivity
+    sectormapping, generateflowbyactivity, incremental, caching, partition
 from flowsa.flowsa_log import log
 from flowsa.settings import DEFAULT_DOWNLOAD_IF_MISSING
 from flowsa.flowbyfunctions import filter_by_geoscale
-from flowsa.flowby import _FlowBy, flowby_config, NAME_SEP_CHAR
+from flowsa.flowby import _FlowBy, _FlowBySeries, flowby_config, \
+    NAME_SEP_CHAR, concat_flowby
 
 if TYPE_CHECKING:
     from flowsa.flowbysector import FlowBySector
@@ -176,7 +177,11 @@ class FlowByActivity(_FlowBy):
         )
 
         mapping = (
-            fedelemflowlist.get_flowmapping(mapping_subset)[mapping_fields]
+            caching.run_cached(
+                caching.reference_tables,
+                ('get_flowmapping', repr(mapping_subset)),
+                lambda: fedelemflowlist.get_flowmapping(mapping_subset))
+            [mapping_fields]
             .assign(ConversionFactor=lambda x: x.ConversionFactor.fillna(1))
         )
         if mapping.empty:
@@ -703,8 +708,9 @@ class FlowByActivity(_FlowBy):
         if 'activity_sets' in self.config:
             try:
                 return (
-                    pd.concat([
-                        fba.prepare_fbs(
+                    concat_flowby([
+                        incremental.prepare_activity_set(
+                            fba,
                             external_config_path=external_config_path,
                             download_sources_ok=download_sources_ok,
                             skip_select_by=True,
@@ -722,7 +728,7 @@ class FlowByActivity(_FlowBy):
                 return FlowBySector(pd.DataFrame())
         log.info(f'Processing FlowBySector for {self.full_name}')
         # Primary FlowBySector generation approach:
-        return FlowBySector(
+        fba = (
             self
             .function_socket('clean_fba_before_mapping')
             .select_by_fields(skip_select_by=skip_select_by)
@@ -733,9 +739,33 @@ class FlowByActivity(_FlowBy):
             .convert_units_and_flows()  # and also map to flow lists
             .function_socket('clean_fba')
             .convert_to_geoscale()
+        )
+        attribute_kwargs = {'external_config_path': external_config_path,
+                            'download_sources_ok': download_sources_ok,
+                            'drop_cols': drop_cols}
+        if fba.config.get('partition_by_state'):
+            return FlowBySector(partition.prepare_by_state(
+                fba, attribute_kwargs,
+                max_workers=fba.config.get('partition_workers', 1)))
+        return FlowBySector(fba.attribute_and_aggregate(**attribute_kwargs))
+
+    def attribute_and_aggregate(
+            self: 'FlowByActivity',
+            external_config_path: str = None,
+            download_sources_ok: bool = True,
+            drop_cols: List[str] = None
+            ) -> 'FlowByActivity':
+        '''
+        The steps of prepare_fbs() after convert_to_geoscale(): attributes
+        flows to sectors, drops drop_cols, and aggregates. Run separately on
+        the rows of each state when partition_by_state is set (see
+        partition.py).
+        '''
+        return (
+            self
             .attribute_flows_to_sectors(external_config_path=external_config_path,
                                         download_sources_ok=download_sources_ok)  # recursive call to prepare_fbs
-            .drop(columns=drop_cols)
+            .drop(columns=drop_cols or [])
             .aggregate_flowby()
             .function_socket('clean_fbs_after_aggregation')
         )
@@ -755,54 +785,15 @@ class FlowByActivity(_FlowBy):
             return [self]
 
         log.info('Splitting %s into activity sets', self.full_name)
-        activities = self.config['activity_sets']
-        parent_config = {k: v for k, v in self.config.items()
-                         if k not in ['activity_sets',
-                                      'clean_fba_before_activity_sets']
-                         and not k.startswith('_')}
-        parent_fba = self.reset_index().rename(columns={'index': 'row'})
-
         child_fba_list = []
-        assigned_rows = set()
-        for activity_set, activity_config in activities.items():
-            log.info('Creating FlowByActivity for %s', activity_set)
-
-            child_fba = (
-                parent_fba
-                .add_full_name(
-                    f'{parent_fba.full_name}{NAME_SEP_CHAR}{activity_set}')
-                .select_by_fields(
-                    selection_fields=activity_config.get('selection_fields'),
-                    exclusion_fields=activity_config.get('exclusion_fields'))
-            )
-
-            child_fba.config = {**parent_config, **activity_config}
-            child_fba = child_fba.assign(SourceName=child_fba.full_name)
-
-            if set(child_fba.row) & assigned_rows:
-                log.critical(
-                    'Some rows from %s assigned to multiple activity '
-                    'sets. This will lead to double-counting:\n%s',
-                    parent_fba.full_name,
-                    child_fba.query(
-                        f'row in {list(set(child_fba.row) & assigned_rows)}'
-                    )
-                )
-                # raise ValueError('Some rows in multiple activity sets')
-
-            assigned_rows.update(child_fba.row)
+        for child_fba in self._split_activity_sets():
             if ((not child_fba.empty) and
                 len(child_fba.query('FlowAmount != 0')) > 0):
-                child_fba_list.append(child_fba.drop(columns='row'))
+                child_fba_list.append(child_fba)
             else:
                 log.error(f'Activity set {child_fba.full_name} is empty. '
                           'Check activity set definition!')
 
-        if set(parent_fba.row) - assigned_rows:
-            log.warning('Some rows from %s not assigned to an activity '
-                        'set. Is this intentional?', parent_fba.full_name)
-            unassigned = parent_fba.query('row not in @assigned_rows')
-
         return child_fba_list
 
     def convert_units_and_flows(
@@ -873,7 +864,7 @@ objects of these classes to return objects of these classes, as desired.
 For more information, see
 https://pandas.pydata.org/docs/development/extending.html
 """
-class _FBASeries(pd.Series):
+class _FBASeries(_FlowBySeries):
     _metadata = [*FlowByActivity()._metadata]
 
     @property
@@ -921,4 +912,5 @@ def getFlowByActivity(
     # if geographic level specified, only load rows in geo level
     if geographic_level is not None:
         fba = filter_by_geoscale(fba, geographic_level)
-    return pd.DataFrame(fba.reset_index(drop=True))
+    return pd.DataFrame(fba.reset_index(drop=True)
+                        .convert_categoricals_to_object())
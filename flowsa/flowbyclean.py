@@ -5,10 +5,9 @@ from __future__ import annotations
 
 import numpy as np
 import pandas as pd
-from flowsa.flowby import FB, get_flowby_from_config
-from flowsa.common import get_catalog_info
+from flowsa.flowby import FB
 from flowsa.flowsa_log import log
-from flowsa import (geo, location)
+from flowsa import (geo, location, planner)
 from flowsa.flowbyactivity import FlowByActivity
 from flowsa.flowbysector import FlowBySector
 from flowsa.naics import map_source_sectors_to_more_aggregated_sectors
@@ -47,15 +46,11 @@ def load_prepare_clean_source(
     except AttributeError:
         name, config = self.config['clean_source'], {}
 
-    clean_fbs = get_flowby_from_config(
+    clean_fbs = planner.load_prepared_source(
         name=name,
-        config={**{k: v for k, v in self.config.items()
-                   if k in self.config['method_config_keys']
-                   or k == 'method_config_keys'},
-                **get_catalog_info(name),
-                **config},
+        config=planner.source_config(self.config, name, config),
         download_sources_ok=download_sources_ok
-        ).prepare_fbs(download_sources_ok=download_sources_ok)
+    )
     return clean_fbs
 
 
@@ -6,6 +6,7 @@ Helper functions for flowbyactivity and flowbysector data
 """
 
 import numpy as np
+import pandas as pd
 from esupy.dqi import get_weighted_average
 import flowsa
 import flowsa.flowbyactivity
@@ -119,6 +120,171 @@ def aggregator(df, groupbycols, retain_zeros=True, flowcolname='FlowAmount'):
     return df_dfg
 
 
+def factorize_columns(df, columns):
+    """
+    Factorize one or more columns of a df into a single integer group key.
+    Groups are numbered in the order that df.groupby(columns, sort=True,
+    dropna=False, observed=True) returns them: NaN values are kept as their
+    own key and sorted last, and categorical columns are sorted by category.
+    :param df: df, Either flowbyactivity or flowbysector
+    :param columns: list, columns to factorize
+    :return: tuple, (array of the group number of each row, array of the
+        position of the first row of each group)
+    """
+    group_ids = np.zeros(len(df), dtype=np.int64)
+    n_groups = 1
+    for column in columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            codes = df[column].cat.codes.to_numpy(dtype=np.int64)
+            n_codes = len(df[column].cat.categories)
+        else:
+            codes, uniques = pd.factorize(df[column], sort=True)
+            n_codes = len(uniques)
+        # missing values are coded -1, recode so they sort last
+        codes = np.where(codes < 0, n_codes, codes)
+        n_codes += 1
+        if n_groups * n_codes > np.iinfo(np.int64).max // 2:
+            # renumber the groups found so far to avoid overflow
+            group_ids = np.unique(group_ids, return_inverse=True)[1]
+            n_groups = int(group_ids.max()) + 1
+        group_ids = group_ids * n_codes + codes
+        n_groups *= n_codes
+    _, first_rows, group_ids = np.unique(group_ids, return_index=True,
+                                         return_inverse=True)
+    return group_ids.reshape(-1), first_rows
+
+
+def sum_by_group(values, group_ids, n_groups):
+    """
+    Sum values by group, skipping NaN (as DataFrame.groupby().sum() does)
+    :param values: array of floats
+    :param group_ids: array, group number of each value, as returned by
+        factorize_columns()
+    :param n_groups: int, number of groups
+    :return: array of length n_groups
+    """
+    return np.bincount(group_ids,
+                       weights=np.where(np.isnan(values), 0, values),
+                       minlength=n_groups)
+
+
+class JoinIndex:
+    """
+    Index on the key columns of a df (the right side of a left merge), used
+    to find the matching rows of another df by position rather than by
+    merging. JoinIndex(right, right_on).expand(JoinIndex.match(left,
+    left_on)) returns the row pairs of left.merge(right, how='left',
+    left_on=left_on, right_on=right_on), in the same order. NaN keys match
+    NaN keys, as in a merge.
+    """
+    def __init__(self, right, right_on):
+        self.right = right
+        self.right_on = list(right_on)
+        self.uniques = []
+        self.combinations = []
+        codes = np.zeros(len(right), dtype=np.int64)
+        for column in self.right_on:
+            column_codes, uniques = pd.factorize(right[column])
+            if (column_codes < 0).any():
+                # give missing values their own code, so they are matched
+                column_codes = np.where(column_codes < 0, len(uniques),
+                                        column_codes)
+                uniques = uniques.append(pd.Index([np.nan], dtype='object'))
+            self.uniques.append(uniques)
+            combinations, codes = np.unique(
+                codes * len(uniques) + column_codes, return_inverse=True)
+            self.combinations.append(combinations)
+            codes = codes.reshape(-1)
+        # right rows of each key, in right order
+        self.order = np.argsort(codes, kind='stable')
+        self.counts = np.bincount(codes,
+                                  minlength=len(self.combinations[-1]))
+        self.starts = np.cumsum(self.counts) - self.counts
+
+    def match(self, left, left_on):
+        """
+        Finds the key of each row of left in the index.
+        :param left: df
+        :param left_on: list, columns of left matched to right_on, in order
+        :return: array, the key number of each row of left, or -1 if the
+            key is not found
+        """
+        codes = np.zeros(len(left), dtype=np.int64)
+        for column, uniques, combinations in zip(left_on, self.uniques,
+                                                 self.combinations):
+            values = left[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                column_codes = np.append(
+                    uniques.get_indexer(values.cat.categories),
+                    uniques.get_indexer([np.nan])
+                )[values.cat.codes.to_numpy()]
+            else:
+                values = values.to_numpy()
+                if values.dtype == object:
+                    values = np.where(pd.isna(values), np.nan, values)
+                column_codes = uniques.get_indexer(values)
+            combined = codes * len(uniques) + column_codes
+            positions = np.searchsorted(combinations, combined)
+            found = ((codes >= 0) & (column_codes >= 0)
+                     & (positions < len(combinations)))
+            found[found] = combinations[positions[found]] == combined[found]
+            codes = np.where(found, positions, -1)
+        return codes
+
+    def expand(self, codes):
+        """
+        Pairs each left row with every right row sharing its key, in right
+        order, or with no row (-1) if its key was not found, as a left merge
+        does.
+        :param codes: array, key number of each left row, from match()
+        :return: tuple, (array of left positions, array of right positions
+            or -1), one entry per merged row
+        """
+        found = codes >= 0
+        counts = np.ones(len(codes), dtype=np.int64)
+        counts[found] = self.counts[codes[found]]
+        starts = np.zeros(len(codes), dtype=np.int64)
+        starts[found] = self.starts[codes[found]]
+        positions = np.repeat(np.arange(len(codes)), counts)
+        offsets = (np.arange(counts.sum())
+                   - np.repeat(np.cumsum(counts) - counts, counts))
+        matched = found[positions]
+        right_positions = np.full(len(positions), -1, dtype=np.int64)
+        right_positions[matched] = self.order[
+            (starts[positions] + offsets)[matched]]
+        return positions, right_positions
+
+    def merge(self, left, left_on, suffix='_other'):
+        """
+        Equivalent to left.merge(right, how='left', left_on=left_on,
+        right_on=right_on, suffixes=[None, suffix]), built by taking rows of
+        left and right by position.
+        :param left: df
+        :param left_on: list, columns of left matched to right_on, in order
+        :param suffix: str, appended to the columns of right that are also
+            columns of left
+        :return: df of the same type as left, with a new index
+        """
+        positions, right_positions = self.expand(self.match(left, left_on))
+        # key columns with the same name on both sides are only kept once
+        shared_keys = [r for l, r in zip(left_on, self.right_on) if l == r]
+        right_columns = {}
+        for column in self.right.columns:
+            if column in shared_keys:
+                continue
+            values = self.right[column]
+            values = (values.array
+                      if pd.api.types.is_extension_array_dtype(values.dtype)
+                      else values.to_numpy())
+            right_columns[f'{column}{suffix}' if column in left.columns
+                          else column] = pd.api.extensions.take(
+                values, right_positions, allow_fill=True)
+        return (left
+                .take(positions)
+                .reset_index(drop=True)
+                .assign(**right_columns))
+
+
 def remove_parent_sectors_from_crosswalk(cw_load, sector_list):
     """
     Remove parent sectors to a list of sectors from the crosswalk
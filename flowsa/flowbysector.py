@@ -11,11 +11,15 @@ from __future__ import annotations
 import esupy.processed_data_mgmt
 import pandas as pd
 from pandas import ExcelWriter
-from flowsa import settings, metadata, common, exceptions, geo, naics
+from flowsa import (settings, metadata, common, exceptions, geo, naics,
+                    caching, planner, incremental)
 from flowsa.common import get_catalog_info, load_crosswalk
-from flowsa.flowby import _FlowBy, flowby_config, get_flowby_from_config
+from flowsa.flowby import _FlowBy, _FlowBySeries, flowby_config, \
+    get_flowby_from_config, concat_flowby
 from flowsa.flowbyfunctions import collapse_fbs_sectors
 from flowsa.settings import DEFAULT_DOWNLOAD_IF_MISSING
+from flowsa.checkpoint import CheckpointRun
+from flowsa.spill import finish_spilled
 from flowsa.flowsa_log import reset_log_file, log
 
 
@@ -114,6 +118,7 @@ class FlowBySector(_FlowBy):
         )
 
     @classmethod
+    @caching.generation_run()
     def generateFlowBySector(
             cls,
             method: str,
@@ -121,6 +126,10 @@ class FlowBySector(_FlowBy):
             download_sources_ok: bool = settings.DEFAULT_DOWNLOAD_IF_MISSING,
             retain_activity_columns: bool = False,
             append_sector_names=False,
+            max_workers: int = 1,
+            checkpoint: bool = False,
+            resume: bool = False,
+            spill: bool = False,
             **kwargs
     ) -> 'FlowBySector':
         '''
@@ -131,6 +140,20 @@ class FlowBySector(_FlowBy):
         :param download_fba_ok: bool, optional. Whether to attempt to download
             source data FlowByActivity files from EPA server rather than
             generating them.
+        :param max_workers: int, optional. If greater than 1, the sources in
+            source_names are prepared in parallel, in up to this many worker
+            processes. Log records are written in source order, and the
+            result is the same as when the sources are prepared one by one.
+        :param checkpoint: bool, optional. If True, each source is written,
+            once prepared, to a run directory in settings.checkpointpath,
+            and the sources are then combined from there.
+        :param resume: bool, optional. If True, checkpoint, and reuse the
+            sources completed by an earlier checkpointed run of the method
+            whose inputs have not changed.
+        :param spill: bool, optional. If True, each source is written to
+            disk once prepared, and the aggregation to the target geoscale
+            and sectors is done one group of flowables at a time, rather
+            than on all sources at once, to limit peak memory use.
         :kwargs: keyword arguments to pass to load_yaml_dict(). Possible kwargs
             include config.
         '''
@@ -139,6 +162,60 @@ class FlowBySector(_FlowBy):
                                               external_config_path,
                                               **kwargs)
 
+        # Outputs at coarser geoscales, derived from the generated FBS
+        derived_outputs = method_config.pop('derived_outputs', {})
+
+        prepared = cls._prepare_sources(
+            method, method_config,
+            external_config_path=external_config_path,
+            download_sources_ok=download_sources_ok,
+            retain_activity_columns=retain_activity_columns,
+            max_workers=max_workers,
+            checkpoint=checkpoint,
+            resume=resume)
+
+        if spill:
+            # write each source to disk as it is completed, then finish
+            # generation one bucket of flowables at a time
+            fbs = finish_spilled(prepared, method, method_config,
+                                 append_sector_names)
+        else:
+            fbs = concat_flowby(source_fbs for _, source_fbs in prepared
+                                )._finish_generation(method, method_config,
+                                                     append_sector_names)
+
+        # Save fbs and metadata, and derived outputs
+        fbs._write_outputs(
+            method,
+            common.load_yaml_dict(method, 'FBS', external_config_path,
+                                  **kwargs),
+            derived_outputs)
+
+        return fbs
+
+    @staticmethod
+    def _prepare_sources(
+            method: str,
+            method_config: dict,
+            external_config_path: str = None,
+            download_sources_ok: bool = settings.DEFAULT_DOWNLOAD_IF_MISSING,
+            retain_activity_columns: bool = False,
+            max_workers: int = 1,
+            checkpoint: bool = False,
+            resume: bool = False
+    ):
+        '''
+        Prepares the sources_to_cache and the sources of a method, the
+        first steps of generateFlowBySector(). method_config is modified in
+        place: sources_to_cache and source_names are popped, and the cached
+        sources are attached as 'cache'.
+        :param method: str, name of the FlowBySector method
+        :param method_config: dict, method config
+        :param external_config_path, download_sources_ok,
+            retain_activity_columns, max_workers, checkpoint, resume: as in
+            generateFlowBySector()
+        :return: generator of (source name, prepared FlowBySector) tuples
+        '''
         # Cache one or more sources by attaching to method_config
         to_cache = method_config.pop('sources_to_cache', {})
         if 'cache' in method_config:
@@ -169,39 +246,211 @@ class FlowBySector(_FlowBy):
 
         # Generate FBS from method_config
         sources = method_config.pop('source_names')
-
-        fbs = pd.concat([
-            get_flowby_from_config(
-                name=source_name,
-                config={
-                    **method_config,
-                    'method_config_keys': set(method_config.keys()),
-                    **get_catalog_info(source_name),
-                    **config
-                },
-                external_config_path=external_config_path,
-                download_sources_ok=download_sources_ok
-            ).prepare_fbs(external_config_path=external_config_path,
-                          download_sources_ok=download_sources_ok,
-                          retain_activity_columns=retain_activity_columns
-                          )
+        source_configs = {
+            source_name: {
+                **method_config,
+                'method_config_keys': set(method_config.keys()),
+                **get_catalog_info(source_name),
+                **config
+            }
             for source_name, config in sources.items()
-        ])
+        }
 
+        run = (CheckpointRun(method, resume=resume, prepare_kwargs={
+                   'external_config_path': external_config_path,
+                   'retain_activity_columns': retain_activity_columns})
+               if checkpoint or resume else None)
+        pending = source_configs
+        if run is not None:
+            completed = [source_name
+                         for source_name, config in source_configs.items()
+                         if run.completed(source_name, config)]
+            if completed:
+                log.info('Resuming %s from checkpoint, reusing %s', method,
+                         ', '.join(completed))
+            pending = {source_name: config
+                       for source_name, config in source_configs.items()
+                       if source_name not in completed}
+
+        if max_workers > 1:
+            # Prepare the attribution and clean sources of every source
+            # first, in parallel where they do not depend on each other.
+            # They are then reused by the primary sources (see
+            # planner.load_prepared_source()).
+            plan = planner.plan_method(
+                method_config,
+                {source_name: sources[source_name] for source_name in pending})
+            planner.execute(plan, max_workers, download_sources_ok)
+
+        def reusable(source_name, config):
+            """Whether a source was already prepared in this run, with the
+            same config, as an attribution or clean source, which are
+            prepared without these keyword arguments"""
+            return (external_config_path is None
+                    and not retain_activity_columns
+                    and planner.config_key(source_name, config)
+                    in caching.prepared_sources)
+
+        if max_workers > 1 and len(pending) > 1:
+            reused = [reusable(source_name, config)
+                      for source_name, config in pending.items()]
+            results = planner.prepare_in_parallel(
+                [(node.name, node.config,
+                  {k: caching.prepared_sources.get(k)
+                   for k in node.dependencies
+                   if k in caching.prepared_sources},
+                  {'external_config_path': external_config_path,
+                   'download_sources_ok': download_sources_ok},
+                  {'external_config_path': external_config_path,
+                   'download_sources_ok': download_sources_ok,
+                   'retain_activity_columns': retain_activity_columns})
+                 for node, reuse in zip(plan.primary, reused) if not reuse],
+                method_config['cache'], max_workers)
+            prepared = (
+                (source_name,
+                 planner.load_prepared_source(source_name, config,
+                                              download_sources_ok)
+                 if reuse else next(results))
+                for (source_name, config), reuse
+                in zip(pending.items(), reused)
+            )
+        else:
+            prepared = (
+                (source_name,
+                 planner.load_prepared_source(source_name, config,
+                                              download_sources_ok)
+                 if reusable(source_name, config)
+                 else get_flowby_from_config(
+                    name=source_name,
+                    config=config,
+                    external_config_path=external_config_path,
+                    download_sources_ok=download_sources_ok
+                 ).prepare_fbs(external_config_path=external_config_path,
+                               download_sources_ok=download_sources_ok,
+                               retain_activity_columns=retain_activity_columns
+                               ))
+                for source_name, config in pending.items()
+            )
+
+        if run is not None:
+            # write each source as it is completed, so that a failing
+            # source leaves the sources completed before it checkpointed,
+            # then combine the sources from their checkpoints
+            for source_name, source_fbs in prepared:
+                run.save(source_name, source_configs[source_name],
+                         source_fbs)
+            prepared = ((source_name, run.load(source_name, config))
+                        for source_name, config in source_configs.items())
+
+        return prepared
+
+    def _write_outputs(
+            self: 'FlowBySector',
+            method: str,
+            method_yaml: dict,
+            derived_outputs: dict = None
+    ) -> None:
+        '''
+        Saves a generated FlowBySector, then derives and saves its
+        derived_outputs.
+        :param method: str, name of the FlowBySector method
+        :param method_yaml: dict, method yaml, as recorded in the metadata
+        :param derived_outputs: dict, geoscale of each derived output, by
+            output name
+        '''
+        self._save_generated(method, method_yaml)
+
+        # Derive coarser geoscale outputs from fbs in the same run
+        for name, geoscale in (derived_outputs or {}).items():
+            derived = self.derive_geoscale_output(name, geoscale)
+            derived._save_generated(name, {**method_yaml,
+                                           'geoscale': geoscale})
+
+    def _save_generated(self: 'FlowBySector', name: str,
+                        method_yaml: dict) -> None:
+        '''
+        Writes a generated FlowBySector and its metadata to file, and starts
+        a new log file.
+        :param name: str, name of the FlowBySector output
+        :param method_yaml: dict, method yaml, as recorded in the metadata
+        '''
+        log.info(f'FBS generation complete, saving {name} to file')
+        meta = metadata.set_fb_meta(name, 'FlowBySector')
+        esupy.processed_data_mgmt.write_df_to_file(
+            self.convert_categoricals_to_object(), settings.paths, meta)
+        reset_log_file(name, meta)
+        metadata.write_metadata(source_name=name,
+                                config=method_yaml,
+                                fb_meta=meta,
+                                category='FlowBySector')
+        # methods generated later in the run load the new dataset
+        caching.dataset_saved('FlowBySector', name)
+
+    def derive_geoscale_output(
+            self: 'FlowBySector',
+            name: str,
+            geoscale: str
+    ) -> 'FlowBySector':
+        '''
+        Aggregates a generated FlowBySector to a coarser geoscale, as for
+        the derived_outputs of a method.
+        :param name: str, name of the derived FlowBySector
+        :param geoscale: str, target geoscale, no finer than the geoscale
+            of the calling FlowBySector
+        :return: FlowBySector
+        '''
+        if (geo.scale.from_string(geoscale)
+                < geo.scale.from_string(self.config['geoscale'])):
+            raise exceptions.FBSMethodConstructionError(
+                message=f'Derived output {name} cannot be at a finer '
+                        f'geoscale ({geoscale}) than '
+                        f'{self.config["geoscale"]}')
+        log.info('Deriving %s from %s at the %s geoscale', name,
+                 self.full_name, geoscale)
+        derived = (
+            self
+            .convert_fips_to_geoscale(geo.scale.from_string(geoscale))
+            .aggregate_flowby()
+        )
+        derived.full_name = name
+        derived.config = {**self.config, 'geoscale': geoscale}
+        return derived
+
+    def _finish_generation(
+            self: 'FlowBySector',
+            method: str,
+            method_config: dict,
+            append_sector_names: bool = False,
+            aggregate: bool = True
+    ) -> 'FlowBySector':
+        '''
+        Completes generateFlowBySector() once the sources of a method are
+        prepared and concatenated: aggregates to the target geoscale and
+        sectors, resets the data quality fields and optionally appends
+        sector names. Rows are only combined with rows of the same
+        Flowable, so the sources can also be finished in parts, as long as
+        each Flowable is in a single part.
+        :param method: str, name of the FlowBySector method
+        :param method_config: dict, method config
+        :param append_sector_names: bool, as in generateFlowBySector()
+        :param aggregate: bool, if False, rows are not aggregated, as when
+            aggregate_flowby() finds a rate or ratio unit. Used when
+            finishing in parts, where that check is made on all parts.
+        :return: FlowBySector
+        '''
+        fbs = self
         fbs.full_name = method
         fbs.config = method_config
 
         # drop year from LocationSystem for FBS use with USEEIO
         fbs['LocationSystem'] = fbs['LocationSystem'].str.split('_').str[0]
         # aggregate to target geoscale
-        fbs = (
-            fbs
-            .convert_fips_to_geoscale(
-                geo.scale.from_string(fbs.config.get('geoscale')))
-            .aggregate_flowby()
-        )
+        fbs = fbs.convert_fips_to_geoscale(
+            geo.scale.from_string(fbs.config.get('geoscale')))
+        if aggregate:
+            fbs = fbs.aggregate_flowby()
         # aggregate to target sector
-        fbs = fbs.sector_aggregation()
+        fbs = fbs.sector_aggregation(aggregate=aggregate)
 
         # set all data quality fields to none until implemented fully
         log.info('Reset all data quality fields to None')
@@ -230,24 +479,15 @@ class FlowBySector(_FlowBy):
                             f'NAICS_{fbs.config["target_naics_year"]}_Name':
                                 f'Sector{s}ByName'}))
 
-        # Save fbs and metadata
-        log.info(f'FBS generation complete, saving {method} to file')
-        meta = metadata.set_fb_meta(method, 'FlowBySector')
-        esupy.processed_data_mgmt.write_df_to_file(fbs, settings.paths, meta)
-        reset_log_file(method, meta)
-        metadata.write_metadata(source_name=method,
-                                config=common.load_yaml_dict(
-                                    method, 'FBS', external_config_path, **kwargs),
-                                fb_meta=meta,
-                                category='FlowBySector')
-
         return fbs
 
-    def sector_aggregation(self, industry_spec=None):
+    def sector_aggregation(self, industry_spec=None, aggregate=True):
         """
         In the event activity sets in an FBS are at a less aggregated target
         sector level than the overall target level, aggregate the sectors to
         the FBS target scale
+        :param aggregate: bool, if False, sectors are mapped to the target
+            scale without aggregating rows
         :return:
         """
         if industry_spec is None:
@@ -263,6 +503,8 @@ class FlowBySector(_FlowBy):
         for direction in sector_cols:
             if fbs[f'Sector{direction}'].isna().all():
                 continue
+            columns_to_group_by = (fbs.groupby_cols + ['group_id']
+                                   if 'group_id' in fbs else None)
             fbs = (
                 fbs
                 .rename(columns={f'Sector{direction}': 'source_naics'})
@@ -270,11 +512,10 @@ class FlowBySector(_FlowBy):
                        how='left')
                 .rename(columns={'target_naics': f'Sector{direction}'})
                 .drop(columns='source_naics')
-                .aggregate_flowby(columns_to_group_by = (
-                    fbs.groupby_cols + ['group_id'] if 'group_id' in fbs
-                    else None)
-                    )
             )
+            if aggregate:
+                fbs = fbs.aggregate_flowby(
+                    columns_to_group_by=columns_to_group_by)
 
         return fbs
 
@@ -288,8 +529,8 @@ class FlowBySector(_FlowBy):
         if 'activity_sets' in self.config:
             try:
                 return (
-                    pd.concat([
-                        fbs.prepare_fbs()
+                    concat_flowby([
+                        incremental.prepare_activity_set(fbs)
                         for fbs in (
                             self
                             .select_by_fields()
@@ -390,7 +631,7 @@ objects of these classes to return objects of these classes, as desired.
 For more information, see
 https://pandas.pydata.org/docs/development/extending.html
 """
-class _FBSSeries(pd.Series):
+class _FBSSeries(_FlowBySeries):
     _metadata = [*FlowBySector()._metadata]
 
     @property
@@ -429,7 +670,7 @@ def getFlowBySector(
         download_fbs_ok=download_FBS_if_missing,
         **kwargs
     )
-    return pd.DataFrame(fbs)
+    return pd.DataFrame(fbs.convert_categoricals_to_object())
 
 
 def collapse_FlowBySector(
@@ -1,4 +1,5 @@
 import logging
+import logging.handlers
 import shutil
 import sys
 from esupy.processed_data_mgmt import mkdir_if_missing
@@ -73,6 +74,44 @@ vlog.setLevel(logging.DEBUG)
 vlog.addHandler(validation_file_handler)
 
 
+class _RecordList(list):
+    """
+    List of log records, usable as the queue of a logging QueueHandler
+    """
+    put_nowait = list.append
+
+
+_captured_records = None
+
+
+def capture_log_records():
+    """
+    Keeps the records of log and vlog in a list instead of writing them.
+    Used in worker processes, which return the records to the main process
+    to be written there, in order, by replay_log_records().
+    :return: list, to which records are appended as they are logged
+    """
+    global _captured_records
+    _captured_records = _RecordList()
+    for logger in [log, vlog]:
+        for h in list(logger.handlers):
+            logger.removeHandler(h)
+        logger.addHandler(logging.handlers.QueueHandler(_captured_records))
+    # validation records are captured once, by the vlog handler
+    vlog.propagate = False
+    return _captured_records
+
+
+def replay_log_records(records):
+    """
+    Writes log records captured by capture_log_records() in another
+    process, with the handlers of this process
+    :param records: list of logging.LogRecord
+    """
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+
+
 def reset_log_file(filename, fb_meta):
     """
     Rename the log file saved to local directory using df meta and
@@ -80,6 +119,9 @@ def reset_log_file(filename, fb_meta):
     :param filename: str, name of dataset
     :param fb_meta: metadata for parquet
     """
+    if _captured_records is not None:
+        # log records are written by the main process, not a worker
+        return
     # original log file name - all log statements
     log_file = logoutputpath / "flowsa.log"
     # generate new log name
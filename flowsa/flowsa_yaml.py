@@ -1,4 +1,6 @@
 from typing import IO, Callable
+from copy import deepcopy
+import os
 import yaml
 import flowsa.settings
 from os import path
@@ -6,6 +8,52 @@ import csv
 import importlib
 
 
+class _Resolution:
+    '''
+    Files read while loading a yaml file (the file, the files it includes,
+    the index csvs it reads and the folders searched for them), and the
+    include targets and index csvs parsed so far, which are parsed once per
+    load rather than once per tag.
+    '''
+    def __init__(self) -> None:
+        self.versions = {}
+        self.parsed = {}
+        self.indexes = {}
+
+    def record(self, file: str) -> None:
+        self.versions[file] = _version(file)
+
+
+def _version(file: str):
+    '''Modification time and size of a file or folder, or None if missing'''
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# _Resolution of the yaml file being loaded, if any
+_resolution = None
+# configs loaded by load_file(), by file and external path, with the
+# versions of the files they were resolved from
+_resolved = {}
+
+
+def _find(file: str, folders: list) -> str:
+    '''
+    Path of file in the first of folders containing it. The folders
+    searched are recorded, so that a file added to one of them is found.
+    '''
+    for folder in folders:
+        candidate = path.join(folder, file)
+        _resolution.record(path.dirname(candidate))
+        if path.exists(candidate):
+            _resolution.record(candidate)
+            return candidate
+    raise FileNotFoundError(f'{file} not found')
+
+
 class FlowsaLoader(yaml.SafeLoader):
     '''
     Custom YAML loader implementing !include: tag to allow inheriting
@@ -25,23 +73,24 @@ class FlowsaLoader(yaml.SafeLoader):
     def include(loader: 'FlowsaLoader', suffix: str, node: yaml.Node) -> dict:
         file, *keys = suffix.split(':')
 
-        for folder in [
+        file = _find(file, [
             *loader.external_paths_to_search,
             flowsa.settings.sourceconfigpath,
             flowsa.settings.flowbysectormethodpath,
             flowsa.settings.datapath
-        ]:
-            if path.exists(path.join(folder, file)):
-                file = path.join(folder, file)
-                break
-        else:
-            raise FileNotFoundError(f'{file} not found')
+        ])
 
-        with open(file) as f:
-            branch = load(f, loader.external_path_to_pass)
+        key = (file, loader.external_path_to_pass)
+        if key not in _resolution.parsed:
+            with open(file) as f:
+                _resolution.parsed[key] = load(f,
+                                               loader.external_path_to_pass)
+        branch = _resolution.parsed[key]
 
         while keys:
             branch = branch[keys.pop(0)]
+        # the parsed file is shared by every tag including it
+        branch = deepcopy(branch)
 
         if isinstance(node, yaml.MappingNode):
             if isinstance(branch, dict):
@@ -84,24 +133,23 @@ class FlowsaLoader(yaml.SafeLoader):
         if not isinstance(node, yaml.ScalarNode):
             raise TypeError('Can only tag a scalar node with !from_index:')
 
-        for folder in [
+        file = _find(file, [
             *loader.external_paths_to_search,
             flowsa.settings.flowbysectoractivitysetspath
-        ]:
-            if path.exists(path.join(folder, file)):
-                file = path.join(folder, file)
-                break
-        else:
-            raise FileNotFoundError(f'{file} not found')
+        ])
 
         activity_set = loader.construct_scalar(node)
 
-        with open(file, 'r', encoding='utf-8-sig', newline='') as f:
-            index = csv.DictReader(f)
-            return [
-                row['name'] for row in index
-                if row['activity_set'] == activity_set
-            ]
+        if file not in _resolution.indexes:
+            with open(file, 'r', encoding='utf-8-sig', newline='') as f:
+                _resolution.indexes[file] = [
+                    (row['activity_set'], row['name'])
+                    for row in csv.DictReader(f)
+                ]
+        return [
+            name for row_set, name in _resolution.indexes[file]
+            if row_set == activity_set
+        ]
 
     @staticmethod
     def script_function(
@@ -137,6 +185,10 @@ class FlowsaLoader(yaml.SafeLoader):
 
 
 def load(stream: IO, external_path: str = None) -> dict:
+    global _resolution
+    outermost = _resolution is None
+    if outermost:
+        _resolution = _Resolution()
     loader = FlowsaLoader(stream)
     if external_path:
         loader.external_paths_to_search.append(external_path)
@@ -149,3 +201,62 @@ def load(stream: IO, external_path: str = None) -> dict:
         return loader.get_single_data()
     finally:
         loader.dispose()
+        if outermost:
+            _resolution = None
+
+
+def load_file(file: str, external_path: str = None) -> dict:
+    '''
+    Loads a yaml file, as load() does. The resolved config is cached
+    until the file, any file it includes (directly or not), any index csv
+    it reads, or any folder searched for them, including external config
+    paths, is modified.
+    :param file: str, path to the yaml file
+    :param external_path: str, as in load()
+    :return: dict, a copy of the cached config
+    '''
+    global _resolution
+    key = (path.abspath(file), external_path)
+    entry = _resolved.get(key)
+    if entry is not None and unchanged(entry[0]):
+        return deepcopy(entry[1])
+
+    resolution = _Resolution()
+    resolution.record(file)
+    outer, _resolution = _resolution, resolution
+    try:
+        with open(file, 'r', encoding='utf-8') as f:
+            config = load(f, external_path)
+    finally:
+        _resolution = outer
+    _resolved[key] = (resolution.versions, config)
+    return deepcopy(config)
+
+
+def resolved_from(file: str, external_path: str = None) -> dict:
+    '''
+    Files a config loaded with load_file() was resolved from (see
+    load_file()), with their versions
+    :param file: str, path to the yaml file
+    :param external_path: str, as in load_file()
+    :return: dict, modification time and size, or None for a missing file
+        or folder, by path. Empty if the file was not loaded.
+    '''
+    entry = _resolved.get((path.abspath(file), external_path))
+    return {} if entry is None else dict(entry[0])
+
+
+def unchanged(versions: dict) -> bool:
+    '''
+    Whether files are as recorded by resolved_from(), e.g. after being
+    saved as json, which turns versions into lists
+    :param versions: dict, version of each file, by path
+    :return: bool
+    '''
+    return all(_version(f) == (None if v is None else tuple(v))
+               for f, v in versions.items())
+
+
+def clear_cache() -> None:
+    '''Drops the configs cached by load_file()'''
+    _resolved.clear()
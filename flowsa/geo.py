@@ -2,7 +2,7 @@ from typing import Literal
 import enum
 from functools import total_ordering
 import pandas as pd
-from . import settings
+from . import caching, settings
 from .flowsa_log import log
 
 
@@ -70,14 +70,16 @@ def get_all_fips(year: Literal[2010, 2013, 2015] = 2015) -> pd.DataFrame:
         'State' is NaN for national level FIPS ('00000'), and 'County'
         is Nan for national and each state level FIPS.
     '''
-    return (pd
-            .read_csv(settings.datapath / 'FIPS_Crosswalk.csv',
-                      header=0, dtype=object)
-            [['State', f'FIPS_{year}', f'County_{year}']]
-            .rename(columns={f'FIPS_{year}': 'FIPS',
-                             f'County_{year}': 'County'})
-            .sort_values('FIPS')
-            .reset_index(drop=True))
+    path = settings.datapath / 'FIPS_Crosswalk.csv'
+    return caching.reference_data.cached(
+        ('get_all_fips', year), [path],
+        lambda: (caching.reference_data
+                 .read_csv(path, dtype='str')
+                 [['State', f'FIPS_{year}', f'County_{year}']]
+                 .rename(columns={f'FIPS_{year}': 'FIPS',
+                                  f'County_{year}': 'County'})
+                 .sort_values('FIPS')
+                 .reset_index(drop=True)))
 
 
 def filtered_fips(
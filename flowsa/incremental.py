@@ -0,0 +1,253 @@
+"""
+Incremental regeneration of FlowBySector methods. When a method yaml sets
+`incremental: True`, each activity set, once prepared with prepare_fbs(), is
+saved as a parquet in settings.activitysetoutputpath, under a fingerprint of
+
+- its resolved config,
+- the code of flowsa and of the functions assigned in its config,
+- the data it is prepared from, and the files of the attribution and clean
+  sources it loads.
+
+When the method is generated again, activity sets whose fingerprint has not
+changed are loaded from their parquet rather than prepared again.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import weakref
+from pathlib import Path
+import pandas as pd
+from flowsa import caching, planner, settings
+from flowsa.common import local_dataset
+from flowsa.flowsa_log import log
+
+# separates the name of an activity set from its fingerprint in file names
+_KEY_SEP = '--'
+
+# file hashes, by (path, size, modification time)
+_file_hashes = {}
+# fingerprints of sources_to_cache, by id, with a weak reference to the source
+_cache_fingerprints = {}
+
+
+def file_hash(path) -> str:
+    """
+    sha1 of the contents of a file. Hashes are kept for as long as the file
+    is unchanged (same size and modification time).
+    :param path: str or Path
+    :return: str, hex digest
+    """
+    stat = os.stat(path)
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def _code_files(config) -> set:
+    """Source files of the functions in a (nested) config"""
+    if isinstance(config, dict):
+        return set().union(*map(_code_files, config.values()))
+    if isinstance(config, (list, tuple)):
+        return set().union(*map(_code_files, config))
+    if callable(config):
+        try:
+            return {inspect.getsourcefile(config)}
+        except TypeError:
+            return set()
+    return set()
+
+
+def code_identity(config: dict) -> dict:
+    """
+    Hashes of the flowsa modules and of the source files of the functions
+    assigned in config, e.g. by !script_function
+    :param config: dict
+    :return: dict, {file name: hash}
+    """
+    files = {str(f) for f in [*settings.MODULEPATH.glob('*.py'),
+                              *_code_files(config)]
+             if f is not None and os.path.exists(f)}
+    return {os.path.relpath(f, settings.MODULEPATH): file_hash(f)
+            for f in sorted(files)}
+
+
+def _cached_fingerprint(fb) -> str:
+    """caching.fingerprint() of a source in sources_to_cache, computed
+    once per source"""
+    ref, digest = _cache_fingerprints.get(id(fb), (None, None))
+    if ref is None or ref() is not fb:
+        digest = caching.fingerprint(fb)
+        _cache_fingerprints[id(fb)] = (weakref.ref(fb), digest)
+    return digest
+
+
+def _source_files(plan, skip: str = None) -> dict:
+    """
+    Hashes of the stored files of the FBA and FBS datasets in a plan
+    :param plan: planner.Plan
+    :param skip: str, key of a node to leave out
+    :return: dict, {file name: hash}, or None if a dataset is not stored
+        locally
+    """
+    files = {}
+    for key, node in plan.nodes.items():
+        if key == skip or node.config.get('data_format') not in ['FBA',
+                                                                  'FBS']:
+            continue
+        dataset = local_dataset(node.name, node.config)
+        if dataset['path'] is None:
+            return None
+        files[dataset['file']] = file_hash(dataset['path'])
+    return files
+
+
+def _cache_identity(config: dict) -> dict:
+    return {name: _cached_fingerprint(cached)
+            for name, cached in (config.get('cache') or {}).items()
+            if cached is not None}
+
+
+def input_identity(fb) -> dict:
+    """
+    Identifies the data an activity set is prepared from: the activity set
+    itself, the stored files of the attribution and clean sources it loads,
+    and the sources it uses from sources_to_cache.
+    :param fb: FlowBy, an activity set before prepare_fbs()
+    :return: dict, or None if an attribution or clean source is not stored
+        locally, and so can not yet be identified by its file
+    """
+    plan = planner.Plan()
+    files = _source_files(plan, skip=plan.add(fb.full_name, fb.config))
+    if files is None:
+        return None
+    return {
+        'data': caching.fingerprint(fb),
+        'files': files,
+        'cache': _cache_identity(fb.config)
+    }
+
+
+def activity_set_key(fb, prepare_kwargs: dict) -> str:
+    """
+    Fingerprint of an activity set, as described in the module docstring
+    :param fb: FlowBy, an activity set before prepare_fbs()
+    :param prepare_kwargs: dict, keyword arguments passed to prepare_fbs()
+        that change its result
+    :return: str, hex digest, or None if it can not be determined
+    """
+    inputs = input_identity(fb)
+    if inputs is None:
+        return None
+    return hashlib.sha1(json.dumps([
+        planner.config_key(fb.full_name, fb.config),
+        code_identity(fb.config),
+        inputs,
+        planner._normalize(prepare_kwargs),
+    ], sort_keys=True).encode()).hexdigest()
+
+
+def source_key(name: str, config: dict, prepare_kwargs: dict) -> str:
+    """
+    Fingerprint of a source, as for activity_set_key(), but identifying its
+    data by the stored file it is loaded from rather than by its contents,
+    so that it can be determined without loading the source.
+    :param name: str, source name
+    :param config: dict, source config
+    :param prepare_kwargs: dict, keyword arguments passed to prepare_fbs()
+        that change its result
+    :return: str, hex digest, or None if the source, or an attribution or
+        clean source it loads, is not stored locally
+    """
+    plan = planner.Plan()
+    plan.add(name, config)
+    files = _source_files(plan)
+    if files is None:
+        return None
+    return hashlib.sha1(json.dumps([
+        planner.config_key(name, config),
+        code_identity(config),
+        {'files': files, 'cache': _cache_identity(config)},
+        planner._normalize(prepare_kwargs),
+    ], sort_keys=True).encode()).hexdigest()
+
+
+def _path(full_name: str, key: str) -> Path:
+    return (settings.activitysetoutputpath
+            / f'{full_name}{_KEY_SEP}{key}.parquet')
+
+
+def _prepared_config(config: dict) -> dict:
+    """
+    Config of an activity set after prepare_fbs(), which ends with the
+    config of its last attribution step (see attribute_flows_to_sectors())
+    """
+    steps = config.get('attribute', config)
+    step = steps if isinstance(steps, dict) else (steps or [{}])[-1]
+    return {**{k: v for k, v in config.items()
+               if k not in planner._NOT_INHERITED
+               and not k.startswith('_')},
+            **step}
+
+
+def prepare_activity_set(fb, **kwargs):
+    """
+    Prepares an activity set with fb.prepare_fbs(**kwargs). If the config
+    of fb sets `incremental: True`, the result is saved under the
+    fingerprint of fb, or loaded if it was saved by an earlier run with the
+    same fingerprint.
+    :param fb: FlowBy, an activity set
+    :kwargs: keyword arguments passed to prepare_fbs()
+    :return: FlowBySector
+    """
+    if not fb.config.get('incremental'):
+        return fb.prepare_fbs(**kwargs)
+
+    from flowsa.flowbysector import FlowBySector
+
+    prepare_kwargs = {k: v for k, v in kwargs.items()
+                      if k in ['external_config_path',
+                               'retain_activity_columns']}
+    key = activity_set_key(fb, prepare_kwargs)
+    if key is not None and _path(fb.full_name, key).exists():
+        log.info('Loading %s from %s, unchanged since it was last prepared',
+                 fb.full_name, settings.activitysetoutputpath)
+        return FlowBySector(
+            pd.read_parquet(_path(fb.full_name, key)),
+            full_name=fb.full_name,
+            config=_prepared_config(fb.config))
+
+    prepared = fb.prepare_fbs(**kwargs)
+    # attribution and clean sources not stored locally before prepare_fbs()
+    # are once it has generated them, so the fingerprint may now be known
+    key = key or activity_set_key(fb, prepare_kwargs)
+    if key is None:
+        log.warning('Not saving %s for incremental regeneration, as some of '
+                    'the sources it loads are not stored locally',
+                    fb.full_name)
+        return prepared
+    save_activity_set(prepared, fb.full_name, key)
+    return prepared
+
+
+def save_activity_set(fbs, full_name: str, key: str) -> None:
+    """
+    Saves a prepared activity set under its fingerprint, replacing any
+    earlier version of the same activity set.
+    :param fbs: FlowBySector, prepared activity set
+    :param full_name: str, name of the activity set
+    :param key: str, fingerprint, as returned by activity_set_key()
+    """
+    settings.activitysetoutputpath.mkdir(parents=True, exist_ok=True)
+    path = _path(full_name, key)
+    for f in os.scandir(settings.activitysetoutputpath):
+        if f.name.rsplit(_KEY_SEP, 1)[0] == full_name and f.path != str(path):
+            os.remove(f.path)
+    fbs.to_parquet(path, index=False)
+    log.info('Saved %s for incremental regeneration', full_name)
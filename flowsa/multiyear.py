@@ -0,0 +1,230 @@
+"""
+Generates the years of a FlowBySector method that differ only by year,
+e.g. Employment_national_{year}, as a grouped batch in one generation run.
+The sources of each year are still prepared one year at a time, but with
+the crosswalks, sector keys and attribution sources shared between years
+(see caching.py) loaded once. The prepared sources of every year are then
+concatenated with the method of each row as an extra key, and aggregated
+to the target geoscale and sectors in one finishing pass before being
+split into one FBS per year. Preparation usually dominates the run time,
+so the time saved is that of the shared inputs and of the finishing
+passes of all but one year: expect a modest speedup over generating the
+years one by one, not one proportional to the number of years. Run from
+the command line with, e.g.
+
+python -m flowsa "Employment_national_{year}" --years 2015 2016 2017
+"""
+
+from flowsa import caching, settings
+from flowsa.common import load_yaml_dict
+from flowsa.flowsa_log import log
+
+METHOD_COLUMN = 'temp_method'
+# config keys used to finish the generation of a group of years (see
+# FlowBySector._finish_generation()), which must be equal, not only equal
+# once the year is replaced, for years to be generated together
+FINISH_KEYS = ['industry_spec', 'target_naics_year', 'geoscale']
+
+
+def year_template(value, year: int):
+    """
+    Replaces the year, and strings containing it, in a method config with
+    a placeholder, so that the configs of methods which differ only by
+    year are equal
+    :param value: method config, or a value in it
+    :param year: int, year of the method
+    :return: method config with '{year}' in place of year
+    """
+    if isinstance(value, dict):
+        return {year_template(k, year): year_template(v, year)
+                for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(year_template(v, year) for v in value)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value == year:
+        return '{year}'
+    if isinstance(value, str):
+        return value.replace(str(year), '{year}')
+    return value
+
+
+def group_years(configs: dict) -> list:
+    """
+    Groups years whose method configs differ only by year, and whose
+    FINISH_KEYS are equal, since a group is finished with the config of
+    its first year
+    :param configs: dict, method config by year
+    :return: list of lists of years
+    """
+    groups = []
+    for year, config in configs.items():
+        template = (year_template(config, year),
+                    [config.get(k) for k in FINISH_KEYS])
+        for group_template, years in groups:
+            if group_template == template:
+                years.append(year)
+                break
+        else:
+            groups.append((template, [year]))
+    return [years for _, years in groups]
+
+
+def generate_years(
+        method: str,
+        years: list,
+        external_config_path: str = None,
+        download_sources_ok: bool = settings.DEFAULT_DOWNLOAD_IF_MISSING,
+        retain_activity_columns: bool = False,
+        append_sector_names: bool = False,
+        max_workers: int = 1,
+        checkpoint: bool = False,
+        resume: bool = False,
+        spill: bool = False,
+        **kwargs
+) -> dict:
+    """
+    Generates a FlowBySector method for several years. Years whose method
+    yamls differ only by year are generated together, the others one by
+    one with generateFlowBySector(). Each year is saved as its own FBS,
+    with its own metadata and derived_outputs, and is the same as when it
+    is generated on its own.
+    :param method: str, name of the FlowBySector method, with {year} in
+        place of the year, e.g. 'GHG_national_{year}_m1'
+    :param years: list of int, years to generate
+    :param external_config_path: str, optional. If given, tells flowsa
+        where to look for the method yamls
+    :param download_sources_ok, retain_activity_columns,
+        append_sector_names, max_workers, checkpoint, resume, spill: as in
+        generateFlowBySector(). Each year is checkpointed as its own
+        method.
+    :kwargs: keyword arguments to pass to load_yaml_dict()
+    :return: dict, generated FlowBySector by method name
+    """
+    from flowsa.flowbysector import FlowBySector
+
+    methods = {year: method.format(year=year) for year in years}
+    configs = {year: load_yaml_dict(name, 'FBS', external_config_path,
+                                    **kwargs)
+               for year, name in methods.items()}
+    generated = {}
+    with caching.generation_run():
+        for group in group_years(configs):
+            if len(group) == 1:
+                name = methods[group[0]]
+                generated[name] = FlowBySector.generateFlowBySector(
+                    name,
+                    external_config_path=external_config_path,
+                    download_sources_ok=download_sources_ok,
+                    retain_activity_columns=retain_activity_columns,
+                    append_sector_names=append_sector_names,
+                    max_workers=max_workers,
+                    checkpoint=checkpoint,
+                    resume=resume,
+                    spill=spill,
+                    **kwargs)
+                continue
+            generated.update(_generate_group(
+                {year: methods[year] for year in group},
+                {year: configs[year] for year in group},
+                external_config_path=external_config_path,
+                download_sources_ok=download_sources_ok,
+                retain_activity_columns=retain_activity_columns,
+                append_sector_names=append_sector_names,
+                max_workers=max_workers,
+                checkpoint=checkpoint,
+                resume=resume,
+                spill=spill,
+                **kwargs))
+    return generated
+
+
+def _generate_group(methods: dict, configs: dict,
+                    external_config_path: str = None,
+                    download_sources_ok: bool = True,
+                    retain_activity_columns: bool = False,
+                    append_sector_names: bool = False,
+                    max_workers: int = 1,
+                    checkpoint: bool = False,
+                    resume: bool = False,
+                    spill: bool = False,
+                    **kwargs) -> dict:
+    """
+    Generates methods which differ only by year in a single finishing
+    pass, with METHOD_COLUMN as an extra key
+    :param methods: dict, method name by year
+    :param configs: dict, method config by year
+    :return: dict, generated FlowBySector by method name
+    """
+    from flowsa.flowby import concat_flowby
+    from flowsa.spill import finish_spilled
+
+    log.info('Generating %s together', ', '.join(methods.values()))
+    derived_outputs = {year: configs[year].pop('derived_outputs', {})
+                       for year in methods}
+
+    # methods with a rate or ratio unit, which aggregate_flowby() does not
+    # aggregate, are finished apart from the others, so that each method
+    # is aggregated as when it is generated on its own
+    rate_methods = set()
+
+    def prepared():
+        """Prepared sources of every year, one year after the other"""
+        from flowsa.flowbysector import FlowBySector
+
+        for year, name in methods.items():
+            log.info('Beginning FlowBySector generation for %s', name)
+            for source_name, source_fbs in FlowBySector._prepare_sources(
+                    name, configs[year],
+                    external_config_path=external_config_path,
+                    download_sources_ok=download_sources_ok,
+                    retain_activity_columns=retain_activity_columns,
+                    max_workers=max_workers,
+                    checkpoint=checkpoint,
+                    resume=resume):
+                if (source_fbs['Unit'].dropna().astype(str)
+                        .str.contains('/').any()):
+                    rate_methods.add(name)
+                yield source_name, source_fbs.assign(**{METHOD_COLUMN: name})
+
+    first = next(iter(methods))
+    # columns of the finished rows, with and without rate units, which
+    # _finish_generation() may order differently
+    columns = {}
+
+    def finish(fbs, aggregate=True):
+        """Finishes the rows of the methods with and without rate units
+        apart, the former with aggregate as given"""
+        has_rate = fbs[METHOD_COLUMN].isin(rate_methods).to_numpy()
+        parts = []
+        for rate, rows in [(False, ~has_rate), (True, has_rate)]:
+            if rows.any():
+                parts.append(
+                    fbs[rows].reset_index(drop=True)._finish_generation(
+                        methods[first], configs[first], append_sector_names,
+                        aggregate=aggregate or not rate))
+                columns[rate] = [c for c in parts[-1].columns
+                                 if c != METHOD_COLUMN]
+        return concat_flowby(parts)
+
+    if spill:
+        fbs = finish_spilled(prepared(), methods[first], configs[first],
+                             append_sector_names, finish=finish)
+    else:
+        fbs = finish(concat_flowby(source_fbs
+                                   for _, source_fbs in prepared()))
+
+    generated = {}
+    for year, name in methods.items():
+        year_fbs = (fbs.loc[fbs[METHOD_COLUMN] == name,
+                            columns.get(name in rate_methods,
+                                        fbs.columns.drop(METHOD_COLUMN))]
+                    .reset_index(drop=True))
+        year_fbs.full_name = name
+        year_fbs.config = configs[year]
+        year_fbs._write_outputs(
+            name,
+            load_yaml_dict(name, 'FBS', external_config_path, **kwargs),
+            derived_outputs[year])
+        generated[name] = year_fbs
+    return generated
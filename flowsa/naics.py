@@ -3,7 +3,7 @@ import pandas as pd
 import numpy as np
 from flowsa.flowbyfunctions import aggregator
 from flowsa.flowsa_log import vlog, log
-from . import (common, settings)
+from . import (caching, common, settings)
 
 
 def return_naics_crosswalk(
@@ -60,8 +60,53 @@ def industry_spec_key(
         then any non-default keys must be NAICS codes with exactly 3 digits).
     3.  Each dictionary is applied only to those codes matching its parent
         key (with the root dictionary being applied to all codes).
+
+    Keys are cached for each industry_spec and year (see _cached_key()).
+    """
+    return _cached_key(_industry_spec_key, year, industry_spec)
+
+
+def canonical_spec(industry_spec):
+    """
+    Hashable form of a (possibly nested) industry_spec, equal for specs
+    which differ only in the order in which the codes of a level are
+    listed. The order of the levels is kept, because a later level takes
+    precedence over an earlier one.
+    :param industry_spec: dict, or a value in it
+    :return: tuple, or the value if it is neither a dict nor a list
+    """
+    if isinstance(industry_spec, dict):
+        return ('dict', *((k, canonical_spec(v))
+                          for k, v in industry_spec.items()))
+    if isinstance(industry_spec, (list, tuple, set)):
+        return ('list', *sorted({canonical_spec(v) for v in industry_spec},
+                                key=repr))
+    return industry_spec
+
+
+def _cached_key(
+    build,
+    year: Literal[2002, 2007, 2012, 2017],
+    industry_spec: dict = None
+) -> pd.DataFrame:
+    """
+    build(industry_spec, year), or build(year) if no industry_spec is
+    given, cached in caching.reference_data by canonical_spec() and year
+    for as long as the NAICS crosswalk of the year is unchanged, and saved
+    to disk for later flowsa processes
     """
+    args = (year,) if industry_spec is None else (industry_spec, year)
+    return caching.reference_data.cached(
+        (build.__name__, canonical_spec(industry_spec), year),
+        [settings.datapath / f'NAICS_{year}_Crosswalk.csv'],
+        lambda: build(*args),
+        persist=True)
 
+
+def _industry_spec_key(
+    industry_spec: dict,
+    year: Literal[2002, 2007, 2012, 2017]
+) -> pd.DataFrame:
     naics = return_naics_crosswalk(year)
     naics = naics.assign(
         target_naics=naics[industry_spec['default']])
@@ -101,6 +146,14 @@ def map_target_sectors_to_less_aggregated_sectors(
     Map target NAICS to all possible other sector lengths
     flat hierarchy
     """
+    return _cached_key(_map_target_sectors_to_less_aggregated_sectors, year,
+                       industry_spec)
+
+
+def _map_target_sectors_to_less_aggregated_sectors(
+    industry_spec: dict,
+    year: Literal[2002, 2007, 2012, 2017]
+) -> pd.DataFrame:
     naics = return_naics_crosswalk(year)
     naics = naics.assign(
         target_naics=naics[industry_spec['default']])
@@ -139,6 +192,102 @@ def map_target_sectors_to_less_aggregated_sectors(
     return naics.drop_duplicates().reset_index(drop=True)
 
 
+class SectorHierarchy:
+    """
+    Integer-coded form of the key returned by
+    map_target_sectors_to_less_aggregated_sectors(), used for equal
+    attribution. Each row of the key is one path through the NAICS
+    hierarchy (_naics_2 to _naics_7) below a target sector, and the values
+    at each level are stored as integer codes (with NaN as its own code).
+    """
+    levels = range(2, 8)
+
+    def __init__(self, naics_key: pd.DataFrame) -> None:
+        # codes of each level, with an extra all-NaN row (position
+        # len(naics_key)) for sectors not found in the key
+        self.null_row = len(naics_key)
+        target_codes, self.targets = self._factorize(naics_key['target_naics'])
+        # key rows of each target, in key order
+        self.order = np.append(np.argsort(target_codes, kind='stable'),
+                               self.null_row)
+        self.counts = np.bincount(target_codes, minlength=len(self.targets))
+        self.starts = np.cumsum(self.counts) - self.counts
+        self.level_codes = {
+            n: self._factorize(pd.concat(
+                [naics_key[f'_naics_{n}'],
+                 pd.Series([np.nan], dtype='object')]))[0]
+            for n in self.levels}
+
+    @staticmethod
+    def _factorize(values: pd.Series) -> tuple:
+        """
+        pd.factorize(), with NaN given its own code (the last) rather than -1
+        """
+        codes, uniques = pd.factorize(values)
+        if (codes < 0).any():
+            codes = np.where(codes < 0, len(uniques), codes)
+            uniques = uniques.append(pd.Index([np.nan], dtype='object'))
+        return codes.astype(np.int64), uniques
+
+    def expand(self, sectors: pd.Series) -> tuple:
+        """
+        Equivalent to a left merge of the key onto the given sectors (on
+        target_naics): each sector is repeated once for each key row with
+        that target, in key order, or kept once (matched to the all-NaN row)
+        if it is not a target.
+
+        :param sectors: pd.Series of target sectors
+        :return: tuple, (positions in sectors of each expanded row, key row
+            of each expanded row)
+        """
+        values = sectors.to_numpy(dtype='object')
+        target = self.targets.get_indexer(
+            np.where(pd.isna(values), np.nan, values))
+        found = target >= 0
+        counts = np.where(found, self.counts[target], 1)
+        positions = np.repeat(np.arange(len(sectors)), counts)
+        offsets = (np.arange(counts.sum())
+                   - np.repeat(np.cumsum(counts) - counts, counts))
+        key_rows = np.where(
+            found[positions],
+            self.order[np.where(found, self.starts[target], 0)[positions]
+                       + offsets],
+            self.null_row)
+        return positions, key_rows
+
+    def fan_out(self, group_ids: np.ndarray, key_rows: np.ndarray) -> list:
+        """
+        For each expanded row, the number of distinct sectors at each level
+        (2 through 7) within its group and parent sector at the previous
+        level. Equivalent to groupby(...).transform('nunique', dropna=False)
+        of each _naics_ column, but computed once per distinct (group, key
+        row) pair rather than per row.
+
+        :param group_ids: array, group number of each expanded row
+        :param key_rows: array, key row of each expanded row, from expand()
+        :return: list of integer arrays (one per level) to divide by
+        """
+        pairs, pair_ids = np.unique(
+            group_ids.astype(np.int64) * (self.null_row + 1) + key_rows,
+            return_inverse=True)
+        pair_groups = pairs // (self.null_row + 1)
+        pair_rows = pairs % (self.null_row + 1)
+
+        divisors = []
+        parent = pair_groups
+        for n in self.levels:
+            level = self.level_codes[n][pair_rows]
+            n_codes = self.null_row + 1
+            _, parent_ids = np.unique(parent, return_inverse=True)
+            parent_ids = parent_ids.reshape(-1)
+            children = np.unique(parent_ids * n_codes + level)
+            n_children = np.bincount(children // n_codes,
+                                     minlength=parent_ids.max() + 1)
+            divisors.append(n_children[parent_ids][pair_ids.reshape(-1)])
+            parent = parent_ids.astype(np.int64) * n_codes + level
+        return divisors
+
+
 def map_source_sectors_to_more_aggregated_sectors(
     year: Literal[2002, 2007, 2012, 2017]
 ) -> pd.DataFrame:
@@ -146,6 +295,12 @@ def map_source_sectors_to_more_aggregated_sectors(
     Map source NAICS to all possible other sector lengths
     parent-childhierarchy
     """
+    return _cached_key(_map_source_sectors_to_more_aggregated_sectors, year)
+
+
+def _map_source_sectors_to_more_aggregated_sectors(
+    year: Literal[2002, 2007, 2012, 2017]
+) -> pd.DataFrame:
     naics_crosswalk = return_naics_crosswalk(year)
 
     naics = []
@@ -184,6 +339,12 @@ def map_source_sectors_to_less_aggregated_sectors(
     Map source NAICS to all possible other sector lengths
     parent-childhierarchy
     """
+    return _cached_key(_map_source_sectors_to_less_aggregated_sectors, year)
+
+
+def _map_source_sectors_to_less_aggregated_sectors(
+    year: Literal[2002, 2007, 2012, 2017]
+) -> pd.DataFrame:
     naics_crosswalk = return_naics_crosswalk(year)
 
     naics = []
@@ -228,15 +389,17 @@ def year_crosswalk(
     :return: pd.DataFrame with columns 'source_naics' and 'target_naics',
         corresponding to NAICS codes for the source and target specifications.
     '''
-    return (
-        pd.read_csv(settings.datapath / 'NAICS_Crosswalk_TimeSeries.csv',
-                    dtype='object')
-        .assign(source_naics=lambda x: x[f'NAICS_{source_year}_Code'],
-                target_naics=lambda x: x[f'NAICS_{target_year}_Code'])
-        [['source_naics', 'target_naics']]
-        .drop_duplicates()
-        .reset_index(drop=True)
-    )
+    path = settings.datapath / 'NAICS_Crosswalk_TimeSeries.csv'
+    return caching.reference_data.cached(
+        ('year_crosswalk', source_year, target_year), [path],
+        lambda: (
+            caching.reference_data.read_csv(path, dtype='str')
+            .assign(source_naics=lambda x: x[f'NAICS_{source_year}_Code'],
+                    target_naics=lambda x: x[f'NAICS_{target_year}_Code'])
+            [['source_naics', 'target_naics']]
+            .drop_duplicates()
+            .reset_index(drop=True)
+        ))
 
 
 def check_if_sectors_are_naics(df_load, crosswalk_list, column_headers):
@@ -0,0 +1,133 @@
+"""
+Prepares state and county FlowByActivity datasets one state at a time.
+When a method yaml sets `partition_by_state: True`, the rows of a source are
+split by the state prefix of their FIPS Location after convert_to_geoscale(),
+and the rest of prepare_fbs() (attribution and aggregation) runs for each
+state separately, optionally in a pool of `partition_workers` processes.
+Attribution and clean sources are prepared once, and each partition loads
+only their rows for its state, plus any national rows, which are shared
+by every partition (see planner.partition_rows()). Each state is written
+to a spill dataset as it is attributed (see spill.py), so that only the
+states in flight are held in memory, and the source is read back once all
+states are done.
+"""
+
+import numpy as np
+from flowsa import caching, planner
+from flowsa.flowsa_log import log
+from flowsa.spill import SpillDataset
+
+
+def state_prefixes(fb) -> np.ndarray:
+    """
+    State FIPS prefix of the Location of each row of fb, or '' for rows
+    without a state or county FIPS code
+    :param fb: FlowBy dataset
+    :return: numpy array of str
+    """
+    location = fb['Location'].astype(object).fillna('')
+    is_fips = (location.str.len() == 5) & location.str.isdigit()
+    return np.where(is_fips, location.str[:2], '').astype(object)
+
+
+def _prepare_partition(fba, prefix: str, prepared: dict,
+                       attribute_kwargs: dict):
+    """
+    Runs attribute_and_aggregate() on the rows of one state, in a worker
+    process of planner.run_in_workers().
+    :param fba: FlowByActivity, rows of the state
+    :param prefix: str, state FIPS prefix
+    :param prepared: dict, attribution and clean sources already prepared,
+        by planner.config_key()
+    :param attribute_kwargs: dict, passed to attribute_and_aggregate()
+    :return: FlowByActivity
+    """
+    with caching.generation_run(), planner.location_partition(prefix):
+        for key, fbs in prepared.items():
+            caching.prepared_sources.put(key, fbs)
+        return fba.attribute_and_aggregate(**attribute_kwargs)
+
+
+def prepare_by_state(fba, attribute_kwargs: dict, max_workers: int = 1):
+    """
+    Runs fba.attribute_and_aggregate(**attribute_kwargs) separately on the
+    rows of each state. Each state is written to disk as it completes,
+    and the states are read back, in order, once all are done.
+    :param fba: FlowByActivity, after convert_to_geoscale()
+    :param attribute_kwargs: dict, passed to attribute_and_aggregate()
+    :param max_workers: int, if greater than 1, states are prepared in
+        parallel in up to this many worker processes. The rows and
+        attribution sources of a state are only split off once a worker is
+        free for it, so at most this many states are in flight at once.
+    :return: FlowByActivity
+    """
+    fba = fba.reset_index(drop=True)
+    prefixes = state_prefixes(fba)
+    partitions = sorted(set(prefixes))
+    if len(partitions) < 2:
+        return fba.attribute_and_aggregate(**attribute_kwargs)
+
+    # prepare the attribution and clean sources once, before partitioning
+    plan = planner.Plan()
+    root = plan.add(fba.full_name, fba.config, primary=True)
+    planner.execute(plan, download_sources_ok=attribute_kwargs.get(
+        'download_sources_ok', True))
+    log.info('Preparing %s by state, in %s partitions', fba.full_name,
+             len(partitions))
+
+    def partition(prefix):
+        """Rows of one state, with the sources_to_cache in their config
+        restricted to that state"""
+        part = (fba.take(np.flatnonzero(prefixes == prefix))
+                .reset_index(drop=True))
+        with planner.location_partition(prefix):
+            part.config = {
+                **fba.config,
+                'cache': {name: planner.partition_rows(cached)
+                          for name, cached
+                          in (fba.config.get('cache') or {}).items()}}
+        return part
+
+    def tasks():
+        """Arguments of _prepare_partition() for each state, built as the
+        workers take them"""
+        for prefix in partitions:
+            with planner.location_partition(prefix):
+                prepared = {
+                    key: planner.partition_rows(
+                        caching.prepared_sources.get(key))
+                    for key in plan.nodes
+                    if key != root and key in caching.prepared_sources}
+            yield partition(prefix), prefix, prepared, attribute_kwargs
+
+    if max_workers > 1:
+        results = planner.run_in_workers(_prepare_partition, tasks(),
+                                         max_workers)
+    else:
+        def sequential():
+            for prefix in partitions:
+                part = partition(prefix)
+                with planner.location_partition(prefix):
+                    yield part.attribute_and_aggregate(**attribute_kwargs)
+        results = sequential()
+    # one bucket, so that the states are read back in order
+    dataset = SpillDataset(fba.full_name, buckets=1)
+    try:
+        for prefix, result in zip(partitions, results):
+            if prefix == partitions[0]:
+                # no rows, but the columns, type and config of the results
+                empty = result.iloc[:0]
+            dataset.append(f'{fba.full_name}_{prefix}', result)
+        fbs = dataset.read()
+    finally:
+        dataset.remove()
+    if fbs is None:
+        return empty
+    # read back as a FlowBySector, with the FBS fields the results lack
+    fbs = type(empty)(fbs[list(empty.columns)], add_missing_columns=False)
+    fbs.full_name = empty.full_name
+    fbs.config = empty.config
+    if 'cache' in fbs.config:
+        # give back the unpartitioned sources_to_cache
+        fbs.config = {**fbs.config, 'cache': fba.config['cache']}
+    return fbs
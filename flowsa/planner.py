@@ -0,0 +1,444 @@
+"""
+Plans the FlowByActivity and FlowBySector datasets needed to generate a
+FlowBySector method. The primary sources of a method, and the attribution
+and clean sources they load, form a dependency graph. Sources loaded with
+the same config are built once per run (see load_prepared_source()), and
+independent sources can be prepared in parallel worker processes.
+"""
+
+import hashlib
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from flowsa import caching
+from flowsa.common import get_catalog_info
+from flowsa.flowsa_log import log, capture_log_records, replay_log_records
+
+# config keys not passed on from a FlowBy to its activity sets or attribution
+# steps (see _FlowBy.attribute_flows_to_sectors())
+_NOT_INHERITED = ['activity_sets', 'clean_fba_before_activity_sets']
+
+# state FIPS prefix of the partition being prepared (see partition.py)
+_location_partition = None
+
+
+def _normalize(value):
+    """
+    Converts a config value into JSON-serializable form, so that equal
+    configs produce equal keys regardless of ordering
+    """
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in
+                sorted(value.items(), key=lambda x: str(x[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_normalize(v) for v in value), key=str)
+    if isinstance(value, pd.DataFrame):
+        return caching.fingerprint(value)
+    if callable(value) and hasattr(value, '__qualname__'):
+        return f'{value.__module__}.{value.__qualname__}'
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return repr(value)
+
+
+def config_key(name: str, config: dict) -> str:
+    """
+    Key identifying a source loaded with a given config. Sources cached
+    through sources_to_cache (config['cache']) are identified by name only.
+    :param name: str, source name
+    :param config: dict, config passed to get_flowby_from_config()
+    :return: str, hex digest
+    """
+    normalized = [
+        name,
+        _normalize({k: v for k, v in config.items() if k != 'cache'}),
+        sorted(config.get('cache') or {})
+    ]
+    return hashlib.sha1(
+        json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+def source_config(parent_config: dict, name: str, config: dict) -> dict:
+    """
+    Config with which an attribution or clean source is loaded by a FlowBy
+    with parent_config: the method-level keys of parent_config, the source
+    catalog entry, and the config given for the source in the method yaml.
+    """
+    return {**{k: v for k, v in parent_config.items()
+               if k in parent_config['method_config_keys']
+               or k == 'method_config_keys'},
+            **get_catalog_info(name),
+            **config}
+
+
+def _name_and_config(source) -> tuple:
+    if isinstance(source, str):
+        return source, {}
+    (name, config), = source.items()
+    return name, config or {}
+
+
+def _prepare(name: str, config: dict, get_kwargs: dict,
+             prepare_kwargs: dict):
+    from flowsa.flowby import get_flowby_from_config
+    return (get_flowby_from_config(name=name, config=config, **get_kwargs)
+            .prepare_fbs(**prepare_kwargs))
+
+
+def load_prepared_source(
+    name: str,
+    config: dict,
+    download_sources_ok: bool = True
+):
+    """
+    Loads a source with get_flowby_from_config() and prepares it with
+    prepare_fbs(), unless a source with the same config_key() has already
+    been prepared in this run, in which case a copy of it is returned.
+    The copy's prepared_key attribute, (config_key(), state partition),
+    identifies it while it is unmodified: it is not kept by pandas methods
+    (see _FlowBy.harmonize_geoscale()).
+    :param name: str, source name
+    :param config: dict, as returned by source_config()
+    :param download_sources_ok: bool, passed to get_flowby_from_config()
+        and prepare_fbs()
+    :return: FlowBySector
+    """
+    key = config_key(name, config)
+    prepared = caching.prepared_sources.get(key)
+    if prepared is None:
+        prepared = _prepare(name, config,
+                            {'download_sources_ok': download_sources_ok},
+                            {'download_sources_ok': download_sources_ok})
+        caching.prepared_sources.put(key, prepared)
+    else:
+        log.info('Reusing %s, already prepared with the same configuration',
+                 name)
+    fbs = partition_rows(prepared)
+    fbs.config = {**prepared.config}
+    object.__setattr__(fbs, 'prepared_key', (key, _location_partition))
+    return fbs
+
+
+@contextmanager
+def location_partition(prefix: str):
+    """
+    Context in which attribution and clean sources are loaded only for the
+    locations of one state (see partition_rows()).
+    :param prefix: str, two-digit state FIPS prefix
+    """
+    global _location_partition
+    previous, _location_partition = _location_partition, prefix
+    try:
+        yield
+    finally:
+        _location_partition = previous
+
+
+def partition_rows(fbs):
+    """
+    Copy of fbs. Within a location_partition(), rows located in other
+    states, i.e. whose Location is a state or county FIPS code with another
+    state prefix, are left out. National rows, and rows without a FIPS
+    Location, are kept for every partition.
+    :param fbs: FlowBy dataset
+    :return: FlowBy dataset
+    """
+    if _location_partition is None or 'Location' not in fbs.columns:
+        return fbs.copy()
+    location = fbs['Location'].astype(object).fillna('')
+    prefix = location.str[:2]
+    keep = ((location.str.len() != 5) | ~location.str.isdigit()
+            | prefix.isin([_location_partition, '00'])).to_numpy()
+    return fbs.take(np.flatnonzero(keep)).reset_index(drop=True)
+
+
+class SourceNode:
+    """
+    A source in a Plan: its name, the config it is loaded with, and the keys
+    of the attribution and clean sources it loads.
+    """
+    def __init__(self, name: str, config: dict, primary: bool = False
+                 ) -> None:
+        self.name = name
+        self.config = config
+        self.primary = primary
+        self.key = config_key(name, config)
+        self.dependencies = []
+
+    def __repr__(self) -> str:
+        return (f'SourceNode({self.name!r}, primary={self.primary}, '
+                f'dependencies={len(self.dependencies)})')
+
+
+class Plan:
+    """
+    Dependency graph of the sources of a FlowBySector method. Sources with
+    the same config_key() are a single node. Create with plan_method().
+    """
+    def __init__(self) -> None:
+        self.nodes: Dict[str, SourceNode] = {}
+        self.primary: List[SourceNode] = []
+
+    def add(self, name: str, config: dict, primary: bool = False) -> str:
+        """
+        Adds a source, and the sources it depends on, to the plan. A
+        primary source with the key of an attribution or clean source
+        already added is that node, prepared by execute(), and reused by
+        FlowBySector._prepare_sources() rather than prepared again.
+        :return: str, key of the node
+        """
+        node = SourceNode(name, config, primary)
+        if node.key in self.nodes:
+            return node.key
+        self.nodes[node.key] = node
+        node.dependencies = list(dict.fromkeys(self._dependencies(config)))
+        return node.key
+
+    def _dependencies(self, config: dict) -> List[str]:
+        """
+        Keys of the attribution and clean sources loaded while preparing a
+        FlowBy with the given config, following activity sets and
+        attribution steps as prepare_fbs() does.
+        """
+        keys = []
+        if 'clean_source' in config:
+            name, clean_config = _name_and_config(config['clean_source'])
+            keys.append(self.add(name, source_config(config, name,
+                                                     clean_config)))
+        parent_config = {k: v for k, v in config.items()
+                         if k not in _NOT_INHERITED and not k.startswith('_')}
+        if 'activity_sets' in config:
+            for activity_config in config['activity_sets'].values():
+                keys.extend(self._dependencies(
+                    {**parent_config, **activity_config}))
+            return keys
+
+        steps = config.get('attribute', config)
+        for step in ([steps] if isinstance(steps, dict) else steps):
+            if 'attribution_source' not in step:
+                continue
+            step_config = {**parent_config, **step}
+            name, attribution_config = _name_and_config(
+                step['attribution_source'])
+            if name in (config.get('cache') or {}):
+                # loaded from sources_to_cache
+                continue
+            keys.append(self.add(name, source_config(
+                step_config, name, attribution_config)))
+        return keys
+
+    def levels(self) -> List[List[SourceNode]]:
+        """
+        Groups the nodes into levels, such that each node depends only on
+        nodes in earlier levels. Nodes in the same level are independent.
+        :return: list of lists of SourceNode
+        """
+        depths = {}
+
+        def depth(key):
+            if key not in depths:
+                depths[key] = 1 + max(
+                    (depth(k) for k in self.nodes[key].dependencies),
+                    default=-1)
+            return depths[key]
+
+        levels = {}
+        for key, node in self.nodes.items():
+            levels.setdefault(depth(key), []).append(node)
+        return [levels[d] for d in sorted(levels)]
+
+
+def plan_method(method_config: dict, sources: dict = None) -> Plan:
+    """
+    Builds the dependency graph of a FlowBySector method.
+    :param method_config: dict, method yaml as loaded by load_yaml_dict(),
+        with any 'cache' key already set and source_names removed
+    :param sources: dict, source_names of the method
+    :return: Plan
+    """
+    plan = Plan()
+    for name, config in (sources or {}).items():
+        key = plan.add(name, {
+            **method_config,
+            'method_config_keys': set(method_config.keys()),
+            **get_catalog_info(name),
+            **(config or {})
+        }, primary=True)
+        plan.primary.append(plan.nodes[key])
+    return plan
+
+
+# State of a worker process used by run_in_workers()
+_worker_cache = {}
+_worker_log_records = []
+
+
+def _init_worker(cache):
+    """
+    Initializes a worker process for run_in_workers(). The method's
+    cached sources are received once per worker, rather than with every
+    task, and log records are captured to be returned to the main process.
+    :param cache: dict, method_config['cache']
+    """
+    global _worker_cache, _worker_log_records
+    _worker_cache = cache
+    _worker_log_records = capture_log_records()
+
+
+def _run_in_worker(function, args):
+    """
+    Runs one task of run_in_workers() in a worker process.
+    :return: tuple, (result or None, list of log records, exception raised
+        or None)
+    """
+    _worker_log_records.clear()
+    try:
+        result = function(*args)
+    except Exception as e:
+        return None, list(_worker_log_records), e
+    return result, list(_worker_log_records), None
+
+
+def run_in_workers(function, tasks, max_workers: int, cache: dict = None):
+    """
+    Runs function(*args) for each args in tasks in a pool of worker
+    processes, and yields the results in the order of tasks. Tasks are
+    submitted as results are consumed, so that at most max_workers tasks
+    are in flight, and held in memory, at once. The log records of each
+    task are written after those of the tasks before it, as if the tasks
+    were run one by one. If a task fails, the results of the tasks before
+    it are yielded before its exception is raised.
+    :param function: module-level function, run in the workers
+    :param tasks: iterable of tuples of arguments, consumed as tasks are
+        submitted
+    :param max_workers: int, number of worker processes
+    :param cache: dict, method_config['cache'], received once per worker
+    :return: generator of the results of function
+    """
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(cache or {},)) as executor:
+        futures = deque()
+
+        def submit():
+            args = next(tasks, None)
+            if args is not None:
+                futures.append(
+                    executor.submit(_run_in_worker, function, args))
+
+        for _ in range(max_workers):
+            submit()
+        while futures:
+            result, records, error = futures.popleft().result()
+            replay_log_records(records)
+            if error is not None:
+                for future in futures:
+                    future.cancel()
+                raise error
+            submit()
+            yield result
+
+
+def _replace_cache(fbs, cache):
+    """
+    Shallow copy of fbs with cache as the 'cache' key of its config, or
+    without the key if cache is None. Sources passed to and from worker
+    processes are stripped of the method's sources_to_cache, which each
+    worker receives once (see _init_worker()), and given them back on
+    arrival.
+    :param fbs: FlowBySector
+    :param cache: dict, method_config['cache'], or None
+    :return: FlowBySector
+    """
+    config = {k: v for k, v in (fbs.config or {}).items() if k != 'cache'}
+    if cache is not None:
+        config['cache'] = cache
+    fbs = fbs.copy(deep=False)
+    fbs.config = config
+    return fbs
+
+
+def _prepare_in_worker(name, config, prepared, get_kwargs, prepare_kwargs):
+    """
+    Loads and prepares one source in a worker process.
+    :param name: str, name of the source
+    :param config: dict, source config, without the 'cache' key
+    :param prepared: dict, sources already prepared, by config_key(),
+        without the 'cache' key in their config
+    :return: FlowBySector, without the 'cache' key in its config
+    """
+    for key, fbs in prepared.items():
+        caching.prepared_sources.put(key, _replace_cache(fbs, _worker_cache))
+    return _replace_cache(
+        _prepare(name, {**config, 'cache': _worker_cache}, get_kwargs,
+                 prepare_kwargs),
+        None)
+
+
+def prepare_in_parallel(tasks: list, cache: dict, max_workers: int):
+    """
+    Loads and prepares sources in a pool of worker processes (see
+    run_in_workers()).
+    :param tasks: list of tuples, (name, config, prepared, get_kwargs,
+        prepare_kwargs), where prepared is a dict of sources already
+        prepared, by config_key(), for the worker to reuse
+    :param cache: dict, method_config['cache']
+    :param max_workers: int, number of worker processes
+    :return: generator of FlowBySector, in the order of tasks, each
+        yielded once it and the tasks before it are complete
+    """
+    log.info('Preparing %s sources in up to %s worker processes',
+             len(tasks), max_workers)
+    results = run_in_workers(
+        _prepare_in_worker,
+        ((name, {k: v for k, v in config.items() if k != 'cache'},
+          {key: _replace_cache(fbs, None) for key, fbs in prepared.items()},
+          get_kwargs, prepare_kwargs)
+         for name, config, prepared, get_kwargs, prepare_kwargs in tasks),
+        max_workers, cache)
+    return (_replace_cache(fbs, cache if 'cache' in config else None)
+            for (_, config, *_), fbs in zip(tasks, results))
+
+
+def execute(plan: Plan, max_workers: int = 1,
+            download_sources_ok: bool = True) -> None:
+    """
+    Prepares the attribution and clean sources of a plan, level by level,
+    and keeps them in caching.prepared_sources for load_prepared_source().
+    Sources within a level are prepared in parallel if max_workers > 1.
+    Primary sources are left to the caller.
+    :param plan: Plan
+    :param max_workers: int, number of worker processes
+    :param download_sources_ok: bool, passed to get_flowby_from_config()
+        and prepare_fbs()
+    """
+    kwargs = {'download_sources_ok': download_sources_ok}
+    cache = next((n.config.get('cache') for n in plan.primary), None) or {}
+    for level in plan.levels():
+        todo = [n for n in level
+                if not n.primary and n.key not in caching.prepared_sources]
+        if not todo:
+            continue
+        log.info('Preparing attribution and clean sources: %s',
+                 ', '.join(n.name for n in todo))
+        if max_workers > 1 and len(todo) > 1:
+            results = prepare_in_parallel(
+                [(n.name, n.config,
+                  {k: caching.prepared_sources.get(k)
+                   for k in n.dependencies
+                   if k in caching.prepared_sources},
+                  kwargs, kwargs) for n in todo],
+                cache, max_workers)
+            for node, fbs in zip(todo, results):
+                caching.prepared_sources.put(node.key, fbs)
+        else:
+            for node in todo:
+                load_prepared_source(node.name, node.config,
+                                     download_sources_ok)
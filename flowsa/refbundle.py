@@ -0,0 +1,167 @@
+"""
+Binary bundle of the reference data packaged as csv in flowsa/data, such as
+the NAICS and FIPS crosswalks and the activity-to-sector mappings. Each csv,
+once parsed, is written to settings.referencebundlepath as an uncompressed
+Arrow IPC (feather) file with dictionary-encoded string columns, and later
+loaded memory-mapped rather than parsed again. The bundle manifest records
+the sha1 of the csv each table was parsed from, and a table whose csv has
+changed is parsed and written again. If pyarrow is not available, or a
+table can not be read, the csv is read instead.
+
+The bundle is filled as tables are read, or built ahead of time with
+
+python -m flowsa.refbundle
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from flowsa import settings
+from flowsa.flowsa_log import log
+
+MANIFEST = 'manifest.json'
+
+
+def covers(path) -> bool:
+    """
+    Whether path is a csv packaged in flowsa/data, and so can be bundled
+    :param path: str or Path
+    :return: bool
+    """
+    return (str(path).endswith('.csv') and os.path.abspath(path).startswith(
+        os.path.abspath(settings.datapath) + os.sep))
+
+
+def _table_name(path, kwargs: dict) -> str:
+    """File name of the table parsed from path with read_csv(**kwargs)"""
+    relative = os.path.relpath(path, settings.datapath)
+    digest = hashlib.sha1(repr((relative, sorted(kwargs.items())))
+                          .encode()).hexdigest()[:12]
+    return (f'{os.path.splitext(relative)[0].replace(os.sep, "-")}'
+            f'-{digest}.arrow')
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(settings.referencebundlepath / MANIFEST, 'r',
+                  encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_table(df: pd.DataFrame, file: str) -> None:
+    import pyarrow as pa
+    import pyarrow.feather
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type) or pa.types.is_null(field.type):
+            table = table.set_column(
+                i, field.name,
+                table.column(i).cast(pa.string()).dictionary_encode())
+    path = settings.referencebundlepath / file
+    tmp = f'{path}.{os.getpid()}.tmp'
+    pyarrow.feather.write_feather(table, tmp, compression='uncompressed')
+    os.replace(tmp, path)
+
+
+def _read_table(file: str) -> pd.DataFrame:
+    import pyarrow as pa
+    import pyarrow.feather
+
+    table = pyarrow.feather.read_table(settings.referencebundlepath / file,
+                                       memory_map=True)
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        column = column.combine_chunks()
+        if pa.types.is_dictionary(column.type):
+            # decode to object, as read_csv() does, with NaN for nulls.
+            # Equal strings share one python object.
+            values = np.append(
+                column.dictionary.to_numpy(zero_copy_only=False)
+                .astype(object), np.nan)
+            columns[name] = values[
+                column.indices.fill_null(-1).to_numpy()]
+        else:
+            columns[name] = column.to_pandas()
+    return pd.DataFrame(columns)
+
+
+def read_csv(path, **kwargs) -> pd.DataFrame:
+    """
+    pd.read_csv(path, **kwargs), from the bundle if the table is bundled
+    and its csv is unchanged. Otherwise, the csv is read and the table
+    added to the bundle.
+    :param path: path of a csv in flowsa/data
+    :kwargs: keyword arguments passed to pd.read_csv()
+    :return: df
+    """
+    from flowsa.incremental import file_hash
+
+    if not (settings.USE_REFERENCE_BUNDLE and covers(path)):
+        return pd.read_csv(path, **kwargs)
+    file = _table_name(path, kwargs)
+    checksum = file_hash(path)
+    entry = _load_manifest().get(file)
+    if entry is not None and entry['checksum'] == checksum:
+        try:
+            return _read_table(file)
+        except Exception as e:
+            log.debug('Reading %s from the reference bundle failed (%s), '
+                      'reading %s', file, e, path)
+
+    df = pd.read_csv(path, **kwargs)
+    try:
+        settings.referencebundlepath.mkdir(parents=True, exist_ok=True)
+        _write_table(df, file)
+    except Exception as e:
+        # e.g. pyarrow is not installed
+        log.debug('Not adding %s to the reference bundle: %s', path, e)
+        return df
+    # merge with entries written by other processes since it was loaded
+    manifest = _load_manifest()
+    manifest[file] = {'source': os.path.relpath(path, settings.datapath),
+                      'kwargs': repr(sorted(kwargs.items())),
+                      'checksum': checksum}
+    tmp = (f'{settings.referencebundlepath / MANIFEST}.'
+           f'{os.getpid()}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, settings.referencebundlepath / MANIFEST)
+    return df
+
+
+def standard_reads():
+    """
+    The csvs in flowsa/data, with the read_csv() keyword arguments they
+    are read with by common.load_crosswalk(),
+    sectormapping.get_activitytosector_mapping() and unit conversion
+    :return: generator of (path, kwargs) tuples
+    """
+    for path in sorted(settings.datapath.glob('*.csv')):
+        if path.name == 'unit_conversion.csv':
+            yield path, {}
+        else:
+            yield path, {'dtype': 'str'}
+    for path in sorted(settings.crosswalkpath.glob('*.csv')):
+        yield path, {'dtype': {'Activity': 'str', 'Sector': 'str'}}
+
+
+def build() -> None:
+    """
+    Adds every standard_reads() table missing from the bundle, or whose
+    csv has changed
+    """
+    count = 0
+    for path, kwargs in standard_reads():
+        read_csv(path, **kwargs)
+        count += 1
+    log.info('Reference bundle in %s is up to date with %s tables',
+             settings.referencebundlepath, count)
+
+
+if __name__ == '__main__':
+    build()
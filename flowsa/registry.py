@@ -0,0 +1,171 @@
+"""
+Index of the source catalog and of the FlowByActivity and FlowBySector
+methods packaged with flowsa, built once per process and rebuilt when the
+files it was built from are modified. The years of each FBA method, for
+which every FBA yaml is parsed, are also saved to settings.registrypath
+and reused by later processes for the yamls whose include graph (the yaml
+and the files it includes, see flowsa_yaml.load_file()) has not changed.
+"""
+
+import json
+import os
+from copy import deepcopy
+import yaml
+from flowsa import flowsa_yaml, settings
+from flowsa.flowsa_log import log
+
+# suffixes of yaml files that are not methods
+EXCLUDED_SUFFIXES = ["_common", "_Common", "_target"]
+MISSING_YEARS = 'YAML missing information on years'
+
+# indexes, by name, each stored with the modification times they were
+# built from
+_indexes = {}
+
+
+def _mtime(path) -> int:
+    return os.stat(path).st_mtime_ns
+
+
+def _indexed(name: str, versions, build):
+    """
+    Returns build(), kept under name until versions changes
+    :param name: str, name of the index
+    :param versions: hashable, e.g. modification times of the files read
+        by build()
+    :param build: function without arguments
+    """
+    entry = _indexes.get(name)
+    if entry is None or entry[0] != versions:
+        entry = (versions, build())
+        _indexes[name] = entry
+    return entry[1]
+
+
+def clear() -> None:
+    """Drops every index, to be rebuilt when next used"""
+    _indexes.clear()
+
+
+def catalog() -> dict:
+    """
+    :return: dict, the contents of source_catalog.yaml. Not to be modified.
+    """
+    from flowsa.common import load_yaml_dict
+    path = settings.datapath / 'source_catalog.yaml'
+    return _indexed('catalog', _mtime(path),
+                    lambda: load_yaml_dict('source_catalog'))
+
+
+def catalog_name(source_name: str) -> str:
+    """
+    Name of the source_catalog.yaml entry of a source, dropping any
+    extensions after an underscore (e.g. 'EIA_MECS_Energy_2018' is found
+    under 'EIA_MECS_Energy') until an entry is found
+    :param source_name: str
+    :return: str, or what is left of source_name if no entry is found
+    """
+    entries = catalog()
+    while entries.get(source_name) is None and '_' in source_name:
+        source_name = source_name.rsplit('_', 1)[0]
+    return source_name
+
+
+def catalog_entry(source_name: str) -> dict:
+    """
+    :param source_name: str
+    :return: dict, copy of the source_catalog.yaml entry of the source, or
+        an empty dict
+    """
+    return deepcopy(catalog().get(catalog_name(source_name), {}))
+
+
+def _method_names(folder) -> list:
+    names = [os.path.splitext(f)[0] for f in os.listdir(folder)
+             if f.endswith('.yaml')]
+    return [f for f in names
+            if all(s not in f for s in EXCLUDED_SUFFIXES)]
+
+
+def fbs_methods() -> list:
+    """
+    :return: list of str, names of the FlowBySector methods in
+        settings.flowbysectormethodpath
+    """
+    folder = settings.flowbysectormethodpath
+    return list(_indexed('fbs_methods', _mtime(folder),
+                         lambda: _method_names(folder)))
+
+
+def _load_fba_years() -> dict:
+    """years of each FBA method, as saved by an earlier process"""
+    try:
+        with open(settings.registrypath / 'fba_years.json', 'r',
+                  encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _build_fba_years(names: list) -> tuple:
+    """
+    :return: tuple, (years by method name, versions of the files the years
+        were resolved from, by method name)
+    """
+    from flowsa.common import load_yaml_dict
+    saved = _load_fba_years()
+    years = {}
+    versions = {}
+    for name in names:
+        entry = saved.get(name)
+        if (isinstance(entry, dict)
+                and flowsa_yaml.unchanged(entry['versions'])):
+            years[name] = entry['years']
+            versions[name] = entry['versions']
+            continue
+        try:
+            years[name] = load_yaml_dict(name, 'FBA')['years']
+        except KeyError:
+            years[name] = MISSING_YEARS
+        versions[name] = flowsa_yaml.resolved_from(
+            f'{settings.sourceconfigpath}/{name}.yaml')
+    try:
+        settings.registrypath.mkdir(parents=True, exist_ok=True)
+        tmp = settings.registrypath / f'fba_years.json.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({name: {'versions': versions[name],
+                              'years': years[name]}
+                       for name in years}, f, indent=2)
+        os.replace(tmp, settings.registrypath / 'fba_years.json')
+    except (OSError, TypeError) as e:
+        log.debug('Could not save the years of FBA methods: %s', e)
+    return years, versions
+
+
+def fba_years() -> dict:
+    """
+    :return: dict, the years listed in each FlowByActivity method yaml in
+        settings.sourceconfigpath, by method name
+    """
+    names = _method_names(settings.sourceconfigpath)
+    entry = _indexes.get('fba_years')
+    if (entry is None or entry[0][0] != names
+            or not all(flowsa_yaml.unchanged(v)
+                       for v in entry[0][1].values())):
+        years, versions = _build_fba_years(names)
+        entry = ((names, versions), years)
+        _indexes['fba_years'] = entry
+    return deepcopy(entry[1])
+
+
+def method_status() -> dict:
+    """
+    :return: dict, copy of the contents of method_status.yaml
+    """
+    path = settings.methodpath / 'method_status.yaml'
+
+    def load():
+        with open(path, 'r') as f:
+            return yaml.safe_load(f)
+
+    return deepcopy(_indexed('method_status', _mtime(path), load))
@@ -11,6 +11,7 @@ from pathlib import Path
 from esupy.mapping import apply_flow_mapping
 import flowsa
 import flowsa.flowbyactivity
+from flowsa import caching
 from flowsa.common import get_flowsa_base_name, load_crosswalk
 from flowsa.dataclean import standardize_units
 from flowsa.flowsa_log import log
@@ -23,6 +24,13 @@ def get_activitytosector_mapping(source, fbsconfigpath=None):
     :param source: str, the data source name
     :return: a pandas df for a standard ActivitytoSector mapping
     """
+    path = _activitytosector_mapping_path(source, fbsconfigpath)
+    return caching.reference_data.cached(
+        ('get_activitytosector_mapping', source, str(path)), [path],
+        lambda: _get_activitytosector_mapping(source, path))
+
+
+def _activitytosector_mapping_path(source, fbsconfigpath=None):
     from flowsa.settings import crosswalkpath
     # identify mapping file name
     mapfn = f'NAICS_Crosswalk_{source}'
@@ -41,8 +49,12 @@ def get_activitytosector_mapping(source, fbsconfigpath=None):
                 crosswalkpath = external_mappingpath
     activity_mapping_source_name = get_flowsa_base_name(
         crosswalkpath, mapfn, 'csv')
-    mapping = pd.read_csv(crosswalkpath / f'{activity_mapping_source_name}.csv',
-                          dtype={'Activity': 'str', 'Sector': 'str'})
+    return crosswalkpath / f'{activity_mapping_source_name}.csv'
+
+
+def _get_activitytosector_mapping(source, path):
+    mapping = caching.reference_data.read_csv(
+        path, dtype={'Activity': 'str', 'Sector': 'str'})
     # some mapping tables will have data for multiple sources, while other
     # mapping tables are used for multiple sources (like EPA_NEI or BEA
     # mentioned above) so if find the exact source name in the
@@ -0,0 +1,229 @@
+"""
+Compiles the selection_fields and exclusion_fields dictionaries used by
+_FlowBy.select_by_fields() into a single boolean row mask, so that a
+selection can be built once and applied to many FlowBy datasets.
+"""
+
+from typing import TypeVar, TYPE_CHECKING
+import numpy as np
+import pandas as pd
+from .flowsa_log import log
+
+if TYPE_CHECKING:
+    from flowsa.flowby import _FlowBy
+
+FB = TypeVar('FB', bound='_FlowBy')
+
+
+def _as_list(values) -> list or dict:
+    return [values] if not isinstance(values, (list, dict)) else values
+
+
+def isin(series: pd.Series, values) -> np.ndarray:
+    '''
+    Equivalent to series.isin(values).to_numpy(). For categorical series,
+    membership is tested once per category and then looked up by category
+    code, rather than hashing every row.
+
+    :param series: pd.Series
+    :param values: list-like of values (the keys are used for a dict)
+    :return: numpy array of bool
+    '''
+    values = list(values)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        category_mask = np.append(series.cat.categories.isin(values),
+                                  any(pd.isna(v) for v in values))
+        # ^^^ missing values have code -1, i.e. the last entry
+        return category_mask[series.cat.codes.to_numpy()]
+    return series.isin(values).to_numpy(dtype=bool)
+
+
+def replace_values(series: pd.Series, mapping: dict) -> pd.Series:
+    '''
+    Equivalent to series.replace(mapping) for a dictionary mapping. Object
+    and categorical series are replaced with a single hashed lookup, rather
+    than one comparison per key of the mapping.
+
+    :param series: pd.Series
+    :param mapping: dict, associates existing values with replacement values
+    :return: pd.Series with values replaced
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = replace_values(
+            pd.Series(series.cat.categories.to_numpy(dtype='object')),
+            mapping).to_numpy(dtype='object')
+        new_codes, new_categories = pd.factorize(categories)
+        codes = np.append(new_codes, -1)[series.cat.codes.to_numpy()]
+        return pd.Series(pd.Categorical.from_codes(codes, new_categories),
+                         index=series.index, name=series.name)
+    if series.dtype != 'object':
+        return series.replace(mapping)
+    values = series.to_numpy(dtype='object')
+    positions = pd.Index(list(mapping), dtype='object').get_indexer(values)
+    replacements = np.array(list(mapping.values()) + [None], dtype='object')
+    return pd.Series(np.where(positions >= 0, replacements[positions],
+                              values),
+                     index=series.index, name=series.name, dtype='object')
+
+
+class Selection:
+    '''
+    A selection_fields and exclusion_fields pair, as described in
+    _FlowBy.select_by_fields(), compiled for use on any number of FlowBy
+    datasets. Create with compile_selection().
+    '''
+    def __init__(
+        self,
+        selection_fields: dict = None,
+        exclusion_fields: dict = None
+    ) -> None:
+        exclusion_fields = {k: _as_list(v)
+                            for k, v in (exclusion_fields or {}).items()}
+        self.conditional_exclusions = {
+            k: _as_list(v)
+            for k, v in exclusion_fields.pop('conditional', {}).items()}
+        self.exclusions = exclusion_fields
+
+        if selection_fields is None or selection_fields == 'null':
+            self.selects = False
+            selection_fields = {}
+        else:
+            self.selects = True
+        selection_fields = {k: _as_list(v)
+                            for k, v in selection_fields.items()}
+
+        self.primary_columns = [k for k in ['Activity', 'Sector']
+                                if f'Primary{k}' in selection_fields]
+        self.special_fields = {
+            k: ([*v.keys(), *v.values()] if isinstance(v, dict) else v)
+            for k, v in selection_fields.items() if k in ['Activity', 'Sector']
+        }
+        self.other_fields = {
+            k: ([*v.keys(), *v.values()] if isinstance(v, dict) else v)
+            for k, v in selection_fields.items()
+            if k not in ['Activity', 'Sector']
+        }
+
+        # Replacement values given as dictionaries. Those given under
+        # PrimaryActivity or PrimarySector are applied to both the
+        # ...ProducedBy and ...ConsumedBy columns.
+        special_replacements = {
+            k: dict(v) for k, v in selection_fields.items()
+            if k in ['Activity', 'Sector'] and isinstance(v, dict)
+        }
+        other_replacements = {
+            k: v for k, v in selection_fields.items()
+            if k not in ['Activity', 'Sector'] and isinstance(v, dict)
+        }
+        for k in ['Activity', 'Sector']:
+            if f'Primary{k}' in other_replacements:
+                special_replacements.setdefault(k, {}).update(
+                    other_replacements.pop(f'Primary{k}'))
+        self.replacements = {
+            **{f'{k}ProducedBy': v for k, v in special_replacements.items()},
+            **{f'{k}ConsumedBy': v for k, v in special_replacements.items()},
+            **other_replacements
+        }
+
+    def mask(self, fb: FB) -> np.ndarray:
+        '''
+        Returns a boolean array marking the rows of fb that are kept by the
+        compiled exclusion_fields and selection_fields. If selecting on
+        PrimaryActivity or PrimarySector, fb must already have that column.
+
+        :param fb: FlowBy dataset
+        :return: numpy array of bool, of length len(fb)
+        '''
+        keep = np.ones(len(fb), dtype=bool)
+        if self.conditional_exclusions:
+            keep &= ~np.logical_and.reduce(
+                [isin(fb[k], v)
+                 for k, v in self.conditional_exclusions.items()])
+        for field, values in self.exclusions.items():
+            if field not in fb:
+                log.warning(f'{field} not found, can not apply '
+                            'exclusion_fields')
+            else:
+                keep &= ~isin(fb[field], values)
+
+        for field, values in self.special_fields.items():
+            keep &= (isin(fb[f'{field}ProducedBy'], values)
+                     | isin(fb[f'{field}ConsumedBy'], values))
+        for field, values in self.other_fields.items():
+            keep &= isin(fb[field], values)
+        return keep
+
+    def add_primary_columns(self, fb: FB) -> FB:
+        '''
+        Adds the PrimaryActivity and/or PrimarySector columns needed by
+        mask(), if selecting on them.
+
+        :param fb: FlowBy dataset
+        :return: FlowBy dataset, with Primary... and Secondary... columns
+        '''
+        for k in self.primary_columns:
+            fb = fb.add_primary_secondary_columns(k)
+        return fb
+
+    def apply(self, fb: FB) -> FB:
+        '''
+        Filters fb according to the compiled exclusion_fields and
+        selection_fields, and makes any replacements given by dictionaries
+        in selection_fields. Equivalent to fb.select_by_fields() with the
+        same selection_fields and exclusion_fields.
+
+        :param fb: FlowBy dataset
+        :return: filtered FlowBy dataset
+        '''
+        if (not self.selects and not self.exclusions
+                and not self.conditional_exclusions):
+            return fb
+        fb = self.add_primary_columns(fb)
+        return self.take(fb, self.mask(fb))
+
+    def take(self, fb: FB, keep: np.ndarray) -> FB:
+        '''
+        Returns the rows of fb marked by keep (as returned by mask()), with
+        any replacements made. Primary... columns, and Secondary... columns
+        added for the selection, are dropped.
+
+        :param fb: FlowBy dataset
+        :param keep: numpy array of bool, of length len(fb)
+        :return: filtered FlowBy dataset
+        '''
+        if not self.selects:
+            return fb.take(np.flatnonzero(keep))
+
+        drop_columns = ['PrimaryActivity', 'PrimarySector',
+                        *[f'Secondary{k}' for k in self.primary_columns]]
+        filtered_fb = (fb[[c for c in fb.columns if c not in drop_columns]]
+                       .take(np.flatnonzero(keep))
+                       .reset_index(drop=True))
+        if filtered_fb.empty:
+            log.warning(f'{filtered_fb.full_name} FBA is empty')
+
+        replaced = {k: replace_values(filtered_fb[k], v)
+                    for k, v in self.replacements.items()}
+        # Reset blank values to nan
+        return filtered_fb.assign(**{k: np.nan if all(v == '') else v
+                                     for k, v in replaced.items()})
+
+
+def compile_selection(
+    selection_fields: dict = None,
+    exclusion_fields: dict = None
+) -> Selection:
+    '''
+    Compiles selection_fields and exclusion_fields dictionaries (as
+    described in _FlowBy.select_by_fields()) into a Selection. Use when the
+    same selection is applied to many datasets, e.g.:
+
+    selection = compile_selection({'FlowName': ['CO2', 'CH4']})
+    subsets = [selection.apply(fba) for fba in fbas]
+
+    :param selection_fields: dict, or None or 'null' to only apply
+        exclusion_fields
+    :param exclusion_fields: dict
+    :return: Selection, with .mask(fb) and .apply(fb) methods
+    '''
+    return Selection(selection_fields, exclusion_fields)
@@ -31,6 +31,12 @@ logoutputpath = outputpath / 'Log'
 diffpath = outputpath / 'FBSComparisons'
 plotoutputpath = outputpath / 'Plots'
 tableoutputpath = outputpath / 'DisplayTables'
+activitysetoutputpath = outputpath / 'FBSActivitySets'
+checkpointpath = outputpath / 'FBSCheckpoints'
+spillpath = outputpath / 'FBSSpill'
+referencecachepath = outputpath / 'ReferenceCache'
+referencebundlepath = outputpath / 'ReferenceBundle'
+registrypath = outputpath / 'MethodRegistry'
 
 # ensure directories exist
 mkdir_if_missing(logoutputpath)
@@ -39,6 +45,43 @@ mkdir_if_missing(tableoutputpath)
 
 DEFAULT_DOWNLOAD_IF_MISSING = False
 
+
+def _physical_memory() -> int:
+    """Bytes of physical memory, or 8 GiB where it can not be read"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        # e.g. on Windows, which has no sysconf
+        return 8 * 1024 ** 3
+
+
+# combined upper bound on memory used by the caches of caching.py, an
+# eighth of physical memory, split between the caches below
+CACHE_MAX_BYTES = _physical_memory() // 8
+# attribution sources after they are harmonized to the geoscale of the data
+# they attribute
+ATTRIBUTION_CACHE_MAX_BYTES = CACHE_MAX_BYTES * 2 // 10
+# attribution and clean sources, once prepared, for reuse by other activity
+# sets and sources of the same method
+PREPARED_SOURCE_CACHE_MAX_BYTES = CACHE_MAX_BYTES * 3 // 10
+# FBA and FBS datasets as loaded, and tables derived from reference data,
+# kept while generating FBS methods
+LOADED_DATASET_CACHE_MAX_BYTES = CACHE_MAX_BYTES * 3 // 10
+REFERENCE_TABLE_CACHE_MAX_BYTES = CACHE_MAX_BYTES // 10
+# crosswalks and other packaged reference data, as read from file, kept for
+# the life of the process
+REFERENCE_DATA_CACHE_MAX_BYTES = CACHE_MAX_BYTES // 10
+# whether tables derived from reference data that are costly to build, such
+# as naics.industry_spec_key(), are also saved to referencecachepath, to be
+# reused by later flowsa processes
+PERSIST_REFERENCE_CACHE = True
+# whether the csvs in datapath are loaded from a binary bundle of the
+# parsed tables in referencebundlepath (see refbundle.py)
+USE_REFERENCE_BUNDLE = True
+# number of buckets of flowables into which sources are written when
+# generating a FlowBySector with spill=True
+SPILL_BUCKETS = 16
+
 # paths to scripts
 scriptpath = MODULEPATH.parent / 'scripts'
 scriptsFBApath = scriptpath / 'FlowByActivity_Datasets'
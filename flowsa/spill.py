@@ -0,0 +1,170 @@
+"""
+Spills the prepared sources of a FlowBySector method to disk, so that the
+sources need not be held in memory together. Rows are written to a
+parquet dataset partitioned into buckets by a hash of Flowable. Because
+generateFlowBySector() only aggregates rows with the same Flowable, each
+bucket can then be finished on its own.
+"""
+
+import os
+import shutil
+import uuid
+import numpy as np
+import pandas as pd
+from flowsa import settings
+from flowsa.flowsa_log import log
+
+
+class SpillDataset:
+    """
+    Parquet dataset in a folder of settings.spillpath / method for each
+    run, so that concurrent runs of a method do not share files, with one
+    folder per bucket and one file per source in each bucket.
+    """
+    def __init__(self, method: str, buckets: int = None) -> None:
+        """
+        :param method: str, name of the FlowBySector method
+        :param buckets: int, number of buckets, defaults to
+            settings.SPILL_BUCKETS
+        """
+        self.path = (settings.spillpath / method /
+                     f'{os.getpid()}-{uuid.uuid4().hex[:8]}')
+        self.buckets_count = buckets or settings.SPILL_BUCKETS
+        self.sources = 0
+        self.units = set()
+        self.path.mkdir(parents=True)
+
+    def bucket_codes(self, fbs) -> np.ndarray:
+        """
+        Bucket of each row of fbs, from a hash of its Flowable
+        :param fbs: FlowBySector
+        :return: numpy array of int
+        """
+        flowable = fbs['Flowable']
+        if isinstance(flowable.dtype, pd.CategoricalDtype):
+            # hash each category once
+            hashes = np.append(
+                pd.util.hash_array(flowable.cat.categories.to_numpy(
+                    dtype=object)),
+                pd.util.hash_array(np.array([None], dtype=object)))
+            hashes = hashes[flowable.cat.codes.to_numpy()]
+        else:
+            hashes = pd.util.hash_array(flowable.to_numpy(dtype=object))
+        return (hashes % self.buckets_count).astype(int)
+
+    def append(self, name: str, fbs) -> None:
+        """
+        Writes the rows of a prepared source to their buckets.
+        :param name: str, source name
+        :param fbs: FlowBySector, prepared source
+        """
+        fbs = fbs.reset_index(drop=True)
+        self.units.update(fbs['Unit'].dropna().astype(str).unique())
+        codes = self.bucket_codes(fbs)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order],
+                                 np.arange(self.buckets_count + 1))
+        for bucket in range(self.buckets_count):
+            rows = order[bounds[bucket]:bounds[bucket + 1]]
+            if len(rows) == 0:
+                continue
+            folder = self.path / f'bucket={bucket}'
+            folder.mkdir(exist_ok=True)
+            fbs.take(rows).to_parquet(
+                folder / f'{self.sources:04d}-{name}.parquet', index=False)
+        self.sources += 1
+        log.info('Spilled %s to %s', name, self.path)
+
+    def buckets(self):
+        """
+        Yields the rows of each non-empty bucket, from all sources, in the
+        order the sources were appended.
+        :return: generator of FlowBySector
+        """
+        for bucket in range(self.buckets_count):
+            if not (self.path / f'bucket={bucket}').exists():
+                continue
+            log.info('Finishing bucket %s of %s', bucket + 1,
+                     self.buckets_count)
+            yield self.read(bucket)
+
+    def read(self, bucket: int = 0):
+        """
+        Reads the rows of one bucket, from all sources, in the order the
+        sources were appended.
+        :param bucket: int, bucket number
+        :return: FlowBySector, or None if no rows are in the bucket
+        """
+        from flowsa.flowby import concat_flowby
+        from flowsa.flowbysector import FlowBySector
+
+        folder = self.path / f'bucket={bucket}'
+        if not folder.exists():
+            return None
+        return concat_flowby(
+            FlowBySector(pd.read_parquet(folder / f))
+            for f in sorted(os.listdir(folder))
+        ).reset_index(drop=True)
+
+    def has_rates(self) -> bool:
+        """
+        Whether any row appended is a rate or ratio (its Unit contains
+        '/'), in which case aggregate_flowby() does not aggregate
+        :return: bool
+        """
+        return any('/' in unit for unit in self.units)
+
+    def remove(self) -> None:
+        """Deletes the dataset from disk"""
+        shutil.rmtree(self.path, ignore_errors=True)
+        try:
+            self.path.parent.rmdir()
+        except OSError:
+            # other runs of the method are spilling
+            pass
+
+
+def finish_spilled(prepared, method: str, method_config: dict,
+                   append_sector_names: bool = False, finish=None):
+    """
+    Spills the prepared sources of a method, then finishes generation one
+    bucket of flowables at a time. Whether rows are aggregated is decided
+    once for all sources, as when they are finished together, so the
+    result is the same apart from row order.
+    :param prepared: iterable of (source name, prepared FlowBySector)
+    :param method: str, name of the FlowBySector method
+    :param method_config: dict, method config
+    :param append_sector_names: bool, as in generateFlowBySector()
+    :param finish: function, optional, called as finish(bucket_fbs,
+        aggregate) in place of bucket_fbs._finish_generation(), as when
+        several methods are finished together (see multiyear.py)
+    :return: FlowBySector
+    """
+    from flowsa.flowby import concat_flowby
+
+    dataset = SpillDataset(method)
+    try:
+        for source_name, source_fbs in prepared:
+            dataset.append(source_name, source_fbs)
+        aggregate = not dataset.has_rates()
+        if not aggregate:
+            log.info('At least one row is a rate or ratio with units %s, '
+                     'finishing %s without aggregating',
+                     sorted(dataset.units), method)
+        if finish is None:
+            def finish(bucket_fbs, aggregate):
+                return bucket_fbs._finish_generation(
+                    method, method_config, append_sector_names,
+                    aggregate=aggregate)
+        fbs = concat_flowby(
+            finish(bucket_fbs, aggregate)
+            for bucket_fbs in dataset.buckets()
+        ).reset_index(drop=True)
+    finally:
+        dataset.remove()
+    fbs = fbs[[c for c in fbs.columns if not c.endswith('ByName')]
+              + [c for c in ['SectorProducedByName', 'SectorConsumedByName']
+                 if c in fbs.columns]]
+    fbs.full_name = method
+    fbs.config = method_config
+    return fbs
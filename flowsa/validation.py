@@ -449,6 +449,20 @@ def compare_national_state_fbs(dataname=None, year=None, method=None,
         state.config = load_yaml_dict(s, 'FBS')
     if national.config == {}:
         national.config = load_yaml_dict(n, 'FBS')
+
+    return compare_geoscale_fbs(national, state, compare_metasources)
+
+
+def compare_geoscale_fbs(national, state, compare_metasources=False):
+    """
+    Compares a national FBS to a state FBS, by sector and by flowable,
+    without loading either from file.
+
+    :param national: FlowBySector, national FBS
+    :param state: FlowBySector, state FBS
+    :param compare_metasources: bool, include MetaSources in the comparison
+    :return: tuple of dfs, comparison by sector and by flowable
+    """
     state_target = state.config['industry_spec']
 
     groupby_fields = ['Flowable','Context','SectorProducedBy', 'SectorConsumedBy',
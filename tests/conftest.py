@@ -0,0 +1,62 @@
+"""
+Fixtures shared by the unit tests of the FlowBy engines and caches
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def make_fbs():
+    """
+    Factory of small random FlowBySector datasets, at the national
+    geoscale, with 6-digit NAICS 2012 sectors
+    """
+    from flowsa.flowbysector import FlowBySector
+
+    def make(n=200, seed=0, units=('kg', 'MJ'), config=None):
+        rng = np.random.default_rng(seed)
+        df = pd.DataFrame({
+            'Flowable': rng.choice(['CO2', 'CH4', 'N2O', 'Water', 'Land'],
+                                   n),
+            'Class': 'Chemicals',
+            'SectorProducedBy': rng.choice(
+                ['111110', '111120', '221111', '325110', None], n),
+            'SectorConsumedBy': rng.choice([None, '221111', '111110'], n),
+            'SectorSourceName': 'NAICS_2012_Code',
+            'Context': 'emission/air',
+            'Location': '00000',
+            'LocationSystem': 'FIPS_2015',
+            'FlowAmount': rng.random(n) * 10,
+            'Unit': rng.choice(list(units), n),
+            'FlowType': 'ELEMENTARY_FLOW',
+            'Year': 2017,
+            'DataReliability': rng.choice([1.0, 2.0, np.nan], n),
+            'DataCollection': rng.random(n),
+            'MetaSources': rng.choice(['A', 'B'], n),
+        })
+        return FlowBySector(df, full_name='test', config={
+            'industry_spec': {'default': 'NAICS_6'},
+            'target_naics_year': 2012,
+            'geoscale': 'national',
+            **(config or {})})
+
+    return make
+
+
+def sorted_frame(df) -> pd.DataFrame:
+    """df as a plain DataFrame, with its rows in a canonical order"""
+    df = pd.DataFrame(df)
+    return (df.sort_values(list(df.columns),
+                           key=lambda s: s.astype(str))
+            .reset_index(drop=True))
+
+
+@pytest.fixture
+def assert_same_rows():
+    """Asserts that two FlowBy datasets are equal apart from row order"""
+    def check(actual, expected):
+        pd.testing.assert_frame_equal(sorted_frame(actual),
+                                      sorted_frame(expected),
+                                      check_dtype=False)
+    return check
@@ -0,0 +1,92 @@
+"""
+Test splitting a FlowByActivity into its activity sets in one pass, with
+rows assigned to several activity sets or to none
+"""
+import logging
+import pandas as pd
+import pytest
+from flowsa.flowbyactivity import FlowByActivity
+from flowsa.flowsa_log import log
+
+ACTIVITY_SETS = {
+    'corn': {'selection_fields': {'ActivityProducedBy': ['Corn']}},
+    # the Corn water withdrawal is also in corn
+    'water': {'selection_fields': {'FlowName': 'Water',
+                                   'ActivityProducedBy': ['Corn', 'Wheat']}},
+    'rice': {'selection_fields': {'PrimaryActivity': ['Rice']}},
+}
+
+
+def fba(activity_sets=None):
+    return FlowByActivity(pd.DataFrame({
+        'FlowName': ['Water', 'Water', 'Land', 'Water', 'Water'],
+        'ActivityProducedBy': ['Corn', 'Wheat', 'Corn', 'Rice', 'Soy'],
+        'FlowAmount': [1.0, 2.0, 3.0, 4.0, 5.0],
+        'Unit': 'kg',
+        'FlowType': 'ELEMENTARY_FLOW',
+        # an index that is not the row position
+    }, index=[10, 20, 30, 40, 50]), full_name='Source', config={
+        'activity_sets': activity_sets or ACTIVITY_SETS})
+
+
+@pytest.fixture
+def messages():
+    """Level and message of each record logged"""
+    records = []
+    handler = logging.Handler()
+    handler.emit = lambda record: records.append(
+        (record.levelname, record.getMessage()))
+    log.addHandler(handler)
+    yield records
+    log.removeHandler(handler)
+
+
+def test_subsets_equal_selecting_each_activity_set():
+    parent = fba().reset_index(drop=True)
+    for child, (name, config) in zip(fba()._split_activity_sets(),
+                                     ACTIVITY_SETS.items()):
+        expected = (parent.add_full_name(f'Source.{name}')
+                    .select_by_fields(config['selection_fields']))
+        assert child.full_name == f'Source.{name}'
+        assert (child['SourceName'] == f'Source.{name}').all()
+        pd.testing.assert_frame_equal(
+            pd.DataFrame(child),
+            pd.DataFrame(expected.assign(SourceName=f'Source.{name}')))
+        assert child.config['selection_fields'] == config['selection_fields']
+        assert 'activity_sets' not in child.config
+
+
+def test_rows_in_several_activity_sets_are_logged(messages):
+    fba()._split_activity_sets()
+    critical = [m for level, m in messages if level == 'CRITICAL']
+    assert len(critical) == 1
+    header, columns, *rows = critical[0].split('\n\n')[0].splitlines()
+    assert header == ('Some rows from Source assigned to multiple activity '
+                      'sets. This will lead to double-counting:')
+    # the row of the water set that is also in corn, by its original index
+    assert [row.split()[0] for row in rows] == ['10']
+    assert 'Source.water' in rows[0]
+
+
+def test_unassigned_rows_are_logged_once(messages):
+    fba()._split_activity_sets()
+    assert [m for level, m in messages if level == 'WARNING'] == [
+        'Some rows from Source not assigned to an activity set. '
+        'Is this intentional?']
+
+    messages.clear()
+    fba({**ACTIVITY_SETS,
+         'soy': {'selection_fields': {'ActivityProducedBy': ['Soy']}}}
+        )._split_activity_sets()
+    assert [level for level, _ in messages
+            if level in ['WARNING', 'CRITICAL']] == ['CRITICAL']
+
+
+def test_empty_activity_sets_are_dropped(messages):
+    sets = fba({**ACTIVITY_SETS,
+                'none': {'selection_fields': {'ActivityProducedBy': 'Oat'}}}
+               ).activity_sets()
+    assert [s.full_name for s in sets] == ['Source.corn', 'Source.water',
+                                           'Source.rice']
+    assert ('ERROR', 'Activity set Source.none is empty. Check activity set '
+            'definition!') in messages
@@ -0,0 +1,89 @@
+"""
+Test proportional attribution against a merge and groupby of the primary
+and attribution sources
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from flowsa.flowbyactivity import FlowByActivity
+from flowsa.flowbysector import FlowBySector
+
+COLUMNS = ['group_id', 'SectorProducedBy', 'SectorConsumedBy', 'Location',
+           'FlowAmount']
+
+
+def make_sources(seed, attribute_on=None):
+    rng = np.random.default_rng(seed)
+    n, m = 600, 400
+    sectors = [str(111110 + i) for i in range(20)]
+    locations = ['01000', '02000', '04000']
+    fba = FlowByActivity(pd.DataFrame({
+        # some rows have no group, and are in no group
+        'group_id': np.where(rng.random(n) < 0.1, np.nan,
+                             rng.integers(0, n // 3, n)),
+        'Flowable': rng.choice(['A', 'B'], n),
+        'SectorProducedBy': rng.choice(sectors, n),
+        'SectorConsumedBy': (rng.choice(sectors, n) if seed % 2
+                             else None),
+        'Location': rng.choice(locations, n),
+        'FlowAmount': rng.random(n) * 10,
+        'Unit': 'kg',
+        'Year': 2017,
+    }), full_name='primary', config={
+        'geoscale': 'state',
+        **({'attribute_on': attribute_on} if attribute_on else {})})
+    other = FlowBySector(pd.DataFrame({
+        'Flowable': rng.choice(['A', 'B'], m),
+        'SectorProducedBy': rng.choice(sectors, m),
+        'SectorConsumedBy': None,
+        'Location': rng.choice(locations, m),
+        'FlowAmount': np.where(rng.random(m) < 0.2, 0, rng.random(m)),
+        'Unit': 'p',
+        'Year': 2017,
+    }), full_name='other', config={'geoscale': 'state'})
+    return fba, other
+
+
+def reference(fba, other):
+    """
+    Proportional attribution by merging fb and other and summing the
+    denominator of each group_id with groupby
+    """
+    _, _, fb, other = fba.harmonize_geoscale(other)
+    fb, other = pd.DataFrame(fb), pd.DataFrame(other)
+    attribute_on = fba.config.get('attribute_on')
+    if attribute_on is None:
+        rank = ('Primary' if fb['SecondarySector'].isna().all()
+                else 'Secondary')
+        group_count = fb.groupby('group_id')['group_id'].transform('count')
+        direct = fb[group_count == 1]
+        fb = fb[group_count > 1]
+        left_on = [f'{rank}Sector', 'Location']
+        right_on = ['PrimarySector', 'Location']
+    else:
+        direct = fb.iloc[:0]
+        left_on = right_on = attribute_on + ['Location']
+    merged = (fb.merge(other, how='left', left_on=left_on, right_on=right_on,
+                       suffixes=[None, '_other'])
+              .fillna({'FlowAmount_other': 0}))
+    flow_other = merged['FlowAmount_other']
+    if attribute_on is None:
+        # each sector in a group counts towards the denominator once
+        flow_other = flow_other * ~merged.duplicated(
+            ['group_id', f'{rank}Sector'])
+    denominator = flow_other.groupby(merged['group_id']).transform('sum')
+    merged = merged.assign(
+        FlowAmount=merged['FlowAmount'] * merged['FlowAmount_other']
+        / denominator)
+    merged = merged[(denominator != 0) & (merged['FlowAmount_other'] != 0)]
+    return pd.concat([direct, merged])[COLUMNS]
+
+
+@pytest.mark.parametrize('attribute_on', [None, ['PrimarySector'],
+                                          ['Flowable', 'SectorProducedBy']])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_proportional_attribution_matches_merge(assert_same_rows, seed,
+                                                attribute_on):
+    fba, other = make_sources(seed, attribute_on)
+    attributed = fba.proportionally_attribute(other)
+    assert_same_rows(attributed[COLUMNS], reference(fba, other))
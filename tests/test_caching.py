@@ -0,0 +1,37 @@
+"""
+Test the caches kept during a generation run and for the life of the process
+"""
+import pandas as pd
+from flowsa import caching
+
+
+def test_saved_dataset_drops_what_was_loaded_from_it():
+    df = pd.DataFrame({'FlowAmount': [1.0, 2.0]})
+    with caching.generation_run():
+        caching.dataset_loaded(('FlowBySector', 'X', 'local'), df)
+        caching.dataset_loaded(('FlowBySector', 'Y', 'local'), df)
+        caching.prepared_sources.put('prepared with X', df)
+        caching.dataset_saved('FlowBySector', 'Z')
+        assert 'prepared with X' in caching.prepared_sources
+
+        caching.dataset_saved('FlowBySector', 'X')
+        assert ('FlowBySector', 'X', 'local') not in caching.loaded_datasets
+        assert ('FlowBySector', 'Y', 'local') in caching.loaded_datasets
+        assert 'prepared with X' not in caching.prepared_sources
+    assert len(caching.loaded_datasets) == 0
+
+
+def test_harmonized_source_reused_by_prepared_key(make_fbs, monkeypatch):
+    fb = make_fbs(50, seed=1)
+    other = make_fbs(50, seed=2)
+    object.__setattr__(other, 'prepared_key', ('key', None))
+    with caching.generation_run():
+        _, _, _, first = fb.harmonize_geoscale(other)
+
+        def fingerprint(*args, **kwargs):
+            raise AssertionError('keyed source fingerprinted')
+
+        monkeypatch.setattr(caching, 'fingerprint', fingerprint)
+        _, _, _, reused = fb.harmonize_geoscale(other)
+        assert caching.harmonized_sources.stats()['hits'] >= 1
+    pd.testing.assert_frame_equal(pd.DataFrame(first), pd.DataFrame(reused))
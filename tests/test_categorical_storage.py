@@ -0,0 +1,85 @@
+"""
+Test that categorical storage of FlowBy string fields gives the same
+results as object storage, and that outputs are written as object
+"""
+import io
+import numpy as np
+import pandas as pd
+import pytest
+import flowsa.flowbysector
+from flowsa.flowby import concat_flowby
+from flowsa.flowbysector import FlowBySector
+
+
+def fbs(storage, **columns):
+    return FlowBySector(pd.DataFrame({
+        'Flowable': ['CO2', 'CH4', 'CO2', 'N2O', 'CO2'],
+        'SectorProducedBy': ['111110', '221111', '111110', None, '325110'],
+        'Location': ['01001', '01003', '01000', '02001', None],
+        'FlowAmount': [1.0, 2.0, 3.0, 4.0, 5.0],
+        'Unit': 'kg',
+        **columns,
+    }), config={'categorical_storage': storage})
+
+
+def chain(storage):
+    selected = fbs(storage).select_by_fields(
+        {'Flowable': ['CO2', 'CH4'], 'Unit': {'kg': 'g'}})
+    aggregated = selected.convert_fips_to_geoscale('state').aggregate_flowby()
+    factors = pd.DataFrame({'SectorProducedBy': ['111110', '325110'],
+                            'Factor': [10.0, 100.0]})
+    merged = aggregated.merge(factors, how='left', on='SectorProducedBy')
+    merged = merged.assign(
+        FlowAmount=merged['FlowAmount'] * merged['Factor'].fillna(1)
+    ).drop(columns='Factor')
+    other = fbs(storage, Unit='g', Location='01000')
+    return concat_flowby([FlowBySector(merged), other]).aggregate_flowby()
+
+
+def test_chain_equals_object_storage():
+    categorical, plain = chain(True), chain(False)
+    for column in ['Location', 'Unit', 'SectorProducedBy']:
+        assert isinstance(categorical[column].dtype, pd.CategoricalDtype)
+        assert plain[column].dtype == object
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(categorical.convert_categoricals_to_object()),
+        pd.DataFrame(plain))
+
+
+@pytest.mark.parametrize('geoscale', ['national', 'state'])
+def test_location_stays_categorical_at_a_coarser_geoscale(geoscale):
+    converted = fbs(True).convert_fips_to_geoscale(geoscale)
+    assert isinstance(converted['Location'].dtype, pd.CategoricalDtype)
+    assert (converted['Location'].astype(object).tolist()
+            == fbs(False).convert_fips_to_geoscale(geoscale)[
+                'Location'].tolist())
+
+
+def test_new_category_assigned_in_place():
+    data = fbs(True)
+    data.loc[0, 'Unit'] = 'm3'
+    data.iloc[1, data.columns.get_loc('Location')] = '99999'
+    assert data['Unit'].tolist()[:2] == ['m3', 'kg']
+    # stored as categorical again by the next FlowBy constructed
+    stored = FlowBySector(data)
+    assert isinstance(stored['Unit'].dtype, pd.CategoricalDtype)
+    assert stored['Location'].astype(object).tolist()[1] == '99999'
+
+
+def test_outputs_are_written_as_object(monkeypatch):
+    written = {}
+    for storage in [True, False]:
+        buffer = io.BytesIO()
+        chain(storage).to_parquet(buffer)
+        written[storage] = buffer.getvalue()
+    assert written[True] == written[False]
+    assert (pd.read_parquet(io.BytesIO(written[True])).dtypes
+            != 'category').all()
+
+    monkeypatch.setattr(FlowBySector, 'return_FBS',
+                        lambda **kwargs: chain(True))
+    returned = flowsa.flowbysector.getFlowBySector('M')
+    assert type(returned) is pd.DataFrame
+    assert not any(isinstance(dtype, pd.CategoricalDtype)
+                   for dtype in returned.dtypes)
+    assert np.array_equal(returned['FlowAmount'], chain(False)['FlowAmount'])
@@ -0,0 +1,46 @@
+"""
+Test that sources prepared in parallel are checkpointed as they complete
+"""
+import json
+import pytest
+import flowsa.flowby
+from flowsa import settings
+from flowsa.flowbysector import FlowBySector
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_failing_source_keeps_earlier_checkpoints(make_fbs, tmp_path,
+                                                  monkeypatch, max_workers):
+    monkeypatch.setattr(settings, 'checkpointpath', tmp_path)
+
+    class Source:
+        def __init__(self, name):
+            self.name = name
+
+        def prepare_fbs(self, **kwargs):
+            if self.name == 'B':
+                raise RuntimeError('B failed')
+            return make_fbs(20)
+
+    def get_flowby_from_config(name, config, **kwargs):
+        return Source(name)
+
+    monkeypatch.setattr(flowsa.flowby, 'get_flowby_from_config',
+                        get_flowby_from_config)
+    monkeypatch.setattr(flowsa.flowbysector, 'get_flowby_from_config',
+                        get_flowby_from_config)
+    method_config = {
+        'industry_spec': {'default': 'NAICS_6'},
+        'target_naics_year': 2012,
+        'geoscale': 'national',
+        'source_names': {'A': {'data_format': 'FBS'},
+                         'B': {'data_format': 'FBS'}}}
+
+    with pytest.raises(RuntimeError, match='B failed'):
+        list(FlowBySector._prepare_sources('M', method_config,
+                                           max_workers=max_workers,
+                                           checkpoint=True))
+    with open(tmp_path / 'M' / 'manifest.json', encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert list(manifest['sources']) == ['A']
+    assert (tmp_path / 'M' / manifest['sources']['A']['file']).exists()
@@ -0,0 +1,37 @@
+"""
+Test explaining an FBS method without generating it
+"""
+import pandas as pd
+import pytest
+from flowsa import common, dryrun, settings
+
+
+@pytest.fixture
+def local_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.paths, 'local_path', str(tmp_path))
+    (tmp_path / 'FlowByActivity').mkdir()
+    return tmp_path
+
+
+def test_local_dataset_reads_rows_of_most_recent_parquet(local_path):
+    config = {'data_format': 'FBA', 'year': 2015}
+    assert common.local_dataset('USGS_NWIS_WU', config)['path'] is None
+    pd.DataFrame({'FlowAmount': [1.0] * 5}).to_parquet(
+        local_path / 'FlowByActivity' / 'USGS_NWIS_WU_2015_v2.0.0.parquet')
+    dataset = common.local_dataset('USGS_NWIS_WU', config)
+    assert dataset['file'] == 'USGS_NWIS_WU_2015'
+    assert dataset['rows'] == 5
+
+
+def test_explain_estimates_attributed_rows(local_path):
+    pd.DataFrame({'FlowAmount': [1.0] * 1000}).to_parquet(
+        local_path / 'FlowByActivity' / 'USGS_NWIS_WU_2015.parquet')
+    report = dryrun.explain('Water_national_2015_m1', print_report=False)
+    fan_out = report['sector_fan_out']
+    mean = (sum(f['codes'] * f['mean'] for f in fan_out.values())
+            / sum(f['codes'] for f in fan_out.values()))
+    source, = report['source_names']
+    assert source['rows'] == 1000
+    assert source['attributed_rows'] == round(1000 * mean)
+    assert report['attributed_rows'] == source['attributed_rows']
+    assert 'once attributed' in dryrun.format_report(report)
@@ -0,0 +1,107 @@
+"""
+Test which years of a method are generated together, and that a year
+generated with others is the same as when generated on its own
+"""
+import copy
+import esupy.processed_data_mgmt
+import pandas as pd
+import pytest
+import flowsa.flowby
+import flowsa.flowbysector
+from flowsa import common, multiyear, settings
+from flowsa.flowbysector import FlowBySector
+from flowsa.multiyear import generate_years, group_years, year_template
+
+
+def config(year, naics_year=2012, geoscale='national'):
+    return {'industry_spec': {'default': 'NAICS_6'},
+            'target_naics_year': naics_year,
+            'geoscale': geoscale,
+            'year': year,
+            'source_names': {f'BLS_QCEW_{year}': {'year': year}}}
+
+
+def test_year_template():
+    assert year_template(config(2015), 2015) == year_template(config(2016),
+                                                              2016)
+
+
+def test_years_differing_only_by_year_are_grouped():
+    assert group_years({2015: config(2015), 2016: config(2016),
+                        2017: config(2017, geoscale='state')}) == [
+        [2015, 2016], [2017]]
+
+
+def test_years_with_their_own_naics_year_are_not_grouped():
+    # equal once the year is replaced, but finished against different
+    # NAICS crosswalks
+    assert year_template(config(2012, 2012), 2012) == year_template(
+        config(2017, 2017), 2017)
+    assert group_years({2012: config(2012, 2012),
+                        2017: config(2017, 2017)}) == [[2012], [2017]]
+
+
+def source(name, config, **kwargs):
+    """Source of a synthetic method, whose flows depend on its year"""
+    year = config['year']
+    return FlowBySector(pd.DataFrame({
+        'Flowable': ['CO2', 'CO2', 'CH4', 'Land'],
+        'SectorProducedBy': ['111110', '111120', '221310', '111110'],
+        'Location': '00000',
+        'LocationSystem': 'FIPS_2015',
+        'FlowAmount': [year - 2000.0, 1.0, year % 7, 2.0],
+        'Unit': ['kg', 'kg', 'kg', 'm2/yr' if year == 2016 else 'm2'],
+        'FlowType': 'ELEMENTARY_FLOW',
+        'Year': year,
+    }), full_name=name, config=config)
+
+
+@pytest.fixture
+def outputs(tmp_path, monkeypatch):
+    """Parquet bytes of each FBS written, by name"""
+    written = {}
+
+    def write_df_to_file(df, paths, meta):
+        path = tmp_path / f'{meta.name_data}.parquet'
+        df.to_parquet(path)
+        written[meta.name_data] = path.read_bytes()
+
+    load = common.load_yaml_dict
+
+    def load_yaml_dict(name, *args, **kwargs):
+        if not name.startswith('M_'):
+            return load(name, *args, **kwargs)
+        year = int(name[2:])
+        return copy.deepcopy(
+            {**config(year),
+             'source_names': {f'Synthetic_{year}': {'year': year},
+                              'Other': {'year': year}}})
+
+    for module in [flowsa.flowby, flowsa.flowbysector]:
+        monkeypatch.setattr(module, 'get_flowby_from_config', source)
+    monkeypatch.setattr(FlowBySector, 'prepare_fbs',
+                        lambda self, **kwargs: self)
+    monkeypatch.setattr(common, 'load_yaml_dict', load_yaml_dict)
+    monkeypatch.setattr(multiyear, 'load_yaml_dict', load_yaml_dict)
+    monkeypatch.setattr(esupy.processed_data_mgmt, 'write_df_to_file',
+                        write_df_to_file)
+    monkeypatch.setattr(flowsa.metadata, 'write_metadata',
+                        lambda **kwargs: None)
+    monkeypatch.setattr(flowsa.flowbysector, 'reset_log_file',
+                        lambda *args: None)
+    monkeypatch.setattr(settings, 'checkpointpath', tmp_path / 'checkpoint')
+    monkeypatch.setattr(settings, 'spillpath', tmp_path / 'spill')
+    return written
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'spill': True},
+                                    {'checkpoint': True}],
+                         ids=['in memory', 'spill', 'checkpoint'])
+def test_years_generated_together_equal_each_year_alone(outputs, kwargs):
+    generated = generate_years('M_{year}', [2015, 2016], **kwargs)
+    together = dict(outputs)
+    assert sorted(together) == sorted(generated) == ['M_2015', 'M_2016']
+    outputs.clear()
+    for name in together:
+        FlowBySector.generateFlowBySector(name, **kwargs)
+    assert outputs == together
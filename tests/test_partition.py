@@ -0,0 +1,113 @@
+"""
+Test that preparing a source one state at a time gives the same result as
+preparing it whole, with a national attribution source shared by every
+state
+"""
+import logging
+import os
+import pandas as pd
+import pytest
+import flowsa.flowby
+from flowsa import caching, partition, settings
+from flowsa.flowbyactivity import FlowByActivity
+from flowsa.flowbysector import FlowBySector
+
+SECTORS = ['111110', '111120', '111130', '111140', '111150', '111160']
+KWARGS = {'download_sources_ok': False,
+          'drop_cols': ['ActivityProducedBy', 'ActivityConsumedBy']}
+
+
+class Employment(FlowBySector):
+    """National attribution source, prepared as loaded"""
+    def prepare_fbs(self, **kwargs):
+        return self
+
+
+@pytest.fixture
+def loaded(tmp_path, monkeypatch):
+    """Names of the attribution sources loaded"""
+    monkeypatch.setattr(settings, 'spillpath', tmp_path / 'spill')
+    names = []
+
+    def get_flowby_from_config(name, config, **kwargs):
+        names.append(name)
+        return Employment(pd.DataFrame({
+            'Flowable': 'Jobs',
+            'SectorProducedBy': SECTORS,
+            'Location': '00000',
+            'FlowAmount': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+            'Unit': 'p',
+            'Year': 2012,
+            'SectorSourceName': 'NAICS_2012_Code',
+        }), full_name=name, config=config)
+
+    monkeypatch.setattr(flowsa.flowby, 'get_flowby_from_config',
+                        get_flowby_from_config)
+    return names
+
+
+def fail_in_california(fbs):
+    if (fbs['Location'] == '06000').any():
+        raise ValueError('California')
+    return fbs
+
+
+def fba(**config):
+    return FlowByActivity(pd.DataFrame({
+        'Flowable': 'Water',
+        # NAICS activities, attributed to their 6-digit sectors
+        'ActivityProducedBy': ['1111', '1111', '1111', '11115', '1111'],
+        'ActivityConsumedBy': None,
+        'Location': ['01000', '06000', '01000', '06000', '48000'],
+        'FlowAmount': [10.0, 20.0, 30.0, 40.0, 50.0],
+        'Unit': 'kg',
+        'Year': 2012,
+        'SourceName': 'Source',
+        'FlowType': 'ELEMENTARY_FLOW',
+        'Class': 'Water',
+    }), full_name='Source', config={
+        'data_format': 'FBA',
+        'activity_schema': 'NAICS_2012_Code',
+        'industry_spec': {'default': 'NAICS_6'},
+        'target_naics_year': 2012,
+        'geoscale': 'state',
+        'year': 2012,
+        'attribution_method': 'proportional',
+        'attribution_source': {'Employment': {'geoscale': 'national'}},
+        'method_config_keys': ['industry_spec', 'target_naics_year'],
+        'cache': {},
+        **config})
+
+
+def prepare(source, max_workers=None):
+    with caching.generation_run():
+        if max_workers is None:
+            return source.attribute_and_aggregate(**KWARGS)
+        return partition.prepare_by_state(source, KWARGS, max_workers)
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_partitioned_equals_unpartitioned(loaded, caplog, max_workers):
+    whole = prepare(fba())
+    assert loaded == ['Employment']
+    by_state = prepare(fba(), max_workers)
+    # loaded once, and shared by the three states
+    assert loaded == ['Employment', 'Employment']
+    assert type(by_state) is type(whole)
+    assert by_state.full_name == whole.full_name
+    assert by_state.config == whole.config
+    assert sorted(by_state['Location'].unique()) == [
+        '01000', '06000', '48000']
+    pd.testing.assert_frame_equal(pd.DataFrame(by_state),
+                                  pd.DataFrame(whole))
+    # each state is attributed without validation errors, as the whole is
+    assert not [r for r in caplog.records if r.levelno >= logging.ERROR]
+    assert os.listdir(settings.spillpath) == []
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_spilled_states_removed_after_a_failure(loaded, max_workers):
+    with pytest.raises(ValueError, match='California'):
+        prepare(fba(clean_fbs_after_aggregation=fail_in_california),
+                max_workers)
+    assert os.listdir(settings.spillpath) == []
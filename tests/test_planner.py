@@ -0,0 +1,208 @@
+"""
+Test the planning of FBS sources and the worker processes preparing them
+"""
+import copy
+import io
+import logging
+import esupy.processed_data_mgmt
+import pandas as pd
+import pytest
+import flowsa.flowby
+import flowsa.flowbysector
+from flowsa import caching, common, planner
+from flowsa.flowbysector import FlowBySector
+from flowsa.flowsa_log import log, vlog
+
+
+def square(x):
+    if x < 0:
+        raise ValueError(f'negative: {x}')
+    return x * x
+
+
+def test_run_in_workers_yields_in_task_order():
+    results = planner.run_in_workers(square, [(x,) for x in range(10)], 3)
+    assert list(results) == [x * x for x in range(10)]
+
+
+def test_run_in_workers_submits_a_bounded_window():
+    taken = []
+
+    def tasks():
+        for x in range(10):
+            taken.append(x)
+            yield (x,)
+
+    results = planner.run_in_workers(square, tasks(), 2)
+    assert next(results) == 0
+    # the first two tasks, and one more once the first was consumed
+    assert len(taken) == 3
+    assert list(results) == [x * x for x in range(1, 10)]
+
+
+def test_run_in_workers_yields_results_before_a_failure():
+    consumed = []
+    with pytest.raises(ValueError, match='negative: -1'):
+        for result in planner.run_in_workers(
+                square, [(1,), (2,), (-1,), (3,)], 2):
+            consumed.append(result)
+    assert consumed == [1, 4]
+
+
+def test_primary_source_prepared_once_as_attribution_source(
+        make_fbs, tmp_path, monkeypatch):
+    # prepare_fbs() calls are recorded in a file, to count those made in
+    # worker processes
+    calls = tmp_path / 'calls'
+
+    class Source:
+        def __init__(self, name):
+            self.name = name
+
+        def prepare_fbs(self, **kwargs):
+            with open(calls, 'a', encoding='utf-8') as f:
+                f.write(f'{self.name}\n')
+            return make_fbs(20)
+
+    def get_flowby_from_config(name, config, **kwargs):
+        return Source(name)
+
+    monkeypatch.setattr(flowsa.flowby, 'get_flowby_from_config',
+                        get_flowby_from_config)
+    monkeypatch.setattr(flowsa.flowbysector, 'get_flowby_from_config',
+                        get_flowby_from_config)
+    method_config = {
+        'industry_spec': {'default': 'NAICS_6'},
+        'target_naics_year': 2012,
+        'geoscale': 'national',
+        'source_names': {'A': {'attribution_method': 'proportional',
+                               'attribution_source': 'B'},
+                         'B': {}}}
+
+    with caching.generation_run():
+        prepared = dict(FlowBySector._prepare_sources(
+            'M', method_config, max_workers=2))
+    assert list(prepared) == ['A', 'B']
+    assert sorted(calls.read_text().split()) == ['A', 'B']
+
+
+class Source:
+    """Source of a synthetic method, which logs as it is prepared, and
+    fails if its config says so"""
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+
+    def prepare_fbs(self, **kwargs):
+        log.info('Preparing %s', self.name)
+        vlog.info('Validating %s', self.name)
+        if self.config.get('fail'):
+            raise ValueError(f'{self.name} failed')
+        cached = self.config.get('cache', {}).get('Cached')
+        return FlowBySector(pd.DataFrame({
+            'Flowable': [self.name, self.name, 'Water'],
+            'SectorProducedBy': ['111110', '111120', '221310'],
+            'Location': '00000',
+            'LocationSystem': 'FIPS_2015',
+            'FlowAmount': [1.0, 2.0, 0 if cached is None else len(cached)],
+            'Unit': 'kg',
+            'FlowType': 'ELEMENTARY_FLOW',
+            'Year': 2017,
+        }), full_name=self.name, config=self.config)
+
+
+@pytest.fixture
+def synthetic_method(tmp_path, monkeypatch):
+    """
+    Runs generateFlowBySector() on a method of Source datasets, and
+    returns the bytes of the parquet written and the records of log and
+    vlog written by the sources
+    """
+    def get_flowby_from_config(name, config, **kwargs):
+        return Source(name, config)
+
+    def write_df_to_file(df, paths, meta):
+        df.to_parquet(tmp_path / f'{meta.name_data}.parquet')
+
+    for module in [flowsa.flowby, flowsa.flowbysector]:
+        monkeypatch.setattr(module, 'get_flowby_from_config',
+                            get_flowby_from_config)
+    monkeypatch.setattr(esupy.processed_data_mgmt, 'write_df_to_file',
+                        write_df_to_file)
+    monkeypatch.setattr(flowsa.metadata, 'write_metadata',
+                        lambda **kwargs: None)
+    monkeypatch.setattr(flowsa.flowbysector, 'reset_log_file',
+                        lambda *args: None)
+
+    def generate(source_names, max_workers, messages):
+        method_config = {
+            'industry_spec': {'default': 'NAICS_6'},
+            'target_naics_year': 2012,
+            'geoscale': 'national',
+            'sources_to_cache': {'Cached': {}},
+            'source_names': source_names}
+        monkeypatch.setattr(common, 'load_yaml_dict',
+                            lambda *args, **kwargs:
+                            copy.deepcopy(method_config))
+        handler = logging.Handler()
+
+        def emit(record):
+            # the messages of the sources, and whether they were written
+            # to the validation log
+            if record.getMessage().split()[1:2] in [[name] for name
+                                                     in source_names]:
+                messages.append((record.name, record.getMessage()))
+
+        handler.emit = emit
+        log.addHandler(handler)
+        try:
+            with caching.generation_run():
+                FlowBySector.generateFlowBySector(
+                    'M', max_workers=max_workers)
+        finally:
+            log.removeHandler(handler)
+        return (tmp_path / 'M.parquet').read_bytes()
+
+    return generate
+
+
+def source_messages(names):
+    return [(logger, f'{verb} {name}') for name in names
+            for logger, verb in [('flowsa', 'Preparing'),
+                                 ('flowsa.validation', 'Validating')]]
+
+
+def test_parallel_generation_equals_sequential(synthetic_method):
+    source_names = {'A': {}, 'B': {}, 'C': {}}
+    sequential, parallel = [], []
+    parquet = synthetic_method(source_names, 1, sequential)
+    assert synthetic_method(source_names, 3, parallel) == parquet
+    assert sequential == parallel == source_messages('ABC')
+    # the sources_to_cache are available to the sources in the workers
+    assert pd.read_parquet(io.BytesIO(parquet)).query(
+        'Flowable == "Water"')['FlowAmount'].tolist() == [9.0]
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_first_failure_raised_after_its_logs(synthetic_method, max_workers):
+    messages = []
+    with pytest.raises(ValueError, match='B failed'):
+        synthetic_method({'A': {}, 'B': {'fail': True},
+                          'C': {'fail': True}, 'D': {}},
+                         max_workers, messages)
+    assert messages == source_messages('AB')
+
+
+def test_cached_sources_are_not_sent_to_workers(monkeypatch):
+    def get_flowby_from_config(name, config, **kwargs):
+        return Source(name, config)
+
+    monkeypatch.setattr(flowsa.flowby, 'get_flowby_from_config',
+                        get_flowby_from_config)
+    cache = {'Cached': Source('Cached', {}).prepare_fbs()}
+    results = list(planner.prepare_in_parallel(
+        [(name, {'cache': cache}, {}, {}, {}) for name in 'AB'],
+        cache, 2))
+    # the cache of the parent, not a copy pickled with the results
+    assert all(fbs.config['cache'] is cache for fbs in results)
+    assert [fbs['FlowAmount'].iloc[2] for fbs in results] == [3.0, 3.0]
@@ -0,0 +1,52 @@
+"""
+Test that the index of FBA method years follows the files each yaml includes
+"""
+import pytest
+import flowsa.common
+from flowsa import flowsa_yaml, registry, settings
+
+
+@pytest.fixture
+def sourceconfigpath(tmp_path, monkeypatch):
+    folder = tmp_path / 'flowbyactivitymethods'
+    folder.mkdir()
+    for module in [settings, flowsa.common]:
+        monkeypatch.setattr(module, 'sourceconfigpath', folder)
+    monkeypatch.setattr(settings, 'registrypath', tmp_path / 'registry')
+    registry.clear()
+    flowsa_yaml.clear_cache()
+    yield folder
+    registry.clear()
+    flowsa_yaml.clear_cache()
+
+
+def test_fba_years_follow_included_files(sourceconfigpath):
+    (sourceconfigpath / 'Source_Common.yaml').write_text(
+        'years: [2017]\n')
+    (sourceconfigpath / 'Source_A.yaml').write_text(
+        '!include:Source_Common.yaml\nauthor: A\n')
+    assert registry.fba_years() == {'Source_A': [2017]}
+
+    (sourceconfigpath / 'Source_Common.yaml').write_text(
+        'years: [2017, 2018]\n')
+    assert registry.fba_years() == {'Source_A': [2017, 2018]}
+
+    # as in a new process, from the years saved to registrypath
+    registry.clear()
+    flowsa_yaml.clear_cache()
+    (sourceconfigpath / 'Source_Common.yaml').write_text(
+        'years: [2017, 2018, 2019]\n')
+    assert registry.fba_years() == {'Source_A': [2017, 2018, 2019]}
+
+
+def test_fba_years_reused_from_registrypath(sourceconfigpath, monkeypatch):
+    (sourceconfigpath / 'Source_A.yaml').write_text('years: [2012]\n')
+    assert registry.fba_years() == {'Source_A': [2012]}
+    registry.clear()
+    flowsa_yaml.clear_cache()
+
+    def load_yaml_dict(*args, **kwargs):
+        raise AssertionError('unchanged yaml parsed again')
+
+    monkeypatch.setattr(flowsa.common, 'load_yaml_dict', load_yaml_dict)
+    assert registry.fba_years() == {'Source_A': [2012]}
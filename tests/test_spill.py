@@ -0,0 +1,55 @@
+"""
+Test that finishing FBS generation from spilled buckets gives the same
+result as finishing it in memory
+"""
+import pytest
+from flowsa import settings
+from flowsa.flowby import concat_flowby
+from flowsa.spill import SpillDataset, finish_spilled
+
+
+@pytest.fixture(autouse=True)
+def spillpath(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'spillpath', tmp_path / 'spill')
+    monkeypatch.setattr(settings, 'SPILL_BUCKETS', 3)
+    return tmp_path / 'spill'
+
+
+def finish_both(make_fbs, rates):
+    def source(seed):
+        fbs = make_fbs(300, seed=seed)
+        if rates:
+            # only one flowable, so in one bucket, is a rate
+            fbs.loc[fbs['Flowable'] == 'Land', 'Unit'] = 'm2/yr'
+        return fbs
+
+    def sources():
+        return [(name, source(seed))
+                for seed, name in enumerate(['A', 'B', 'C'])]
+    config = sources()[0][1].config
+    in_memory = concat_flowby(fbs for _, fbs in sources())._finish_generation(
+        'M', config)
+    spilled = finish_spilled(sources(), 'M', config)
+    return in_memory, spilled
+
+
+@pytest.mark.parametrize('rates', [False, True])
+def test_spill_matches_in_memory(make_fbs, assert_same_rows, rates):
+    in_memory, spilled = finish_both(make_fbs, rates)
+    assert list(spilled.columns) == list(in_memory.columns)
+    assert_same_rows(spilled, in_memory)
+
+
+def test_spill_rate_units_are_not_aggregated(make_fbs):
+    # buckets without the rate unit are not aggregated either
+    in_memory, spilled = finish_both(make_fbs, True)
+    assert len(spilled) == len(in_memory) == 900
+
+
+def test_spill_runs_do_not_share_files(spillpath):
+    first, second = SpillDataset('M'), SpillDataset('M')
+    assert first.path != second.path
+    first.remove()
+    assert second.path.exists()
+    second.remove()
+    assert not (spillpath / 'M').exists()
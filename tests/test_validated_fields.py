@@ -0,0 +1,117 @@
+"""
+Test that FlowBy fields already normalized are not normalized again, and
+that fields whose values may have changed are
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from flowsa.flowby import concat_flowby
+from flowsa.flowbysector import FlowBySector
+
+
+@pytest.fixture
+def fbs():
+    return FlowBySector(pd.DataFrame({
+        'Flowable': ['CO2', 'CH4'],
+        'Class': ['Chemicals', 'Chemicals'],
+        'SectorProducedBy': ['111110', '221111'],
+        'FlowAmount': [1.0, 2.0],
+        'Unit': 'kg',
+    }))
+
+
+@pytest.fixture
+def normalized(monkeypatch):
+    """Fields normalized by FlowBy.__init__(), which fills them first"""
+    fields = []
+    fillna = pd.DataFrame.fillna
+
+    def counted(self, value=None, *args, **kwargs):
+        if isinstance(value, dict):
+            fields.extend(value)
+        return fillna(self, value, *args, **kwargs)
+
+    monkeypatch.setattr(pd.DataFrame, 'fillna', counted)
+    return fields
+
+
+def test_only_assigned_fields_are_normalized_again(fbs, normalized):
+    assert FlowBySector(fbs).equals(fbs)
+    assert normalized == []
+    fbs['Class'] = ['None', 'Energy']
+    assert 'Class' not in fbs.validated_fields
+    assert FlowBySector(fbs)['Class'].tolist()[1] == 'Energy'
+    assert pd.isna(FlowBySector(fbs)['Class'].iloc[0])
+    assert set(normalized) == {'Class'}
+
+
+@pytest.mark.parametrize('write', [
+    lambda fbs: fbs.loc.__setitem__((0, 'Class'), 'None'),
+    lambda fbs: fbs.iloc.__setitem__(
+        (0, fbs.columns.get_loc('Class')), 'None'),
+    lambda fbs: fbs.at.__setitem__((0, 'Class'), 'None'),
+    lambda fbs: fbs.iat.__setitem__(
+        (0, fbs.columns.get_loc('Class')), 'None'),
+    lambda fbs: fbs.replace({'Class': {'Chemicals': ''}}, inplace=True),
+    lambda fbs: fbs.where(fbs['FlowAmount'] > 1, inplace=True),
+], ids=['loc', 'iloc', 'at', 'iat', 'replace', 'where'])
+def test_fields_written_in_place_are_normalized_again(fbs, write):
+    write(fbs)
+    assert fbs.validated_fields == {}
+    renormalized = FlowBySector(fbs)
+    assert pd.isna(renormalized['Class'].iloc[0])
+    assert not renormalized['FlowAmount'].isna().any()
+
+
+def test_reading_through_an_indexer_keeps_the_fields(fbs):
+    fields = dict(fbs.validated_fields)
+    assert len(fbs.loc[fbs['FlowAmount'] > 1]) == 1
+    assert fbs.at[0, 'Class'] == 'Chemicals'
+    assert fbs.validated_fields == fields
+
+
+def test_fields_kept_only_by_methods_that_keep_values(fbs):
+    assert fbs.sort_values('FlowAmount', ascending=False).validated_fields \
+        == fbs.validated_fields
+    assert fbs.copy().validated_fields == fbs.validated_fields
+    assert fbs.replace('Chemicals', 'None').validated_fields == {}
+    assert pd.isna(FlowBySector(fbs.replace('Chemicals', 'None'))[
+        'Class']).all()
+
+
+@pytest.mark.parametrize('how', ['left', 'inner', 'outer'])
+def test_merge_keeps_the_left_fields_not_in_right(fbs, how):
+    right = pd.DataFrame({'Flowable': ['CO2'], 'Class': ['None']})
+    merged = fbs.merge(right, how=how, on='Flowable',
+                       suffixes=('_left', ''))
+    if how == 'outer':
+        assert merged.validated_fields == {}
+    else:
+        assert 'Flowable' in merged.validated_fields
+        assert 'FlowAmount' in merged.validated_fields
+        # Class is taken from right, and may hold any value
+        assert 'Class' not in merged.validated_fields
+        assert pd.isna(FlowBySector(merged)['Class']).all()
+
+
+def test_concat_keeps_the_fields_validated_in_every_dataset(fbs):
+    changed = fbs.copy()
+    changed['Class'] = 'None'
+    combined = concat_flowby([fbs, changed])
+    assert 'Class' not in combined.validated_fields
+    assert set(fbs.validated_fields) - set(combined.validated_fields) == {
+        'Class'}
+    assert FlowBySector(combined)['Class'].isna().tolist() == [
+        False, False, True, True]
+
+
+def test_function_socket_clears_the_fields(fbs):
+    def clean(fb):
+        # writes to the underlying array, which the FlowBy cannot track
+        fb['FlowAmount'].to_numpy()[0] = np.nan
+        return fb
+
+    fbs.config = {'clean_fba': clean}
+    cleaned = fbs.function_socket('clean_fba')
+    assert cleaned.validated_fields == {}
+    assert FlowBySector(cleaned)['FlowAmount'].tolist() == [0.0, 2.0]